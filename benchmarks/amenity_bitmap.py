@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+"""Compares amenity membership queries on a scan and on the bitmap index.
+
+Usage: ./benchmarks/amenity_bitmap.py [places [amenities]]
+
+Builds `places` places (1,000,000 by default), each holding 10 of
+`amenities` amenity ids (200 by default) drawn at random, then times each
+query both ways and prints the seconds per query:
+
+    scan:   walk every place's amenity_ids list, as callers do today
+    bitmap: BitmapIndex, combining one bitmap per amenity
+
+"count" rows only ask for the number of matches, which the bitmap answers
+without building the list of places.
+"""
+
+from types import SimpleNamespace
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.engine.indexes import BitmapIndex
+
+
+def make_places(count, amenities):
+    """Returns `count` place stand-ins with 10 random amenity ids each"""
+    random.seed(0)
+    ids = ["amenity-{}".format(i) for i in range(amenities)]
+    return [SimpleNamespace(id="place-{}".format(i),
+                            amenity_ids=random.sample(ids, 10))
+            for i in range(count)]
+
+
+def scan(places, all_of=(), any_of=(), none_of=()):
+    """Selects the matching places by walking every amenity list"""
+    return [place for place in places
+            if all(a in place.amenity_ids for a in all_of) and
+            (not any_of or any(a in place.amenity_ids for a in any_of)) and
+            not any(a in place.amenity_ids for a in none_of)]
+
+
+def timed(function, *args, **kwargs):
+    """Returns the result of a call and the seconds it took"""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    amenities = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    places = make_places(count, amenities)
+    index = BitmapIndex("amenity_ids")
+    _, elapsed = timed(lambda: [index.add(place) for place in places])
+    print("indexed {:,} places in {:.2f} s".format(count, elapsed))
+    queries = (
+        ("1 AND 2", {"all_of": ["amenity-1", "amenity-2"]}),
+        ("1 AND 2 AND 3", {"all_of": ["amenity-1", "amenity-2",
+                                      "amenity-3"]}),
+        ("1 OR 2", {"any_of": ["amenity-1", "amenity-2"]}),
+        ("1 AND NOT 2", {"all_of": ["amenity-1"],
+                         "none_of": ["amenity-2"]}),
+    )
+    print("{:<16} {:<6} {:>9} {:>10} {:>10} {:>8}".format(
+        "query", "kind", "matches", "scan s", "bitmap s", "speedup"))
+    for name, query in queries:
+        expected, scan_time = timed(scan, places, **query)
+        found, list_time = timed(index.lookup, **query)
+        number, count_time = timed(index.count, **query)
+        assert [place.id for place in found] == \
+            [place.id for place in expected]
+        assert number == len(expected)
+        for kind, elapsed in (("list", list_time), ("count", count_time)):
+            print("{:<16} {:<6} {:>9,} {:>10.4f} {:>10.4f} {:>7.0f}x".format(
+                name, kind, number, scan_time, elapsed, scan_time / elapsed))
@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Compares reloading through the model constructors with FileStorage.hydrate.
+
+Usage: ./benchmarks/hydrate.py [count ...]
+
+For each count (100,000 and 1,000,000 by default) the same records are
+turned into registered objects twice and the objects per second printed:
+
+    constructor: eval(class_name)(**item) then storage.new(), as reload
+                 used to do
+    hydrate:     storage.hydrate(), registry lookup, __new__ and
+                 fromisoformat with the garbage collector paused
+"""
+
+from datetime import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+
+from models import storage
+from models.base_model import BaseModel
+from models.user import User
+from models.state import State
+from models.city import City
+from models.place import Place
+from models.amenity import Amenity
+from models.review import Review
+
+
+def make_records(count):
+    """Returns `count` encoded records of every model class"""
+    classes = (User, State, City, Place, Amenity, Review)
+    stamp = datetime(2024, 2, 21, 10, 30, 0, 123456)
+    lines = []
+    for i in range(count):
+        obj = classes[i % len(classes)]()
+        obj.__dict__.update(name="Object {}".format(i), created_at=stamp,
+                            updated_at=stamp)
+        lines.append(json.dumps(obj.to_dict()))
+    storage.reload()
+    return lines
+
+
+def constructor(items):
+    """Registers the records through the model constructors"""
+    for item in items:
+        class_name = item["__class__"]
+        del item["__class__"]
+        storage.new(eval(class_name)(**item))
+
+
+def hydrate(items):
+    """Registers the records through FileStorage.hydrate"""
+    storage.hydrate(items)
+
+
+if __name__ == "__main__":
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    print("{:>9} {:<12} {:>10} {:>14}".format(
+        "records", "path", "seconds", "objects/s"))
+    for count in counts:
+        lines = make_records(count)
+        for name, load in (("constructor", constructor), ("hydrate", hydrate)):
+            items = [json.loads(line) for line in lines]
+            start = time.perf_counter()
+            load(items)
+            elapsed = time.perf_counter() - start
+            print("{:>9} {:<12} {:>10.2f} {:>14,.0f}".format(
+                count, name, elapsed, count / elapsed))
+            del items
+            storage.reload()
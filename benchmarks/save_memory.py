@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+"""Compares the peak memory of FileStorage.save strategies.
+
+Usage: ./benchmarks/save_memory.py [count]
+
+Each strategy runs in its own process over `count` Place objects
+(1,000,000 by default) and reports the resident memory added by the save:
+
+    dict:   the former save, building a dict of every to_dict() copy and
+            handing it to json.dump
+    cached: the streaming save, keeping the encoded fragments
+    stream: the streaming save with the fragment cache turned off
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def current_rss():
+    """Returns the resident memory of the process in MiB"""
+    with open("/proc/self/statm") as file_0:
+        pages = int(file_0.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def run(mode, count):
+    """Saves `count` objects with the given strategy and prints the result
+
+    Args:
+        mode (str): one of "dict", "cached" or "stream"
+        count (int): number of Place objects to create
+    """
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, ROOT)
+    from models import storage
+    from models.place import Place
+
+    for i in range(count):
+        Place().__dict__.update(name="Place {}".format(i),
+                                price_by_night=i % 300)
+    before = current_rss()
+    start = time.perf_counter()
+    if mode == "dict":
+        objects = storage.all()
+        obj_dict = {key: objects[key].to_dict() for key in objects}
+        with open("file.json", "w") as file_0:
+            json.dump(obj_dict, file_0)
+    else:
+        storage.fragment_cache(mode == "cached")
+        storage.save()
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print("{:<7} {:>10.2f}s {:>10.1f} MiB {:>10.1f} MiB".format(
+        mode, elapsed, before, peak - before))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        run(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print("{} objects".format(count))
+    print("{:<7} {:>11} {:>14} {:>14}".format(
+        "mode", "save", "rss before", "save peak"))
+    for mode in ("dict", "cached", "stream"):
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        "--child", mode, str(count)], check=True)
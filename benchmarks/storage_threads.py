@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+"""Measures FileStorage throughput under contention from worker threads.
+
+Usage: ./benchmarks/storage_threads.py [operations [places]]
+
+Loads `places` places (10,000 by default) into a storage in a temporary
+directory, then runs `operations` operations (40,000 by default) split
+between 1, 4, 16 and 64 threads, and prints the operations per second:
+
+    show:   get a random place and build its string (70%)
+    update: set the price of a random place (20%)
+    create: create a place (10%)
+
+Every 5,000th operation also saves the storage. Each thread count runs
+twice: in thread-safe mode, and without it, where saves can fail with
+"dictionary changed size during iteration" as other threads create
+places; the failed operations are counted as errors.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from itertools import count
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import storage
+from models.engine.file_storage import FileStorage
+from models.place import Place
+
+SAVE_EVERY = 5000
+
+
+def worker(operations, ids, counter, errors, seed):
+    """Runs a share of the operations, counting the ones that fail"""
+    chance = random.Random(seed)
+    for i in range(operations):
+        try:
+            roll = chance.random()
+            if roll < 0.7:
+                str(storage.get("Place", chance.choice(ids)))
+            elif roll < 0.9:
+                storage.get("Place", chance.choice(ids)).price_by_night = i
+            else:
+                ids.append(Place().id)
+            if next(counter) % SAVE_EVERY == SAVE_EVERY - 1:
+                storage.save()
+        except Exception:
+            errors.append(sys.exc_info()[1])
+
+
+def run(threads, operations, places, thread_safe):
+    """Returns the operations per second and the errors of one run"""
+    storage.thread_safe(False)
+    storage.reload()
+    ids = [Place().id for i in range(places)]
+    storage.save()
+    storage.thread_safe(thread_safe)
+    counter = count()
+    errors = []
+    workers = [threading.Thread(target=worker,
+                                args=(operations // threads, ids, counter,
+                                      errors, seed))
+               for seed in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return operations // threads * threads / elapsed, len(errors)
+
+
+if __name__ == "__main__":
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    places = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    tmp_dir = tempfile.mkdtemp()
+    FileStorage._FileStorage__file_path = os.path.join(tmp_dir, "file.json")
+    try:
+        print("{:>7} {:>14} {:>14} {:>14}".format(
+            "threads", "safe ops/s", "unsafe ops/s", "unsafe errors"))
+        for threads in (1, 4, 16, 64):
+            safe, safe_errors = run(threads, operations, places, True)
+            assert safe_errors == 0
+            unsafe, unsafe_errors = run(threads, operations, places, False)
+            print("{:>7} {:>14,.0f} {:>14,.0f} {:>14,}".format(
+                threads, safe, unsafe, unsafe_errors))
+    finally:
+        storage.thread_safe(False)
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+"""
+This module provides the filtering, ordering and paging shared by the
+`query` method of the storage engines.
+
+A condition is an (attribute, operator, value) triple, the operator being
+one of OPERATORS. An object whose attribute is missing or cannot be compared
+with the value does not match.
+
+Aggregations group objects by the value of one attribute and compute the
+functions of AGGREGATES over others.
+"""
+
+import heapq
+from itertools import islice
+import operator
+
+OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+AGGREGATES = ("sum", "avg", "min", "max")
+
+
+def check(where):
+    """
+    Validates a list of conditions.
+
+    Args:
+        where (iterable): The (attribute, operator, value) conditions.
+
+    Returns:
+        list: The conditions.
+
+    Raises:
+        ValueError: If a condition has an unknown operator.
+    """
+
+    where = [tuple(condition) for condition in where]
+    for attr, op, value in where:
+        if op not in OPERATORS:
+            raise ValueError("unknown operator: {}".format(op))
+    return where
+
+
+def matches(obj, where):
+    """
+    Tells whether an object satisfies every condition.
+
+    Args:
+        obj: The object to test.
+        where (list): The (attribute, operator, value) conditions.
+
+    Returns:
+        bool: True if every condition holds.
+    """
+
+    for attr, op, value in where:
+        try:
+            if not OPERATORS[op](getattr(obj, attr), value):
+                return False
+        except (AttributeError, TypeError):
+            return False
+    return True
+
+
+def sort_key(attr):
+    """
+    Builds a sort key on an attribute, objects missing it coming last in
+    ascending order.
+
+    Args:
+        attr (str): The attribute to order by.
+
+    Returns:
+        function: The key function.
+    """
+
+    def key(obj):
+        value = getattr(obj, attr, None)
+        return (value is None, value)
+    return key
+
+
+def select(candidates, where=(), order_by=None, limit=None, offset=0):
+    """
+    Filters, orders and pages candidate objects in a single pass.
+
+    Without ordering, the pass stops as soon as the page is full. With a
+    limit, only the best `offset + limit` objects are kept while ordering.
+
+    Args:
+        candidates (iterable): The objects to choose from.
+        where (list): The (attribute, operator, value) conditions.
+        order_by (str): The attribute to order by, descending when prefixed
+            with "-".
+        limit (int): The maximum number of objects to return.
+        offset (int): The number of matching objects to skip.
+
+    Returns:
+        list: The selected objects.
+
+    Raises:
+        ValueError: If the objects cannot be ordered by `order_by`.
+    """
+
+    found = (obj for obj in candidates if matches(obj, where))
+    if order_by is None:
+        stop = None if limit is None else offset + limit
+        return list(islice(found, offset, stop))
+    reverse = order_by.startswith("-")
+    key = sort_key(order_by.lstrip("-"))
+    try:
+        if limit is None:
+            ordered = sorted(found, key=key, reverse=reverse)
+        elif reverse:
+            ordered = heapq.nlargest(offset + limit, found, key=key)
+        else:
+            ordered = heapq.nsmallest(offset + limit, found, key=key)
+    except TypeError:
+        raise ValueError("cannot order by {}".format(order_by)) from None
+    return ordered[offset:]
+
+
+def check_metrics(metrics):
+    """
+    Validates the metrics of an aggregation.
+
+    Args:
+        metrics (dict): The attribute, or list of attributes, each of the
+            functions in AGGREGATES is computed over.
+
+    Returns:
+        list: The (function, attribute) pairs.
+
+    Raises:
+        ValueError: If a function is unknown.
+    """
+
+    pairs = []
+    for function, attrs in metrics.items():
+        if function not in AGGREGATES:
+            raise ValueError("unknown aggregate: {}".format(function))
+        if isinstance(attrs, str):
+            attrs = [attrs]
+        pairs.extend((function, attr) for attr in attrs)
+    return pairs
+
+
+def aggregate(objects, group_by=None, metrics=()):
+    """
+    Counts objects and computes metrics over them, per group, in a single
+    pass.
+
+    Only numbers are summed, averaged or compared; other values are
+    ignored. Objects whose group value cannot be hashed are skipped.
+
+    Args:
+        objects (iterable): The objects.
+        group_by (str): The attribute whose values form the groups, or
+            None for a single group.
+        metrics (list): The (function, attribute) pairs to compute.
+
+    Returns:
+        dict: The metrics of each group, by group value (None without
+        `group_by`), named "count" and "<function>(<attribute>)".
+    """
+
+    groups = {}
+    for obj in objects:
+        group = None if group_by is None else getattr(obj, group_by, None)
+        try:
+            state = groups.get(group)
+        except TypeError:
+            continue
+        if state is None:
+            state = groups[group] = [0] + [None] * len(metrics)
+        state[0] += 1
+        for position, (function, attr) in enumerate(metrics, 1):
+            value = getattr(obj, attr, None)
+            if not isinstance(value, (int, float)):
+                continue
+            current = state[position]
+            if function == "avg":
+                state[position] = [value, 1] if current is None else \
+                    [current[0] + value, current[1] + 1]
+            elif current is None:
+                state[position] = value
+            elif function == "sum":
+                state[position] = current + value
+            elif function == "min":
+                state[position] = min(current, value)
+            else:
+                state[position] = max(current, value)
+    results = {}
+    for group, state in groups.items():
+        results[group] = {"count": state[0]}
+        for position, (function, attr) in enumerate(metrics, 1):
+            value = state[position]
+            if function == "avg" and value is not None:
+                value = value[0] / value[1]
+            results[group]["{}({})".format(function, attr)] = value
+    return results
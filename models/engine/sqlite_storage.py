@@ -0,0 +1,669 @@
+#!/usr/bin/python3
+"""
+This module provides the SQLiteStorage class, a drop-in replacement for
+FileStorage that keeps every object in an SQLite database.
+
+Attributes:
+    COUNT_CHUNK (int): The number of ids looked up per query when `count`
+        checks which unsaved changes the database already holds.
+"""
+
+from models.base_model import BaseModel
+from models.user import User
+from models.state import State
+from models.city import City
+from models.place import Place
+from models.amenity import Amenity
+from models.review import Review
+from models.engine import query
+from models.engine.undo import MISSING, UndoLog
+from contextlib import nullcontext
+from datetime import datetime
+import json
+import sqlite3
+
+COUNT_CHUNK = 500
+
+
+class SQLiteStorage:
+    """
+    Persists objects in an SQLite database, one table per model class.
+
+    Every class attribute of a model gets its own column, and the attributes
+    set on an instance beyond those are kept as JSON in the `extra` column.
+    Objects are only loaded when they are asked for: `get` is an indexed
+    point lookup and `all` reads the tables. `save` upserts and deletes the
+    rows changed since the last save in batches, in one transaction.
+
+    Attributes:
+        __db_path (str): Path of the database file.
+        __connection (sqlite3.Connection): The open database connection.
+        __objects (dict): Objects loaded or created so far, by key.
+        __dirty (dict): Keys changed since the last save, mapped to the
+            object or to None when the object was deleted.
+        __classes (dict): The model classes stored, by name.
+        __columns (dict): Column names and types of each table.
+        __json_columns (dict): Columns of each table holding JSON values.
+        __loaded (bool): Whether every row has been read by `all`.
+        __index_fields (dict): The indexed columns of each class name.
+        __dependents (dict): The (class name, column) pairs whose column
+            holds the id of an object of each class name.
+        __undo (UndoLog): The pre-images of the open transaction.
+    """
+
+    __db_path = "file.db"
+    __connection = None
+    __objects = {}
+    __dirty = {}
+    __classes = {cls.__name__: cls for cls in
+                 (BaseModel, User, State, City, Place, Amenity, Review)}
+    __columns = {}
+    __json_columns = {}
+    __loaded = False
+    __index_fields = {"City": ["state_id"], "Place": ["city_id", "user_id"],
+                      "Review": ["place_id", "user_id"]}
+    __dependents = {"State": [("City", "state_id")],
+                    "City": [("Place", "city_id")],
+                    "User": [("Place", "user_id"), ("Review", "user_id")],
+                    "Place": [("Review", "place_id")]}
+    __undo = UndoLog()
+
+    def all(self, cls=None):
+        """
+        Retrieves a dictionary of the stored objects.
+
+        Rows that were not loaded yet are read from the database the first
+        time.
+
+        Args:
+            cls (str): Only return the objects of this class name.
+
+        Returns:
+            dict: A copy of every stored object by "<class>.<id>" key, or of
+            the objects of `cls` by id.
+        """
+
+        if cls is not None:
+            if cls not in SQLiteStorage.__classes:
+                return {}
+            self.__load_table(cls)
+            prefix = cls + "."
+            return {key[len(prefix):]: obj for key, obj in
+                    SQLiteStorage.__objects.items() if key.startswith(prefix)}
+        if not SQLiteStorage.__loaded:
+            for name in SQLiteStorage.__classes:
+                self.__load_table(name)
+            SQLiteStorage.__loaded = True
+        return SQLiteStorage.__objects.copy()
+
+    def get(self, cls, id):
+        """
+        Retrieves one object by class and id.
+
+        Args:
+            cls (str): The class name of the object.
+            id (str): The id of the object.
+
+        Returns:
+            The object, or None if it does not exist.
+        """
+
+        key = "{}.{}".format(cls, id)
+        if key in SQLiteStorage.__objects:
+            return SQLiteStorage.__objects[key]
+        if cls not in SQLiteStorage.__classes or \
+                key in SQLiteStorage.__dirty:
+            return None
+        row = SQLiteStorage.__connection.execute(
+            "SELECT * FROM {} WHERE id = ?".format(cls), (id,)).fetchone()
+        if row is None:
+            return None
+        SQLiteStorage.__objects[key] = self.__hydrate(cls, row)
+        return SQLiteStorage.__objects[key]
+
+    def new(self, obj):
+        """
+        Register a new object within the storage system.
+
+        Args:
+            obj: The object to be added to storage.
+        """
+
+        key = "{}.{}".format(obj.__class__.__name__, obj.id)
+        if SQLiteStorage.__undo.depth() > 0:
+            SQLiteStorage.__undo.key(key, SQLiteStorage.__objects.get(key),
+                                     SQLiteStorage.__dirty.get(key, MISSING))
+        SQLiteStorage.__objects[key] = obj
+        SQLiteStorage.__dirty[key] = obj
+
+    def remember(self, obj, name):
+        """
+        Records the value of an attribute before it is set, so the open
+        transaction can restore it.
+
+        Args:
+            obj: The object about to change.
+            name (str): The attribute about to be set.
+        """
+
+        if SQLiteStorage.__undo.depth() == 0 or "id" not in obj.__dict__:
+            return
+        key = "{}.{}".format(obj.__class__.__name__, obj.id)
+        if SQLiteStorage.__objects.get(key) is obj:
+            SQLiteStorage.__undo.attr(obj, name)
+
+    def touch(self, obj, name=None):
+        """
+        Marks a stored object as changed so the next save persists it.
+
+        Args:
+            obj: The object whose attributes were modified.
+            name (str): The attribute that was set, unused: there are no
+                indexes to refresh.
+        """
+
+        key = "{}.{}".format(obj.__class__.__name__, obj.id)
+        if key in SQLiteStorage.__objects:
+            SQLiteStorage.__dirty[key] = obj
+
+    def holds(self, obj):
+        """
+        Tells whether an object is the one stored under its key.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            bool: False for objects not registered yet, whose attribute
+            writes need no bookkeeping.
+        """
+
+        if "id" not in obj.__dict__:
+            return False
+        key = "{}.{}".format(obj.__class__.__name__, obj.id)
+        return SQLiteStorage.__objects.get(key) is obj
+
+    def is_dirty(self, obj):
+        """
+        Tells whether an object changed since it was last saved.
+
+        Args:
+            obj: The object to check.
+
+        Returns:
+            bool: True if the next save has to write the object again.
+        """
+
+        key = "{}.{}".format(obj.__class__.__name__, obj.id)
+        return key in SQLiteStorage.__dirty
+
+    def delete(self, obj, cascade=False):
+        """
+        Removes an object from storage.
+
+        With `cascade`, the objects depending on it (the cities of a state,
+        the places of a city or user, the reviews of a place or user) are
+        removed as well, recursively, through the column indexes.
+
+        Args:
+            obj: The object to be removed.
+            cascade (bool): Whether to remove its dependents too.
+
+        Returns:
+            list: The objects removed.
+        """
+
+        doomed = {"{}.{}".format(obj.__class__.__name__, obj.id): obj}
+        pending = [obj] if cascade else []
+        while len(pending) > 0:
+            current = pending.pop()
+            for cls, attr in SQLiteStorage.__dependents.get(
+                    current.__class__.__name__, ()):
+                for dependent in self.by_index(cls, attr, current.id).values():
+                    key = "{}.{}".format(cls, dependent.id)
+                    if key not in doomed:
+                        doomed[key] = dependent
+                        pending.append(dependent)
+        for key in doomed:
+            if SQLiteStorage.__undo.depth() > 0:
+                SQLiteStorage.__undo.key(
+                    key, SQLiteStorage.__objects.get(key),
+                    SQLiteStorage.__dirty.get(key, MISSING))
+            SQLiteStorage.__objects.pop(key, None)
+            SQLiteStorage.__dirty[key] = None
+        return list(doomed.values())
+
+    def count(self, cls=None):
+        """
+        Counts the stored objects, without reading them.
+
+        The rows are counted by the database, then corrected for the
+        objects created or deleted since the last save, so the cost grows
+        with the number of unsaved changes only.
+
+        Args:
+            cls (str): Only count the objects of this class name.
+
+        Returns:
+            int: The number of objects.
+        """
+
+        if cls is not None and cls not in SQLiteStorage.__classes:
+            return 0
+        names = list(SQLiteStorage.__classes) if cls is None else [cls]
+        changes = {name: {} for name in names}
+        for key, obj in SQLiteStorage.__dirty.items():
+            name, id = key.split(".", 1)
+            if name in changes:
+                changes[name][id] = obj is not None
+        total = 0
+        for name in names:
+            total += SQLiteStorage.__connection.execute(
+                "SELECT COUNT(*) FROM {}".format(name)).fetchone()[0]
+            ids = list(changes[name])
+            for start in range(0, len(ids), COUNT_CHUNK):
+                chunk = ids[start:start + COUNT_CHUNK]
+                for row in SQLiteStorage.__connection.execute(
+                        "SELECT id FROM {} WHERE id IN ({})".format(
+                            name, ", ".join("?" * len(chunk))), chunk):
+                    if not changes[name].pop(row[0]):
+                        total -= 1
+            total += sum(changes[name].values())
+        return total
+
+    def by_index(self, cls, attr, value):
+        """
+        Retrieves the objects of a class whose attribute holds a value.
+
+        Saved rows are found through the column index, unsaved changes are
+        looked up in memory.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The indexed attribute.
+            value: The value to look for.
+
+        Returns:
+            dict: The matching objects, by id.
+
+        Raises:
+            ValueError: If the attribute is not indexed.
+        """
+
+        if attr not in SQLiteStorage.__index_fields.get(cls, ()):
+            raise ValueError("no index on {}.{}".format(cls, attr))
+        result = {}
+        cursor = SQLiteStorage.__connection.execute(
+            "SELECT id FROM {} WHERE {} = ?".format(cls, attr), (value,))
+        for (id,) in cursor:
+            key = "{}.{}".format(cls, id)
+            if key not in SQLiteStorage.__dirty:
+                obj = self.get(cls, id)
+                if getattr(obj, attr, None) == value:
+                    result[id] = obj
+        for key, obj in SQLiteStorage.__dirty.items():
+            if obj is not None and key.startswith(cls + ".") and \
+                    getattr(obj, attr, None) == value:
+                result[obj.id] = obj
+        return result
+
+    def query(self, cls, where=(), order_by=None, limit=None, offset=0):
+        """
+        Retrieves the objects of a class satisfying conditions.
+
+        An equality condition on an indexed column narrows the candidates
+        to the matching rows; the other conditions are checked in memory.
+
+        Args:
+            cls (str): The class name.
+            where (iterable): The (attribute, operator, value) conditions.
+            order_by (str): The attribute to order by, descending when
+                prefixed with "-".
+            limit (int): The maximum number of objects to return.
+            offset (int): The number of matching objects to skip.
+
+        Returns:
+            list: The matching objects.
+
+        Raises:
+            ValueError: If a condition or the ordering is invalid.
+        """
+
+        candidates, where = self.__plan(cls, query.check(where))
+        return query.select(candidates, where, order_by, limit, offset)
+
+    def aggregate(self, cls, group_by=None, where=(), **metrics):
+        """
+        Counts the objects of a class and computes metrics over them, per
+        group, in one pass.
+
+        Args:
+            cls (str): The class name.
+            group_by (str): The attribute whose values form the groups, or
+                None for a single group.
+            where (iterable): The (attribute, operator, value) conditions.
+            **metrics: The attribute, or list of attributes, to compute
+                each of "sum", "avg", "min" and "max" over.
+
+        Returns:
+            dict: The metrics of each group, by group value (None without
+            `group_by`), named "count" and "<function>(<attribute>)".
+
+        Raises:
+            ValueError: If a condition or a function is invalid.
+        """
+
+        metrics = query.check_metrics(metrics)
+        candidates, where = self.__plan(cls, query.check(where))
+        return query.aggregate(
+            (obj for obj in candidates if query.matches(obj, where)),
+            group_by, metrics)
+
+    def durability(self, mode, **kwargs):
+        """
+        Chooses when a requested save reaches the disk.
+
+        Every save is its own transaction, so only "immediate" is supported.
+
+        Args:
+            mode (str): The durability mode.
+
+        Raises:
+            ValueError: If the mode is not "immediate".
+        """
+
+        if mode != "immediate":
+            raise ValueError("unsupported durability mode: {}".format(mode))
+
+    def begin(self):
+        """
+        Opens a transaction, or a savepoint inside the open one.
+
+        Until the transaction is committed, saves do nothing and the
+        pre-image of every change is recorded.
+
+        Returns:
+            int: The number of open savepoints, the transaction included.
+        """
+
+        return SQLiteStorage.__undo.begin()
+
+    def commit(self):
+        """
+        Closes the innermost savepoint, keeping its changes.
+
+        Closing the transaction itself writes its changes in one database
+        transaction.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        if SQLiteStorage.__undo.release():
+            self.save()
+
+    def rollback(self):
+        """
+        Closes the innermost savepoint, undoing its changes.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        objects = SQLiteStorage.__objects
+        changed = {}
+        for entry in SQLiteStorage.__undo.undo():
+            if entry[0] == "attr":
+                kind, obj, name, value = entry
+                if value is MISSING:
+                    obj.__dict__.pop(name, None)
+                else:
+                    obj.__dict__[name] = value
+                changed[id(obj)] = obj
+                continue
+            kind, key, obj, dirty = entry
+            objects.pop(key, None)
+            if obj is not None:
+                objects[key] = obj
+            if dirty is MISSING:
+                SQLiteStorage.__dirty.pop(key, None)
+            else:
+                SQLiteStorage.__dirty[key] = dirty
+        for obj in changed.values():
+            key = "{}.{}".format(obj.__class__.__name__, obj.id)
+            if objects.get(key) is obj:
+                SQLiteStorage.__dirty[key] = obj
+
+    def lock(self):
+        """
+        Retrieves the lock of a thread-safe mode.
+
+        Returns:
+            None: The connection belongs to the thread that opened it.
+        """
+
+        return None
+
+    def exclusive(self):
+        """
+        Holds the write lock of a thread-safe mode for a with block.
+
+        Returns:
+            The context manager, doing nothing.
+        """
+
+        return nullcontext()
+
+    def depth(self):
+        """
+        Tells how many savepoints are open.
+
+        Returns:
+            int: 0 outside of a transaction, 1 in a transaction, more in
+            nested savepoints.
+        """
+
+        return SQLiteStorage.__undo.depth()
+
+    def save(self):
+        """
+        Writes the objects changed since the last save in one database
+        transaction, unless a storage transaction is open.
+        """
+
+        if SQLiteStorage.__undo.depth() > 0:
+            return
+
+        upserts = {}
+        deletes = {}
+        for key, obj in SQLiteStorage.__dirty.items():
+            name, id = key.split(".", 1)
+            if obj is None:
+                deletes.setdefault(name, []).append((id,))
+            else:
+                upserts.setdefault(name, []).append(self.__row(name, obj))
+        with SQLiteStorage.__connection as connection:
+            for name, rows in deletes.items():
+                connection.executemany(
+                    "DELETE FROM {} WHERE id = ?".format(name), rows)
+            for name, rows in upserts.items():
+                columns = SQLiteStorage.__columns[name]
+                connection.executemany(
+                    "INSERT OR REPLACE INTO {} VALUES ({})".format(
+                        name, ", ".join("?" * len(columns))), rows)
+        SQLiteStorage.__dirty = {}
+
+    def flush(self):
+        """
+        Writes every change requested so far to disk.
+        """
+
+        self.save()
+
+    def close(self):
+        """
+        Writes the pending changes, if any.
+        """
+
+        if len(SQLiteStorage.__dirty) > 0:
+            self.save()
+
+    def writer_error(self):
+        """
+        Retrieves the last error of a background writer.
+
+        Returns:
+            None: Writes always happen in the calling thread.
+        """
+
+        return None
+
+    def reload(self):
+        """
+        Opens the database, creating the missing tables.
+
+        No object is read until it is asked for. The open transaction, if
+        any, is discarded.
+        """
+
+        if SQLiteStorage.__connection is not None:
+            SQLiteStorage.__connection.close()
+        SQLiteStorage.__connection = sqlite3.connect(SQLiteStorage.__db_path)
+        SQLiteStorage.__connection.execute("PRAGMA journal_mode=WAL")
+        SQLiteStorage.__connection.execute("PRAGMA synchronous=NORMAL")
+        SQLiteStorage.__objects = {}
+        SQLiteStorage.__dirty = {}
+        SQLiteStorage.__loaded = False
+        SQLiteStorage.__undo = UndoLog()
+        for name, cls in SQLiteStorage.__classes.items():
+            columns = [("id", "TEXT PRIMARY KEY"), ("created_at", "TEXT"),
+                       ("updated_at", "TEXT")]
+            SQLiteStorage.__json_columns[name] = set()
+            for attr, value in vars(cls).items():
+                if not attr.startswith("_") and not callable(value):
+                    columns.append((attr, SQLiteStorage.__sql_type(value)))
+                    if type(value) not in (int, float, str):
+                        SQLiteStorage.__json_columns[name].add(attr)
+            columns.append(("extra", "TEXT"))
+            SQLiteStorage.__columns[name] = columns
+            SQLiteStorage.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS {} ({})".format(
+                    name, ", ".join(" ".join(col) for col in columns)))
+            for attr in SQLiteStorage.__index_fields.get(name, ()):
+                SQLiteStorage.__connection.execute(
+                    "CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} ({1})".format(
+                        name, attr))
+
+    def __plan(self, cls, where):
+        """
+        Chooses the candidates of a query: the rows matching an equality
+        condition on an indexed column, or the whole table.
+
+        Args:
+            cls (str): The class name.
+            where (list): The (attribute, operator, value) conditions.
+
+        Returns:
+            tuple: The candidates, with the conditions left to apply to
+            them.
+        """
+
+        for condition in where:
+            attr, op, value = condition
+            if op == "==" and \
+                    attr in SQLiteStorage.__index_fields.get(cls, ()):
+                rest = [other for other in where if other is not condition]
+                return self.by_index(cls, attr, value).values(), rest
+        return self.all(cls).values(), where
+
+    def __load_table(self, name):
+        """
+        Reads the rows of a table that were not loaded yet.
+
+        Args:
+            name (str): The class name of the table.
+        """
+
+        if SQLiteStorage.__loaded:
+            return
+        cursor = SQLiteStorage.__connection.execute(
+            "SELECT * FROM {}".format(name))
+        for row in cursor:
+            key = "{}.{}".format(name, row[0])
+            if key not in SQLiteStorage.__objects and \
+                    key not in SQLiteStorage.__dirty:
+                SQLiteStorage.__objects[key] = self.__hydrate(name, row)
+
+    @staticmethod
+    def __sql_type(value):
+        """
+        Maps the default value of a class attribute to a column type.
+
+        Args:
+            value: The default value.
+
+        Returns:
+            str: The SQLite column type.
+        """
+
+        if type(value) is int:
+            return "INTEGER"
+        if type(value) is float:
+            return "REAL"
+        return "TEXT"
+
+    def __row(self, name, obj):
+        """
+        Builds the column values of an object.
+
+        Args:
+            name (str): The class name of the object.
+            obj: The object to store.
+
+        Returns:
+            tuple: The values, in column order.
+        """
+
+        attrs = obj.to_dict()
+        del attrs["__class__"]
+        row = []
+        json_columns = SQLiteStorage.__json_columns[name]
+        for column, sql_type in SQLiteStorage.__columns[name][:-1]:
+            value = attrs.pop(column, None)
+            if column in json_columns and value is not None:
+                value = json.dumps(value)
+            row.append(value)
+        row.append(json.dumps(attrs) if len(attrs) > 0 else None)
+        return tuple(row)
+
+    def __hydrate(self, name, row):
+        """
+        Builds an object from its row.
+
+        The timestamps are parsed with `datetime.fromisoformat`, which also
+        reads the ones `isoformat` wrote without microseconds.
+
+        Args:
+            name (str): The class name of the object.
+            row (tuple): The column values.
+
+        Returns:
+            The object.
+        """
+
+        kwargs = {}
+        json_columns = SQLiteStorage.__json_columns[name]
+        for (column, sql_type), value in zip(
+                SQLiteStorage.__columns[name][:-1], row):
+            if value is not None:
+                if column in json_columns:
+                    value = json.loads(value)
+                kwargs[column] = value
+        if row[-1] is not None:
+            kwargs.update(json.loads(row[-1]))
+        stamps = {key: kwargs.pop(key) for key in ("created_at", "updated_at")
+                  if key in kwargs}
+        obj = SQLiteStorage.__classes[name](**kwargs)
+        for key, value in stamps.items():
+            obj.__dict__[key] = datetime.fromisoformat(value)
+        return obj
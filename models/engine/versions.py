@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+"""
+This module provides the snapshots FileStorage gives readers, so they see
+the storage as it was when they started while writers keep changing it.
+
+A reader pins the current version. From then on, each write records the
+state the key had before it, unless a pre-image newer than every pin is
+already kept for it. A reader resolves a key by taking the oldest pre-image
+recorded after its version, or the live object when there is none. Once no
+reader holds the versions a pre-image was kept for, it is dropped.
+
+Attributes:
+    SNAPSHOT_CHUNK (int): The number of ids a snapshot resolves under one
+        hold of the read lock.
+"""
+
+from collections import deque
+from contextlib import nullcontext
+
+SNAPSHOT_CHUNK = 1000
+
+
+class VersionLog:
+    """
+    Keeps the pre-images pinned readers still need.
+
+    Attributes:
+        version (int): The version of the latest recorded write.
+        __pins (dict): The number of readers holding each version, oldest
+            version first.
+        __images (dict): The (version, object) pre-images of each key,
+            oldest first, the object being None when the key was absent.
+        __history (deque): The (version, key) of every pre-image, oldest
+            first.
+    """
+
+    def __init__(self):
+        """Initializes an empty log, without readers."""
+
+        self.version = 0
+        self.__pins = {}
+        self.__images = {}
+        self.__history = deque()
+
+    def pinned(self):
+        """
+        Tells whether a reader holds a version.
+
+        Returns:
+            bool: True if writes have to record pre-images.
+        """
+
+        return len(self.__pins) > 0
+
+    def pin(self):
+        """
+        Holds the current version for a new reader.
+
+        Returns:
+            int: The version.
+        """
+
+        self.__pins[self.version] = self.__pins.get(self.version, 0) + 1
+        return self.version
+
+    def unpin(self, version):
+        """
+        Lets go of a version held by a reader, dropping the pre-images no
+        remaining reader needs.
+
+        Args:
+            version (int): The version, as returned by `pin`.
+        """
+
+        if self.__pins[version] > 1:
+            self.__pins[version] -= 1
+            return
+        del self.__pins[version]
+        if len(self.__pins) == 0:
+            self.__images = {}
+            self.__history.clear()
+            return
+        oldest = next(iter(self.__pins))
+        while len(self.__history) > 0 and self.__history[0][0] <= oldest:
+            version, key = self.__history.popleft()
+            images = self.__images[key][1:]
+            if len(images) == 0:
+                del self.__images[key]
+            else:
+                self.__images[key] = images
+
+    def preserve(self, key, obj):
+        """
+        Records the state of a key before a write, if a reader needs it.
+
+        The object is copied shallowly: lists it holds and later modifies
+        in place are shared with the copy.
+
+        Args:
+            key (str): The "<class>.<id>" key about to change.
+            obj: The object the key holds, or None.
+        """
+
+        if len(self.__pins) == 0:
+            return
+        images = self.__images.get(key)
+        if images is not None and \
+                images[-1][0] > next(reversed(self.__pins)):
+            return
+        if obj is not None:
+            image = obj.__class__.__new__(obj.__class__)
+            image.__dict__.update(obj.__dict__)
+            obj = image
+        self.version += 1
+        self.__images.setdefault(key, []).append((self.version, obj))
+        self.__history.append((self.version, key))
+
+    def resolve(self, key, version, live):
+        """
+        Finds the state of a key at a version.
+
+        Args:
+            key (str): The "<class>.<id>" key.
+            version (int): The pinned version.
+            live: The object the key holds now, or None.
+
+        Returns:
+            The object the key held at the version, or None.
+        """
+
+        for image_version, obj in self.__images.get(key, ()):
+            if image_version > version:
+                return obj
+        return live
+
+
+class Snapshot:
+    """
+    A consistent, read-only view of a FileStorage at one version.
+
+    Nothing is copied when it is taken: objects are read from the live
+    partitions, and replaced by their pre-images when they changed since.
+    Only the ids listed when the snapshot was taken are visited, so it can
+    be iterated while writers add and remove objects. The objects it
+    returns must not be modified.
+
+    Release it when done, or use it as a context manager, so the pre-images
+    it holds can be dropped.
+
+    With the lock of a thread-safe storage, objects are resolved under its
+    read lock, a chunk at a time. A live object may still be changed by a
+    writer once handed out.
+
+    Attributes:
+        version (int): The pinned version.
+        __log (VersionLog): The log of the storage.
+        __partitions (dict): The live objects of each class, by id.
+        __order (dict): The ids of each class, in the order they were
+            listed. Ids of deleted objects stay listed while readers exist.
+        __lengths (dict): The number of ids of each class when pinned.
+        __lock (RWLock): The lock of the storage, or None.
+    """
+
+    def __init__(self, log, partitions, order, lock=None):
+        """
+        Pins the current version of a storage.
+
+        Args:
+            log (VersionLog): The log of the storage.
+            partitions (dict): The live objects of each class, by id.
+            order (dict): The listed ids of each class.
+            lock (RWLock): The lock of a thread-safe storage.
+        """
+
+        self.__lock = lock
+        self.__log = log
+        self.__partitions = partitions
+        self.__order = order
+        self.__lengths = {name: len(ids) for name, ids in order.items()}
+        self.version = log.pin()
+
+    def get(self, cls, id):
+        """
+        Retrieves one object as it was when the snapshot was taken.
+
+        Args:
+            cls (str): The class name of the object.
+            id (str): The id of the object.
+
+        Returns:
+            The object, or None if it did not exist.
+        """
+
+        with self.__reading():
+            return self.__log.resolve("{}.{}".format(cls, id), self.version,
+                                      self.__partitions.get(cls, {}).get(id))
+
+    def items(self, cls=None):
+        """
+        Walks the objects that existed when the snapshot was taken.
+
+        Args:
+            cls (str): Only walk the objects of this class name.
+
+        Yields:
+            tuple: The "<class>.<id>" key and the object.
+        """
+
+        names = list(self.__lengths) if cls is None else [cls]
+        for name in names:
+            ids = self.__order.get(name, ())
+            partition = self.__partitions.get(name, {})
+            length = self.__lengths.get(name, 0)
+            for start in range(0, length, SNAPSHOT_CHUNK):
+                found = []
+                with self.__reading():
+                    for id in ids[start:min(start + SNAPSHOT_CHUNK, length)]:
+                        key = "{}.{}".format(name, id)
+                        obj = self.__log.resolve(key, self.version,
+                                                 partition.get(id))
+                        if obj is not None:
+                            found.append((key, obj))
+                yield from found
+
+    def count(self, cls=None):
+        """
+        Counts the objects that existed when the snapshot was taken.
+
+        Args:
+            cls (str): Only count the objects of this class name.
+
+        Returns:
+            int: The number of objects.
+        """
+
+        return sum(1 for item in self.items(cls))
+
+    def release(self):
+        """Lets go of the pinned version; the snapshot cannot be read after."""
+
+        if self.__log is not None:
+            with (nullcontext() if self.__lock is None else
+                  self.__lock.writing()):
+                self.__log.unpin(self.version)
+            self.__log = None
+
+    def __reading(self):
+        """Holds the read lock of the storage, if any, for a with block"""
+
+        if self.__lock is None:
+            return nullcontext()
+        return self.__lock.reading()
+
+    def __enter__(self):
+        """Returns the snapshot itself."""
+
+        return self
+
+    def __exit__(self, *exc_info):
+        """Releases the snapshot."""
+
+        self.release()
@@ -5,12 +5,16 @@ This module provides a command-line interface for creating, displaying, updating
 and deleting instances of various classes used in the HolbertonBnB application.
 
 Attributes:
-    storage (FileStorage): An instance of the FileStorage class for persisting data.
+    storage (FileStorage): The storage engine shared with the models.
+    QUERY_METHODS (tuple): The methods a query chain is made of.
+    STREAM_FLUSH (int): The number of streamed objects between two flushes.
+    OUTPUT_FORMATS (tuple): The formats objects can be printed in.
     __classes_0 (set): A set of available class names for the console.
 """
 
+from ast import literal_eval
 from shlex import split
-from models.engine.file_storage import FileStorage
+from models import storage
 from models.base_model import BaseModel 
 from models.user import User
 from models.state import State
@@ -18,11 +22,22 @@ from models.city import City
 from models.place import Place
 from models.amenity import Amenity
 from models.review import Review
+from itertools import islice
+import argparse
+import base64
 import cmd
+import csv
+import json
+import math
 import re
+import sys
+import time
+
+QUERY_METHODS = ("where", "order_by", "limit", "offset", "aggregate")
+STREAM_FLUSH = 1000
+OUTPUT_FORMATS = ("text", "json", "ndjson", "csv")
 
 
-storage = FileStorage()
 def do_parse(arg):
     """Parses a given command-line argument string.
 
@@ -52,6 +67,289 @@ def do_parse(arg):
         return lexer_res
 
 
+def parse_value(text):
+    """Parses a literal value, keeping it as a string if it is none.
+
+    Args:
+        text (str): The value as typed.
+
+    Returns:
+        The parsed value.
+    """
+    try:
+        return literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parse_query(text):
+    """Parses a chain of query methods.
+
+    Args:
+        text (str): The chain, e.g. "where(max_guest>=4).limit(20)".
+
+    Returns:
+        dict: The keyword arguments of `storage.query`.
+
+    Raises:
+        ValueError: If the chain is malformed.
+    """
+    options = {"where": []}
+    position = 0
+    for call in re.finditer(r"\.?(\w+)\((.*?)\)", text):
+        if call.start() != position or call.group(1) not in QUERY_METHODS:
+            raise ValueError("invalid query: {}".format(text))
+        position = call.end()
+        name, args = call.group(1), call.group(2).strip()
+        if name == "where":
+            for condition in re.findall(r"(?:[^,\"']|\"[^\"]*\"|'[^']*')+",
+                                        args):
+                found = re.match(r"\s*(\w+)\s*(==|!=|<=|>=|<|>|=)\s*(.+?)\s*$",
+                                 condition)
+                if found is None:
+                    raise ValueError("invalid condition: {}".format(
+                        condition.strip()))
+                attr, op, value = found.groups()
+                options["where"].append((attr, "==" if op == "=" else op,
+                                         parse_value(value)))
+        elif name == "aggregate":
+            options["aggregate"] = parse_aggregate(args)
+        elif name == "order_by":
+            if re.match(r"-?\w+$", args) is None:
+                raise ValueError("invalid order: {}".format(args))
+            options["order_by"] = args
+        else:
+            value = parse_value(args)
+            if type(value) is not int or value < 0:
+                raise ValueError("invalid {}: {}".format(name, args))
+            options[name] = value
+    if position != len(text):
+        raise ValueError("invalid query: {}".format(text))
+    if "aggregate" in options and \
+            len(options.keys() & {"order_by", "limit", "offset"}) > 0:
+        raise ValueError("aggregate cannot be ordered or paged")
+    return options
+
+
+def parse_aggregate(text):
+    """Parses the arguments of an aggregation.
+
+    Args:
+        text (str): The arguments, e.g. "group_by=city_id, avg=price_by_night".
+
+    Returns:
+        dict: The keyword arguments of `storage.aggregate`.
+
+    Raises:
+        ValueError: If an argument is malformed.
+    """
+    options = {}
+    for word in text.replace(",", " ").split():
+        found = re.match(r"(\w+)=(\w+)$", word)
+        if found is None:
+            raise ValueError("invalid aggregate: {}".format(word))
+        name, attr = found.groups()
+        if name == "group_by":
+            options["group_by"] = attr
+        else:
+            options.setdefault(name, []).append(attr)
+    return options
+
+
+def parse_flags(args_vect, names):
+    """Removes `--name value` options from parsed arguments.
+
+    Args:
+        args_vect (list): The parsed arguments, modified in place.
+        names (tuple): The accepted option names.
+
+    Returns:
+        dict: The value of each option given, by name.
+
+    Raises:
+        ValueError: If an option is unknown or has no value.
+    """
+    options = {}
+    position = 0
+    while position < len(args_vect):
+        if not args_vect[position].startswith("--"):
+            position += 1
+            continue
+        name = args_vect.pop(position)
+        if name not in names:
+            raise ValueError("unknown option: {}".format(name))
+        if position == len(args_vect):
+            raise ValueError("{} value missing".format(name))
+        options[name] = args_vect.pop(position)
+    return options
+
+
+def parse_count(options, name):
+    """Reads a non-negative integer option.
+
+    Args:
+        options (dict): The options, by name.
+        name (str): The option name.
+
+    Returns:
+        int: The value, or None if the option was not given (0 for
+        --offset).
+
+    Raises:
+        ValueError: If the value is not a non-negative integer.
+    """
+    if name not in options:
+        return 0 if name == "--offset" else None
+    if not options[name].isdigit():
+        raise ValueError("invalid {}: {}".format(name[2:], options[name]))
+    return int(options[name])
+
+
+def encode_cursor(cls, position, key):
+    """Builds the cursor resuming a listing after a given object.
+
+    Args:
+        cls (str): The class name listed, or None for every class.
+        position (int): The number of objects listed so far.
+        key (str): The key of the last object listed.
+
+    Returns:
+        str: The opaque cursor.
+    """
+    data = json.dumps([cls, position, key]).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor, cls):
+    """Reads a cursor built by `encode_cursor`.
+
+    Args:
+        cursor (str): The cursor.
+        cls (str): The class name listed now, or None.
+
+    Returns:
+        tuple: The position to resume at and the key of the last object
+        listed.
+
+    Raises:
+        ValueError: If the cursor is malformed or was built for another
+            listing.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_cls, position, key = json.loads(data)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor") from None
+    if cursor_cls != cls or type(position) is not int or position < 1:
+        raise ValueError("invalid cursor")
+    return position, key
+
+
+def resume(obj_dict, position, key):
+    """Iterates over the items of a dictionary after a cursor.
+
+    The item at the cursor's position is expected to be the last one
+    listed; if objects were added or removed before it since, the listing
+    resumes after that object wherever it now is, or at the same position
+    if it is gone.
+
+    Args:
+        obj_dict (mapping): The objects listed, by key.
+        position (int): The number of objects listed so far.
+        key (str): The key of the last object listed.
+
+    Returns:
+        tuple: The position resumed at and an iterator over the remaining
+        (key, object) items.
+    """
+    items = iter(obj_dict.items())
+    previous = next(islice(items, position - 1, position), (None, None))
+    if previous[0] == key:
+        return position, items
+    if key in obj_dict:
+        items = iter(obj_dict.items())
+        for index, (item_key, obj_var) in enumerate(items, 1):
+            if item_key == key:
+                return index, items
+    return position, islice(iter(obj_dict.items()), position, None)
+
+
+class ErrorWatch:
+    """Passes output through, noting whether an error message was printed.
+
+    Error messages are the lines starting with "*** ".
+
+    Attributes:
+        stream (file): The stream the output is written to.
+        failed (bool): Whether an error message was written.
+    """
+
+    def __init__(self, stream):
+        """Initializes the watch.
+
+        Args:
+            stream (file): The stream the output is written to.
+        """
+        self.stream = stream
+        self.failed = False
+        self.__line_start = True
+
+    def write(self, text):
+        """Writes text to the stream, looking for error messages."""
+        if self.__line_start and text.startswith("*** "):
+            self.failed = True
+        if len(text) > 0:
+            self.__line_start = text.endswith("\n")
+        return self.stream.write(text)
+
+    def flush(self):
+        """Flushes the stream."""
+        self.stream.flush()
+
+
+def csv_columns(classes):
+    """Lists the CSV columns of objects of some classes.
+
+    Args:
+        classes (list): The class names.
+
+    Returns:
+        list: The class name, id and timestamps columns, the class
+        attributes of the classes, and the "extra" column.
+    """
+    columns = ["__class__", "id", "created_at", "updated_at"]
+    for name in classes:
+        for attr, value in vars(eval(name)).items():
+            if not attr.startswith("_") and not callable(value) and \
+                    attr not in columns:
+                columns.append(attr)
+    return columns + ["extra"]
+
+
+def csv_row(record, columns):
+    """Builds the CSV row of an object's dictionary.
+
+    Lists and dictionaries are written as JSON, and the attributes without
+    a column as a JSON object in the last, "extra" column.
+
+    Args:
+        record (dict): The dictionary of the object.
+        columns (list): The columns, from `csv_columns`.
+
+    Returns:
+        list: The cells.
+    """
+    record = record.copy()
+    row = []
+    for column in columns[:-1]:
+        value = record.pop(column, "")
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value)
+        row.append(value)
+    row.append(json.dumps(record) if len(record) > 0 else "")
+    return row
+
+
 class HBNBCommand(cmd.Cmd):
     """Defines the HolbertonBnB command-line interpreter.
 
@@ -61,9 +359,15 @@ class HBNBCommand(cmd.Cmd):
 
     Attributes:
         prompt (str): The command-line prompt string.
+        output_format (str): The output format of the session, one of
+            OUTPUT_FORMATS.
+        batch_depth (int): The depth of the transaction of the running
+            batch, 0 outside of batches.
         __classes_0 (set): A set of available class names for the console.
     """
     prompt = "(AirBnB-clone)/> "
+    output_format = "text"
+    batch_depth = 0
     __classes_0 = {
         "BaseModel",
         "User",
@@ -74,10 +378,127 @@ class HBNBCommand(cmd.Cmd):
         "Review"
     }
 
+    def run_batch(self, lines, report=None):
+        """Runs commands as a single transaction
+
+        The commands run in a storage transaction, committed once at the
+        end. The first command printing an error, or raising one, stops the
+        batch and the transaction is rolled back. Commands can open nested
+        savepoints with begin, commit and rollback, but closing the
+        transaction of the batch itself is an error. The time each command
+        took is written to `report`.
+
+        Args:
+            lines (iterable): The commands; blank lines and lines starting
+                with "#" are skipped.
+            report (file): Where the timings go, the standard error if None.
+
+        Returns:
+            bool: Whether every command succeeded and the changes were saved.
+        """
+        report = report or sys.stderr
+        stdout = sys.stdout
+        count = 0
+        started = time.perf_counter()
+        depth = self.batch_depth = storage.begin()
+        try:
+            for number, line in enumerate(lines, 1):
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                watch = ErrorWatch(stdout)
+                sys.stdout = watch
+                start = time.perf_counter()
+                try:
+                    stop = self.onecmd(line)
+                except Exception as error:
+                    print("*** {}: {} ***".format(
+                        type(error).__name__, error))
+                    stop = False
+                finally:
+                    sys.stdout = stdout
+                count += 1
+                print("{:>6} {:>10.6f} s  {}".format(
+                    number, time.perf_counter() - start, line), file=report)
+                if watch.failed:
+                    self.batch_depth = 0
+                    self.close_transaction(storage.rollback, depth)
+                    print("*** line {} failed, changes rolled back ***".format(
+                        number))
+                    return False
+                if stop:
+                    break
+        except BaseException:
+            self.batch_depth = 0
+            self.close_transaction(storage.rollback, depth)
+            raise
+        self.batch_depth = 0
+        start = time.perf_counter()
+        try:
+            self.close_transaction(storage.commit, depth)
+        except Exception as error:
+            print("*** write failed: {} ***".format(error))
+            return False
+        print("{} commands in {:.3f} s, saved in {:.3f} s".format(
+            count, start - started, time.perf_counter() - start), file=report)
+        return True
+
+    def close_transaction(self, close, depth):
+        """Closes the savepoints left open down to a transaction
+
+        Args:
+            close (function): storage.commit or storage.rollback.
+            depth (int): The depth of the transaction, as returned by
+                storage.begin.
+        """
+        while storage.depth() >= depth:
+            close()
+
+    def closes_batch(self):
+        """Tells whether closing a savepoint would close the batch's transaction
+
+        Prints an error message if so.
+        """
+        if 0 < self.batch_depth and storage.depth() <= self.batch_depth:
+            print("*** cannot close the transaction of the batch ***")
+            return True
+        return False
+
+    def do_begin(self, arg):
+        """Opens a transaction, or a savepoint inside the open one.
+
+        Changes are only written to disk when the transaction is committed.
+        """
+        storage.begin()
+
+    def do_commit(self, arg):
+        """Closes the innermost savepoint or the transaction, keeping its changes."""
+        if self.closes_batch():
+            return
+        try:
+            storage.commit()
+        except ValueError as error:
+            print("*** {} ***".format(error))
+        except Exception as error:
+            print("*** write failed: {} ***".format(error))
+
+    def do_rollback(self, arg):
+        """Closes the innermost savepoint or the transaction, undoing its changes."""
+        if self.closes_batch():
+            return
+        try:
+            storage.rollback()
+        except ValueError as error:
+            print("*** {} ***".format(error))
+
     def do_emptyline(self):
         """Does nothing upon receiving an empty line"""
         pass
 
+    def default(self, line):
+        """Routes `<class>.<method>(...)` lines to do_default"""
+        return self.do_default(line)
+
     def do_default(self, arg):
         """Default behavior when input is invalid"""
         dict_args = {
@@ -85,6 +506,7 @@ class HBNBCommand(cmd.Cmd):
             "show": self.do_show,
             "destroy": self.do_destroy,
             "track": self.do_count,
+            "count": self.do_count,
             "update": self.do_update
         }
 
@@ -94,21 +516,46 @@ class HBNBCommand(cmd.Cmd):
             found = re.search(r"\((.*?)\)", args_vect[1])
             if found is not None:
                 cmd_list = [args_vect[1][:found.span()[0]], found.group()[1:-1]]
+                if cmd_list[0] in QUERY_METHODS:
+                    return self.do_query(arg)
                 if cmd_list[0] in dict_args.keys():
                     call = "{} {}".format(args_vect[0], cmd_list[1])
                     return dict_args[cmd_list[0]](call)
         print("*** Unknown syntax: {} ***".format(arg))
         return False
 
+    def postcmd(self, stop, line):
+        """Reports the errors met by the background writer"""
+        error = storage.writer_error()
+        if error is not None:
+            print("*** write failed: {} ***".format(error))
+        return stop
+
     def do_exit(self, arg):
         """Quit command to exit program."""
+        self.close_storage()
         return True
 
     def do_EOF(self, arg):
         """EOF signal to exit program."""
         print("")
+        self.close_storage()
         return True
 
+    def close_storage(self):
+        """Writes the pending changes before the console exits"""
+        try:
+            storage.close()
+        except Exception as error:
+            print("*** write failed: {} ***".format(error))
+
+    def do_sync(self, arg):
+        """Writes every pending change to disk."""
+        try:
+            storage.flush()
+        except Exception as error:
+            print("*** write failed: {} ***".format(error))
+
     def do_create(self, arg):
         """Creates a new class instance and prints its ID.
 
@@ -129,44 +576,57 @@ class HBNBCommand(cmd.Cmd):
     def do_show(self, arg):
         """Displays the string representation of a class instance.
 
-        This method displays the string representation of a class instance of a given ID.
+        This method displays the string representation of a class instance of a given ID,
+        or its dictionary with --format json, ndjson or csv.
 
         Args:
             arg (str): The command-line argument string (e.g., "show User 123").
         """
         args_vect = do_parse(arg)
-        obj_dict = storage.all()
+        try:
+            output_format = self.take_format(args_vect)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
         if len(args_vect) == 0:
             print("*** class name missing ***")
         elif args_vect[0] not in HBNBCommand.__classes_0:
             print("*** class does not exist ***")
         elif len(args_vect) == 1:
             print("*** instance id missing ***")
-        elif "{}.{}".format(args_vect[0], args_vect[1]) not in obj_dict:
+        elif storage.get(args_vect[0], args_vect[1]) is None:
             print("*** no instance found ***")
+        elif output_format == "text":
+            print(storage.get(args_vect[0], args_vect[1]))
+        elif output_format == "csv":
+            self.print_objects([storage.get(args_vect[0], args_vect[1])],
+                               "csv", [args_vect[0]])
         else:
-            print(obj_dict["{}.{}".format(args_vect[0], args_vect[1])])
+            print(json.dumps(storage.get(args_vect[0], args_vect[1]).to_dict()))
 
     def do_destroy(self, arg):
         """Deletes a class instance of a given ID.
 
-        This method deletes a class instance of a given ID.
+        This method deletes a class instance of a given ID. With --cascade,
+        the cities, places and reviews depending on it are deleted too, and
+        written in the same save.
 
         Args:
-            arg (str): The command-line argument string (e.g., "destroy User 123").
+            arg (str): The command-line argument string (e.g., "destroy User 123"
+                or "destroy State 123 --cascade").
         """
         args_vect = do_parse(arg)
-        obj_dict = storage.all()
         if len(args_vect) == 0:
-            print("** class name missing **")
+            print("*** class name missing ***")
         elif args_vect[0] not in HBNBCommand.__classes_0:
-            print("** class doesn't exist **")
+            print("*** class doesn't exist ***")
         elif len(args_vect) == 1:
             print("*** instance id missing ***")
-        elif "{}.{}".format(args_vect[0], args_vect[1]) not in obj_dict.keys():
+        elif storage.get(args_vect[0], args_vect[1]) is None:
             print("*** no instance found ***")
         else:
-            del obj_dict["{}.{}".format(args_vect[0], args_vect[1])]
+            storage.delete(storage.get(args_vect[0], args_vect[1]),
+                           cascade="--cascade" in args_vect[2:])
             storage.save()
 
     def do_all(self, arg):
@@ -178,6 +638,14 @@ class HBNBCommand(cmd.Cmd):
         * `all`: Display all instances of all classes.
         * `all <class>`: Display all instances of a specific class.
         * `<class>.all()`: Same as `all <class>`.
+        * `all [<class>] --limit <n> [--offset <n>]`: Display a page of
+          them, followed by a cursor when it is not empty and more remain.
+        * `all [<class>] --cursor <cursor> [--limit <n>]`: Resume after the
+          page the cursor was printed for.
+
+        Instances are printed as they are read, so memory stays flat and
+        the first ones show up at once. With --format json, ndjson or csv
+        the cursor goes to the standard error instead.
 
         **Example:**
 
@@ -194,16 +662,342 @@ class HBNBCommand(cmd.Cmd):
         """
 
         args_vect = do_parse(arg)
+        try:
+            output_format = self.take_format(args_vect)
+            options = parse_flags(args_vect, ("--limit", "--offset",
+                                              "--cursor"))
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        if len(args_vect) > 1:
+            print("*** Unknown syntax: {} ***".format(arg))
+            return False
         if len(args_vect) > 0 and args_vect[0] not in HBNBCommand.__classes_0:
             print("*** class doesn't exist ***")
+            return False
+        cls = args_vect[0] if len(args_vect) > 0 else None
+        try:
+            limit = parse_count(options, "--limit")
+            offset = parse_count(options, "--offset")
+            start, after = 0, None
+            if "--cursor" in options:
+                start, after = decode_cursor(options["--cursor"], cls)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        obj_dict = storage.all(cls)
+        items = iter(obj_dict.items())
+        if start > 0:
+            start, items = resume(obj_dict, start, after)
+        position = start + offset
+        items = islice(items, offset, None if limit is None else offset + limit)
+        last = [None]
+
+        def rows():
+            for key, obj_var in items:
+                last[0] = key
+                yield obj_var
+        count = self.print_objects(rows(), output_format,
+                                   [cls] if cls is not None else None)
+        position += count
+        if limit is not None and 0 < count == limit and \
+                position < len(obj_dict):
+            print("next cursor: {}".format(encode_cursor(cls, position,
+                                                         last[0])),
+                  file=sys.stdout if output_format == "text" else sys.stderr)
+
+    def do_query(self, arg):
+        """
+        Displays the instances of a class satisfying conditions.
+
+        **Usage:**
+
+        * `<class>.where(<condition>, ...)`: Display the matching instances.
+        * `.order_by(<attribute>)`, `.order_by(-<attribute>)`: Sort them,
+          ascending or descending.
+        * `.limit(<n>)`, `.offset(<n>)`: Page through them.
+
+        A condition compares an attribute with a value using one of
+        ==, !=, <, <=, > and >=. A trailing `--format <format>` chooses the
+        output format.
+
+        **Example:**
+
+        * `Place.where(price_by_night<100, max_guest>=4).limit(20)`
+        """
+
+        args_vect = [arg.strip()]
+        flag = re.search(r"\s+(--format\s+\S+)$", args_vect[0])
+        if flag is not None:
+            args_vect = [args_vect[0][:flag.start()]] + flag.group(1).split()
+        found = re.match(r"(\w+)\.(.*)$", args_vect[0])
+        if found is None:
+            print("*** Unknown syntax: {} ***".format(arg))
+            return False
+        if found.group(1) not in HBNBCommand.__classes_0:
+            print("*** class doesn't exist ***")
+            return False
+        try:
+            output_format = self.take_format(args_vect)
+            options = parse_query(found.group(2))
+            if "aggregate" in options:
+                self.print_stats(storage.aggregate(
+                    found.group(1), where=options["where"],
+                    **options["aggregate"]), options["aggregate"],
+                    output_format)
+                return False
+            results = storage.query(found.group(1), **options)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        self.print_objects(results, output_format, [found.group(1)])
+
+    def do_stats(self, arg):
+        """
+        Displays the number of instances of a class and metrics over them,
+        per group.
+
+        **Usage:**
+
+        * `stats <class> [group_by=<attribute>] [<function>=<attribute> ...]`
+        * `<class>.aggregate(group_by=<attribute>, <function>=<attribute>)`
+        * `<class>.where(...).aggregate(...)`: Aggregate the matches only.
+
+        The functions are sum, avg, min and max.
+
+        **Example:**
+
+        * `stats Place group_by=city_id avg=price_by_night max=max_guest`
+        """
+
+        words = arg.split()
+        try:
+            output_format = self.take_format(words)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        if len(words) == 0:
+            print("*** class name missing ***")
+            return False
+        if words[0] not in HBNBCommand.__classes_0:
+            print("*** class doesn't exist ***")
+            return False
+        try:
+            options = parse_aggregate(" ".join(words[1:]))
+            self.print_stats(storage.aggregate(words[0], **options), options,
+                             output_format)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+        return False
+
+    def take_format(self, args_vect):
+        """Removes the --format option from parsed arguments
+
+        Args:
+            args_vect (list): The parsed arguments, modified in place.
+
+        Returns:
+            str: The format given, or the format of the session.
+
+        Raises:
+            ValueError: If the format is unknown or missing.
+        """
+        if "--format" not in args_vect:
+            return self.output_format
+        position = args_vect.index("--format")
+        if position + 1 == len(args_vect):
+            raise ValueError("--format value missing")
+        output_format = args_vect[position + 1]
+        del args_vect[position:position + 2]
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("unknown format: {}".format(output_format))
+        return output_format
+
+    def do_format(self, arg):
+        """Shows or sets the output format of the session.
+
+        Usage: format [text|json|ndjson|csv]
+        """
+        args_vect = do_parse(arg)
+        if len(args_vect) == 0:
+            print(self.output_format)
+        elif args_vect[0] not in OUTPUT_FORMATS:
+            print("*** unknown format: {} ***".format(args_vect[0]))
         else:
-            obj_list = []
-            for obj_var in storage.all().values():
-                if len(args_vect) > 0 and args_vect[0] == obj_var.__class__.__name__:
-                    obj_list.append(obj_var.__str__())
-                elif len(args_vect) == 0:
-                    obj_list.append(obj_var.__str__())
-            print(obj_list)
+            self.output_format = args_vect[0]
+
+    def print_objects(self, objects, output_format="text", classes=None):
+        """Streams objects in an output format, each as it is read
+
+        The text format matches printing the list of the objects' strings
+        at once, without building it. json writes a list of their
+        dictionaries, ndjson one dictionary per line, and csv one row per
+        object under a header naming the class attributes of `classes`,
+        the attributes beyond those going to an "extra" JSON column.
+
+        Args:
+            objects (iterable): The objects to print.
+            output_format (str): One of OUTPUT_FORMATS.
+            classes (list): The class names listed, or None for all.
+
+        Returns:
+            int: The number of objects printed.
+        """
+        count = 0
+        if output_format == "csv":
+            columns = csv_columns(classes or sorted(HBNBCommand.__classes_0))
+            writer = csv.writer(sys.stdout, lineterminator="\n")
+            writer.writerow(columns)
+        elif output_format != "ndjson":
+            sys.stdout.write("[")
+        for obj_var in objects:
+            if output_format == "text":
+                if count > 0:
+                    sys.stdout.write(", ")
+                sys.stdout.write(repr(obj_var.__str__()))
+            elif output_format == "json":
+                if count > 0:
+                    sys.stdout.write(", ")
+                sys.stdout.write(json.dumps(obj_var.to_dict()))
+            elif output_format == "ndjson":
+                sys.stdout.write(json.dumps(obj_var.to_dict()) + "\n")
+            else:
+                writer.writerow(csv_row(obj_var.to_dict(), columns))
+            count += 1
+            if count == 1 or count % STREAM_FLUSH == 0:
+                sys.stdout.flush()
+        if output_format in ("text", "json"):
+            sys.stdout.write("]\n")
+        return count
+
+    def print_stats(self, results, options, output_format="text"):
+        """Prints aggregation results
+
+        In text, the results are printed as a dictionary, unwrapped when
+        there is a single group. The other formats write one record per
+        group, holding its "group" value and its metrics.
+        """
+        if output_format == "text":
+            if "group_by" in options:
+                print(results)
+            else:
+                print(results.get(None, {"count": 0}))
+            return
+        records = [dict(group=group, **metrics)
+                   for group, metrics in results.items()]
+        if output_format == "json":
+            print(json.dumps(records))
+        elif output_format == "ndjson":
+            for record in records:
+                print(json.dumps(record))
+        else:
+            columns = ["group", "count"]
+            for record in records:
+                columns.extend(name for name in record if name not in columns)
+            writer = csv.DictWriter(sys.stdout, columns,
+                                    lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(records)
+
+    def do_near(self, arg):
+        """
+        Displays the places within a distance of a point, nearest first.
+
+        **Usage:**
+
+        * `near <latitude> <longitude> <radius_km>`
+
+        **Example:**
+
+        * `near 48.8566 2.3522 5`: Places less than 5 km from central Paris.
+        """
+
+        if not hasattr(storage, "places_within"):
+            print("*** not supported by this storage engine ***")
+            return False
+        args_vect = do_parse(arg)
+        try:
+            output_format = self.take_format(args_vect)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        try:
+            lat, lon, radius_km = (float(i) for i in args_vect)
+            if not all(map(math.isfinite, (lat, lon, radius_km))):
+                raise ValueError
+        except ValueError:
+            print("*** usage: near <latitude> <longitude> <radius_km> ***")
+            return False
+        self.print_objects(storage.places_within(lat, lon, radius_km),
+                           output_format, ["Place"])
+
+    def do_bbox(self, arg):
+        """
+        Displays the places inside a bounding box.
+
+        **Usage:**
+
+        * `bbox <south> <west> <north> <east>`
+
+        A west edge greater than the east edge crosses the antimeridian.
+
+        **Example:**
+
+        * `bbox 48.8 2.2 48.9 2.4`: Places in central Paris.
+        """
+
+        if not hasattr(storage, "places_in_bbox"):
+            print("*** not supported by this storage engine ***")
+            return False
+        args_vect = do_parse(arg)
+        try:
+            output_format = self.take_format(args_vect)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        try:
+            south, west, north, east = (float(i) for i in args_vect)
+            if not all(map(math.isfinite, (south, west, north, east))):
+                raise ValueError
+        except ValueError:
+            print("*** usage: bbox <south> <west> <north> <east> ***")
+            return False
+        self.print_objects(storage.places_in_bbox(south, west, north, east),
+                           output_format, ["Place"])
+
+    def do_search(self, arg):
+        """
+        Displays the instances whose text attributes match a query.
+
+        **Usage:**
+
+        * `search [<class>] <term> ... [OR <term> ...]`
+
+        Every term of an alternative must match; a term ending with "*"
+        matches every word starting with it.
+
+        **Example:**
+
+        * `search Place cozy loft OR barn*`
+        """
+
+        if not hasattr(storage, "search"):
+            print("*** not supported by this storage engine ***")
+            return False
+        words = arg.split()
+        try:
+            output_format = self.take_format(words)
+        except ValueError as error:
+            print("*** {} ***".format(error))
+            return False
+        cls = None
+        if len(words) > 0 and words[0] in HBNBCommand.__classes_0:
+            cls = words.pop(0)
+        if len(words) == 0:
+            print("*** search terms missing ***")
+            return False
+        self.print_objects(storage.search(" ".join(words), cls),
+                           output_format, [cls] if cls is not None else None)
 
     def do_count(self, arg):
         """
@@ -228,11 +1022,10 @@ class HBNBCommand(cmd.Cmd):
         """
 
         args_vect = do_parse(arg)
-        track = 0
-        for obj_var in storage.all().values():
-            if args_vect[0] == obj_var.__class__.__name__:
-                track += 1
-        print(track)
+        if len(args_vect) == 0:
+            print("*** class name missing ***")
+            return False
+        print(storage.count(args_vect[0]))
 
     def do_update(self, arg):
         """
@@ -260,7 +1053,6 @@ class HBNBCommand(cmd.Cmd):
         """
 
         args_vect = do_parse(arg)
-        obj_dict = storage.all()
 
         if len(args_vect) == 0:
             print("*** class name missing ***")
@@ -271,7 +1063,8 @@ class HBNBCommand(cmd.Cmd):
         if len(args_vect) == 1:
             print("*** instance id missing ***")
             return False
-        if "{}.{}".format(args_vect[0], args_vect[1]) not in obj_dict.keys():
+        obj_var = storage.get(args_vect[0], args_vect[1])
+        if obj_var is None:
             print("*** no instance found ***")
             return False
         if len(args_vect) == 2:
@@ -285,23 +1078,56 @@ class HBNBCommand(cmd.Cmd):
                 return False
 
         if len(args_vect) == 4:
-            obj_var = obj_dict["{}.{}".format(args_vect[0], args_vect[1])]
             if args_vect[2] in obj_var.__class__.__dict__.keys():
                 value_type = type(obj_var.__class__.__dict__[args_vect[2]])
-                obj_var.__dict__[args_vect[2]] = value_type(args_vect[3])
+                if value_type is list:
+                    value = parse_value(args_vect[3])
+                    if type(value) is not list:
+                        value = [value]
+                    setattr(obj_var, args_vect[2], value)
+                else:
+                    setattr(obj_var, args_vect[2], value_type(args_vect[3]))
             else:
-                obj_var.__dict__[args_vect[2]] = args_vect[3]
+                setattr(obj_var, args_vect[2], args_vect[3])
         elif type(eval(args_vect[2])) == dict:
-            obj_var = obj_dict["{}.{}".format(args_vect[0], args_vect[1])]
             for key, value in eval(args_vect[2]).items():
                 if (key in obj_var.__class__.__dict__.keys() and
                         type(obj_var.__class__.__dict__[key]) in {str, int, float}):
                     value_type = type(obj_var.__class__.__dict__[key])
-                    obj_var.__dict__[key] = value_type(value)
+                    setattr(obj_var, key, value_type(value))
                 else:
-                    obj_var.__dict__[key] = value
+                    setattr(obj_var, key, value)
         storage.save()
 
 
 if __name__ == "__main__":
-    HBNBCommand().cmdloop()
+    parser = argparse.ArgumentParser(description="HolbertonBnB console")
+    parser.add_argument("--durability", choices=("immediate", "grouped", "async"),
+                        default="immediate",
+                        help="write on every command, coalesce writes "
+                             "or leave them to a background thread")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="text",
+                        help="output format of show, all and the queries")
+    batch = parser.add_mutually_exclusive_group()
+    batch.add_argument("--script", type=argparse.FileType("r"),
+                       help="run the commands of a file as one transaction")
+    batch.add_argument("--stdin-batch", action="store_true",
+                       help="run the commands read from the standard input "
+                            "as one transaction")
+    options = parser.parse_args()
+    try:
+        storage.durability(options.durability)
+    except ValueError as error:
+        parser.error(error)
+    console = HBNBCommand()
+    console.output_format = options.format
+    if options.script is not None:
+        with options.script:
+            succeeded = console.run_batch(options.script)
+    elif options.stdin_batch:
+        succeeded = console.run_batch(sys.stdin)
+    else:
+        console.cmdloop()
+        succeeded = True
+    storage.close()
+    sys.exit(0 if succeeded else 1)
@@ -19,10 +19,13 @@ Unittests for `console.py`, covering various functionalities of the HBNBCommand
     - HBNBCommand class: [link to console.HBNBCommand documentation]
 """
 
+import csv
+import json
 import os
 import sys
 import unittest
 from models.engine.file_storage import FileStorage
+from models.engine.sqlite_storage import SQLiteStorage
 from console import HBNBCommand
 from io import StringIO
 from unittest.mock import patch
@@ -1757,6 +1760,581 @@ class TestHBNBCommandCount(unittest.TestCase):
             self.assertFalse(HBNBCommand().onecmd("Review.do_count()"))
             self.assertEqual("3", output.getvalue().strip())
 
+
+class TestHBNBCommandSync(unittest.TestCase):
+    """Unittests for testing the sync command"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+
+    def tearDown(self):
+        storage.durability("immediate")
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def test_syncWritesGroupedCommands(self):
+        storage.durability("grouped", window=60, size=1000)
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("create Place"))
+        self.assertFalse(os.path.exists("file.json"))
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("sync"))
+            self.assertEqual("", output.getvalue())
+        self.assertTrue(os.path.exists("file.json"))
+
+    def test_exitDrainsAsyncWriter(self):
+        storage.durability("async")
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("create Place"))
+            self.assertTrue(HBNBCommand().onecmd("EOF"))
+        with open("file.json") as file_0:
+            self.assertIn(output.getvalue().split()[0], file_0.read())
+
+
+class TestHBNBCommandQuery(unittest.TestCase):
+    """Unittests for testing the query chains"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        self.ids = []
+        for price in (50, 150, 80):
+            with patch("sys.stdout", new=StringIO()) as output:
+                HBNBCommand().onecmd("create Place")
+            place_id = output.getvalue().strip()
+            self.ids.append(place_id)
+            with patch("sys.stdout", new=StringIO()):
+                HBNBCommand().onecmd("update Place {} price_by_night {}"
+                                     .format(place_id, price))
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def query(self, line):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd(line))
+        return output.getvalue().strip()
+
+    def test_where(self):
+        output = self.query("Place.where(price_by_night<100)")
+        self.assertIn(self.ids[0], output)
+        self.assertNotIn(self.ids[1], output)
+        self.assertIn(self.ids[2], output)
+
+    def test_orderAndLimit(self):
+        output = self.query("Place.where(price_by_night>0)"
+                            ".order_by(-price_by_night).limit(2)")
+        self.assertLess(output.index(self.ids[1]), output.index(self.ids[2]))
+        self.assertNotIn(self.ids[0], output)
+
+    def test_updateListAttribute(self):
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd('update Place {} amenity_ids ["a", "b"]'
+                                 .format(self.ids[0]))
+            HBNBCommand().onecmd("update Place {} amenity_ids b"
+                                 .format(self.ids[1]))
+        self.assertEqual(["a", "b"],
+                         storage.get("Place", self.ids[0]).amenity_ids)
+        self.assertEqual(2, storage.count_members("Place", "amenity_ids",
+                                                  all_of=["b"]))
+
+    def test_updateMovesRange(self):
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd("update Place {} price_by_night 90"
+                                 .format(self.ids[1]))
+        self.assertEqual([50, 80, 90], [
+            place.price_by_night for place in storage.by_range(
+                "Place", "price_by_night", high=100)])
+
+    def test_stats(self):
+        self.assertEqual("{{'count': 3, 'avg(price_by_night)': {}}}"
+                         .format(280 / 3),
+                         self.query("stats Place avg=price_by_night"))
+        self.assertEqual("{'': {'count': 3, 'max(price_by_night)': 150}}",
+                         self.query("stats Place group_by=city_id "
+                                    "max=price_by_night"))
+
+    def test_aggregateChain(self):
+        self.assertEqual("{'count': 2, 'sum(price_by_night)': 130}",
+                         self.query("Place.where(price_by_night<100)"
+                                    ".aggregate(sum=price_by_night)"))
+        self.assertEqual("*** unknown aggregate: median ***",
+                         self.query("Place.aggregate(median=max_guest)"))
+
+    def test_count(self):
+        with patch.object(FileStorage, "all") as all:
+            self.assertEqual("3", self.query("count Place"))
+            self.assertEqual("3", self.query("Place.count()"))
+        all.assert_not_called()
+        self.assertEqual("*** class name missing ***", self.query("count"))
+
+    def test_invalidClass(self):
+        self.assertEqual("*** class doesn't exist ***",
+                         self.query("Nope.where(price_by_night<100)"))
+
+    def test_invalidChain(self):
+        self.assertEqual("*** invalid limit: x ***",
+                         self.query("Place.where(max_guest>1).limit(x)"))
+        self.assertEqual("*** invalid condition: max_guest ***",
+                         self.query("Place.where(max_guest)"))
+
+
+class TestHBNBCommandGeo(unittest.TestCase):
+    """Unittests for testing the near and bbox commands"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("create Place")
+        self.place_id = output.getvalue().strip()
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd('Place.update("{}", {{"latitude": 48.86, '
+                                 '"longitude": 2.34}})'.format(self.place_id))
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def test_near(self):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("near 48.85 2.35 5"))
+        self.assertIn(self.place_id, output.getvalue())
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("near 40.71 -74.00 5"))
+        self.assertEqual("[]", output.getvalue().strip())
+
+    def test_bbox(self):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("bbox 48.8 2.3 48.9 2.4"))
+        self.assertIn(self.place_id, output.getvalue())
+
+    def test_invalidArguments(self):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("near 48.85 east 5"))
+        self.assertEqual("*** usage: near <latitude> <longitude> "
+                         "<radius_km> ***", output.getvalue().strip())
+
+    def test_nonFiniteArguments(self):
+        for line in ("near nan 0 5", "near 0 0 inf"):
+            with patch("sys.stdout", new=StringIO()) as output:
+                self.assertFalse(HBNBCommand().onecmd(line))
+            self.assertEqual("*** usage: near <latitude> <longitude> "
+                             "<radius_km> ***", output.getvalue().strip())
+        for line in ("bbox 0 0 inf 1", "bbox nan 0 1 1"):
+            with patch("sys.stdout", new=StringIO()) as output:
+                self.assertFalse(HBNBCommand().onecmd(line))
+            self.assertEqual("*** usage: bbox <south> <west> <north> "
+                             "<east> ***", output.getvalue().strip())
+
+    def test_nonFinitePosition(self):
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("update Place {} latitude inf"
+                                 .format(self.place_id))
+        self.assertEqual("", output.getvalue().strip())
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd("near 48.85 2.35 5"))
+        self.assertEqual("[]", output.getvalue().strip())
+
+    def test_unsupportedEngine(self):
+        with patch("console.storage", SQLiteStorage()):
+            for line in ("near 48.85 2.35 5", "bbox 48.8 2.3 48.9 2.4"):
+                with patch("sys.stdout", new=StringIO()) as output:
+                    self.assertFalse(HBNBCommand().onecmd(line))
+                self.assertEqual("*** not supported by this storage "
+                                 "engine ***", output.getvalue().strip())
+
+
+class TestHBNBCommandSearch(unittest.TestCase):
+    """Unittests for testing the search command"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("create Place")
+        self.place_id = output.getvalue().strip()
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd('update Place {} description "Cozy loft"'
+                                 .format(self.place_id))
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def search(self, line):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd(line))
+        return output.getvalue().strip()
+
+    def test_search(self):
+        self.assertIn(self.place_id, self.search("search Place coz* loft"))
+        self.assertIn(self.place_id, self.search("search barn OR loft"))
+        self.assertEqual("[]", self.search("search City loft"))
+
+    def test_unsupportedEngine(self):
+        with patch("console.storage", SQLiteStorage()):
+            with patch("sys.stdout", new=StringIO()) as output:
+                self.assertFalse(HBNBCommand().onecmd("search Place loft"))
+        self.assertEqual("*** not supported by this storage engine ***",
+                         output.getvalue().strip())
+
+    def test_searchTermsMissing(self):
+        self.assertEqual("*** search terms missing ***",
+                         self.search("search Place"))
+
+
+class TestHBNBCommandCascade(unittest.TestCase):
+    """Unittests for testing the cascading destroy"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        self.ids = []
+        for line in ("create State", "create City", "create Place"):
+            with patch("sys.stdout", new=StringIO()) as output:
+                HBNBCommand().onecmd(line)
+            self.ids.append(output.getvalue().strip())
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd("update City {} state_id {}".format(
+                self.ids[1], self.ids[0]))
+            HBNBCommand().onecmd("update Place {} city_id {}".format(
+                self.ids[2], self.ids[1]))
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def test_destroyCascade(self):
+        with patch.object(FileStorage, "save") as save:
+            with patch("sys.stdout", new=StringIO()) as output:
+                self.assertFalse(HBNBCommand().onecmd(
+                    "destroy State {} --cascade".format(self.ids[0])))
+        self.assertEqual("", output.getvalue())
+        save.assert_called_once()
+        self.assertIsNone(storage.get("Place", self.ids[2]))
+
+    def test_destroyKeepsDependents(self):
+        with patch("sys.stdout", new=StringIO()):
+            HBNBCommand().onecmd("destroy State {}".format(self.ids[0]))
+        self.assertIsNotNone(storage.get("City", self.ids[1]))
+
+
+class TestHBNBCommandAllPages(unittest.TestCase):
+    """Unittests for testing the streamed, paginated all command"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        self.ids = []
+        for i in range(5):
+            with patch("sys.stdout", new=StringIO()) as output:
+                HBNBCommand().onecmd("create Place")
+            self.ids.append(output.getvalue().strip())
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def all(self, line):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse(HBNBCommand().onecmd(line))
+        return output.getvalue()
+
+    def listed(self, output):
+        return [place_id for place_id in self.ids if place_id in output]
+
+    def test_sameFormat(self):
+        objects = storage.all("Place").values()
+        self.assertEqual("{}\n".format([str(obj) for obj in objects]),
+                         self.all("all Place"))
+
+    def test_limitOffset(self):
+        output = self.all("all Place --limit 2 --offset 1")
+        self.assertEqual(self.ids[1:3], self.listed(output))
+        self.assertTrue(output.splitlines()[-1].startswith("next cursor: "))
+        self.assertEqual(2, len(self.all("all Place --offset 3")
+                                .splitlines()[0].split("[Place]")) - 1)
+
+    def test_cursor(self):
+        output = self.all("all Place --limit 2")
+        cursor = output.splitlines()[-1].split()[-1]
+        storage.delete(storage.get("Place", self.ids[0]))
+        output = self.all("all Place --limit 2 --cursor " + cursor)
+        self.assertEqual(self.ids[2:4], self.listed(output))
+        cursor = output.splitlines()[-1].split()[-1]
+        output = self.all("all Place --limit 2 --cursor " + cursor)
+        self.assertEqual(self.ids[4:], self.listed(output))
+        self.assertEqual(1, len(output.splitlines()))
+
+    def test_emptyPageHasNoCursor(self):
+        self.assertEqual("[]\n", self.all("all Place --limit 0"))
+
+    def test_invalidOptions(self):
+        self.assertEqual("*** invalid cursor ***\n",
+                         self.all("all Place --cursor nope"))
+        cursor = self.all("all Place --limit 1").splitlines()[-1].split()[-1]
+        self.assertEqual("*** invalid cursor ***\n",
+                         self.all("all City --cursor " + cursor))
+        self.assertEqual("*** invalid limit: -1 ***\n",
+                         self.all("all Place --limit -1"))
+        self.assertEqual("*** --limit value missing ***\n",
+                         self.all("all Place --limit"))
+
+
+class TestHBNBCommandFormats(unittest.TestCase):
+    """Unittests for testing the output formats"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        self.places = []
+        for i in range(3):
+            with patch("sys.stdout", new=StringIO()) as output:
+                HBNBCommand().onecmd("create Place")
+            place = storage.get("Place", output.getvalue().strip())
+            place.price_by_night = 100 * i
+            place.amenity_ids = ["wifi"]
+            place.pets = "yes"
+            self.places.append(place)
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def run_command(self, line, console=None):
+        with patch("sys.stdout", new=StringIO()) as output:
+            self.assertFalse((console or HBNBCommand()).onecmd(line))
+        return output.getvalue()
+
+    def test_json(self):
+        self.assertEqual([p.to_dict() for p in self.places],
+                         json.loads(self.run_command(
+                             "all Place --format json")))
+        self.assertEqual(self.places[1].to_dict(), json.loads(
+            self.run_command("show Place {} --format json".format(
+                self.places[1].id))))
+
+    def test_ndjson(self):
+        output = self.run_command(
+            "Place.where(price_by_night >= 100) --format ndjson")
+        self.assertEqual([p.to_dict() for p in self.places[1:]],
+                         [json.loads(line) for line in output.splitlines()])
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(
+            self.run_command("all Place --format csv"))))
+        self.assertEqual([p.id for p in self.places], [r["id"] for r in rows])
+        self.assertEqual("200", rows[2]["price_by_night"])
+        self.assertEqual('["wifi"]', rows[2]["amenity_ids"])
+        self.assertEqual({"pets": "yes"}, json.loads(rows[2]["extra"]))
+
+    def test_cursorOnStderr(self):
+        with patch("sys.stderr", new=StringIO()) as error:
+            output = self.run_command("all Place --limit 1 --format ndjson")
+        self.assertEqual(1, len(output.splitlines()))
+        self.assertTrue(error.getvalue().startswith("next cursor: "))
+
+    def test_stats(self):
+        self.assertEqual([{"group": None, "count": 3,
+                           "sum(price_by_night)": 300}],
+                         json.loads(self.run_command(
+                             "stats Place sum=price_by_night --format json")))
+
+    def test_sessionFormat(self):
+        console = HBNBCommand()
+        self.assertEqual("text\n", self.run_command("format", console))
+        self.run_command("format ndjson", console)
+        self.assertEqual(3, len(self.run_command("all Place",
+                                                 console).splitlines()))
+        self.assertEqual("[", self.run_command(
+            "all Place --format text", console)[0])
+
+    def test_unknownFormat(self):
+        self.assertEqual("*** unknown format: xml ***\n",
+                         self.run_command("all Place --format xml"))
+        self.assertEqual("*** unknown format: xml ***\n",
+                         self.run_command("format xml"))
+        self.assertEqual("*** --format value missing ***\n",
+                         self.run_command("search loft --format"))
+
+
+class TestHBNBCommandBatch(unittest.TestCase):
+    """Unittests for testing the transactional batch runner"""
+
+    def setUp(self):
+        try:
+            os.rename("file.json", "temp")
+        except IOError:
+            pass
+        storage.reload()
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("create State")
+        self.state_id = output.getvalue().strip()
+
+    def tearDown(self):
+        try:
+            os.remove("file.json")
+        except IOError:
+            pass
+        try:
+            os.rename("temp", "file.json")
+        except IOError:
+            pass
+        storage.reload()
+
+    def run_batch(self, lines):
+        report = StringIO()
+        with patch("sys.stdout", new=StringIO()) as output:
+            succeeded = HBNBCommand().run_batch(lines, report)
+        return succeeded, output.getvalue(), report.getvalue()
+
+    def test_singleSave(self):
+        lines = ['update State {} name "n{}"'.format(self.state_id, i)
+                 for i in range(20)] + ["", "# done", "create City"]
+        with patch.object(FileStorage, "_FileStorage__write_snapshot") as \
+                write:
+            succeeded, output, report = self.run_batch(lines)
+        self.assertTrue(succeeded)
+        self.assertEqual(1, write.call_count)
+        self.assertEqual(22, len(report.splitlines()))
+        self.assertTrue(report.splitlines()[-1].startswith("21 commands in"))
+        self.assertEqual("n19", storage.get("State", self.state_id).name)
+
+    def test_rollback(self):
+        lines = ["create City",
+                 'update State {} name "Lagos"'.format(self.state_id),
+                 "show State nope", "create Place"]
+        succeeded, output, report = self.run_batch(lines)
+        self.assertFalse(succeeded)
+        self.assertEqual("*** line 3 failed, changes rolled back ***",
+                         output.splitlines()[-1])
+        self.assertEqual(3, len(report.splitlines()))
+        self.assertEqual(0, storage.count("City"))
+        self.assertEqual(0, storage.count("Place"))
+        self.assertEqual("", storage.get("State", self.state_id).name)
+
+    def test_destroyFailure(self):
+        lines = ['update State {} name "Lagos"'.format(self.state_id),
+                 "destroy Statee {}".format(self.state_id),
+                 'update State {} name "Oops"'.format(self.state_id)]
+        succeeded, output, report = self.run_batch(lines)
+        self.assertFalse(succeeded)
+        self.assertEqual("*** class doesn't exist ***",
+                         output.splitlines()[0])
+        storage.reload()
+        self.assertEqual("", storage.get("State", self.state_id).name)
+
+    def test_savepoints(self):
+        lines = ["begin", "create City", "rollback",
+                 'update State {} name "Lagos"'.format(self.state_id),
+                 "begin", "create Place", "commit"]
+        succeeded, output, report = self.run_batch(lines)
+        self.assertTrue(succeeded)
+        storage.reload()
+        self.assertEqual(0, storage.count("City"))
+        self.assertEqual(1, storage.count("Place"))
+        self.assertEqual("Lagos", storage.get("State", self.state_id).name)
+
+    def test_closingBatchTransaction(self):
+        for closing in ("commit", "rollback"):
+            lines = ["create State", closing, "create City",
+                     "show State nope"]
+            succeeded, output, report = self.run_batch(lines)
+            self.assertFalse(succeeded)
+            self.assertEqual(
+                ["*** cannot close the transaction of the batch ***",
+                 "*** line 2 failed, changes rolled back ***"],
+                output.splitlines()[1:])
+            storage.reload()
+            self.assertEqual(1, storage.count("State"))
+            self.assertEqual(0, storage.count("City"))
+            self.assertEqual(0, storage.depth())
+
+    def test_transactionCommands(self):
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("commit")
+            HBNBCommand().onecmd("rollback")
+        self.assertEqual("*** no transaction ***\n" * 2, output.getvalue())
+        with patch("sys.stdout", new=StringIO()) as output:
+            HBNBCommand().onecmd("begin")
+            HBNBCommand().onecmd("create City")
+            HBNBCommand().onecmd("rollback")
+        self.assertEqual(0, storage.count("City"))
+
+
 if __name__ == "__main__":
     unittest.main()
 
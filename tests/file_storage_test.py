@@ -0,0 +1,1192 @@
+#!/usr/bin/python3
+"""Unittests for `models/engine/file_storage.py`."""
+
+import gc
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import models
+from models.engine.file_storage import FileStorage
+from models.amenity import Amenity
+from models.city import City
+from models.place import Place
+from models.review import Review
+from models.state import State
+from models.user import User
+
+
+class TestFileStorageBase(unittest.TestCase):
+    """Runs every test against an empty storage in a temporary directory"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "file.json")
+        for name, value in (("__file_path", self.path),
+                            ("__journal", False),
+                            ("__journal_threshold", 4 * 1024 * 1024),
+                            ("__cache", True),
+                            ("__lazy", False),
+                            ("__durability", "immediate"),
+                            ("__pending", 0),
+                            ("__index_fields", {
+                                name: list(attrs) for name, attrs in
+                                FileStorage._FileStorage__index_fields.items()
+                            }),
+                            ("__materialized", dict(
+                                FileStorage._FileStorage__materialized))):
+            patcher = patch.object(FileStorage, "_FileStorage" + name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage = models.storage
+        self.storage.reload()
+
+    def tearDown(self):
+        self.storage.durability("immediate")
+        self.storage.thread_safe(False)
+        self.storage.compact(wait=True)
+        self.storage.reload()
+        shutil.rmtree(self.tmp_dir)
+
+
+class TestFileStorageJournal(TestFileStorageBase):
+    """Unittests for the append-only journal mode"""
+
+    def test_saveAppendsOnlyChanges(self):
+        self.storage.journal(True)
+        place = Place()
+        State()
+        self.storage.save()
+        place.name = "Loft"
+        self.storage.touch(place)
+        self.storage.save()
+        with open(self.path + ".log") as file_0:
+            entries = [json.loads(line) for line in file_0]
+        self.assertEqual(3, len(entries))
+        self.assertEqual("Loft", entries[-1]["Place." + place.id]["name"])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_reloadReplaysTombstones(self):
+        self.storage.journal(True)
+        place = Place()
+        state = State()
+        self.storage.save()
+        self.storage.delete(state)
+        self.storage.save()
+        self.storage.reload()
+        self.assertIn("Place." + place.id, self.storage.all())
+        self.assertNotIn("State." + state.id, self.storage.all())
+
+    def test_compactFoldsJournal(self):
+        self.storage.journal(True, threshold=1)
+        place = Place()
+        self.storage.save()
+        self.storage.compact(wait=True)
+        self.assertFalse(os.path.exists(self.path + ".log"))
+        self.assertFalse(os.path.exists(self.path + ".log.1"))
+        with open(self.path) as file_0:
+            self.assertIn("Place." + place.id, json.load(file_0))
+        self.storage.reload()
+        self.assertIn("Place." + place.id, self.storage.all())
+
+    def test_snapshotSaveDiscardsJournal(self):
+        self.storage.journal(True)
+        Place()
+        self.storage.save()
+        self.storage.journal(False)
+        self.storage.save()
+        self.assertFalse(os.path.exists(self.path + ".log"))
+        self.assertEqual(1, len(self.storage.all()))
+
+    def test_failedAppendKeepsChanges(self):
+        self.storage.journal(True)
+        os.mkdir(self.path + ".log")
+        place = Place()
+        with self.assertRaises(OSError):
+            self.storage.save()
+        os.rmdir(self.path + ".log")
+        self.storage.flush()
+        self.storage.reload()
+        self.assertIn("Place." + place.id, self.storage.all())
+
+
+class TestFileStorageDirty(TestFileStorageBase):
+    """Unittests for dirty tracking and the fragment cache"""
+
+    def test_attributeWriteMarksDirty(self):
+        place = Place()
+        self.storage.save()
+        self.assertFalse(place.is_dirty())
+        place.name = "Loft"
+        self.assertTrue(place.is_dirty())
+        self.storage.save()
+        self.assertFalse(place.is_dirty())
+
+    def test_saveReencodesOnlyDirty(self):
+        place = Place()
+        state = State()
+        self.storage.save()
+        place.name = "Loft"
+        with patch.object(State, "to_dict") as to_dict:
+            self.storage.save()
+        to_dict.assert_not_called()
+        with open(self.path) as file_0:
+            obj_dict = json.load(file_0)
+        self.assertEqual("Loft", obj_dict["Place." + place.id]["name"])
+        self.assertIn("State." + state.id, obj_dict)
+
+    def test_saveWritesOneRecordPerLine(self):
+        Place()
+        State()
+        self.storage.save()
+        with open(self.path) as file_0:
+            self.assertEqual(4, len(file_0.readlines()))
+
+    def test_unregisteredWriteIsNotTracked(self):
+        place = Place(id="loose", created_at="2017-09-28T21:05:54.119427",
+                      updated_at="2017-09-28T21:05:54.119427")
+        place.name = "Loft"
+        self.assertFalse(place.is_dirty())
+        self.assertEqual([], self.storage.search("loft"))
+
+    def test_writeRefreshesCoveringIndexesOnly(self):
+        place = Place()
+        place.name = "Loft"
+        with patch("models.engine.indexes.TextIndex.refresh") as refresh:
+            place.number_rooms = 3
+        refresh.assert_not_called()
+        place.description = "Sunny"
+        self.assertEqual([place], self.storage.search("sunny"))
+
+
+class TestFileStorageGrouped(TestFileStorageBase):
+    """Unittests for group-commit write coalescing"""
+
+    def test_groupedSavesAreCoalesced(self):
+        self.storage.durability("grouped", window=60, size=3)
+        Place()
+        self.storage.save()
+        State()
+        self.storage.save()
+        self.assertFalse(os.path.exists(self.path))
+        Place()
+        self.storage.save()
+        with open(self.path) as file_0:
+            self.assertEqual(3, len(json.load(file_0)))
+
+    def test_groupedWindowElapsed(self):
+        self.storage.durability("grouped", window=0, size=1000)
+        Place()
+        self.storage.save()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_lonePendingSaveIsWritten(self):
+        self.storage.durability("grouped", window=0.05, size=1000)
+        place = Place()
+        self.storage.save()
+        self.assertFalse(os.path.exists(self.path))
+        time.sleep(0.5)
+        with open(self.path) as file_0:
+            self.assertIn("Place." + place.id, json.load(file_0))
+
+    def test_flushWritesPendingSaves(self):
+        self.storage.durability("grouped", window=60, size=1000)
+        place = Place()
+        self.storage.save()
+        self.storage.flush()
+        with open(self.path) as file_0:
+            self.assertIn("Place." + place.id, json.load(file_0))
+
+    def test_unknownDurability(self):
+        with self.assertRaises(ValueError):
+            self.storage.durability("eventually")
+
+
+class TestFileStorageAsync(TestFileStorageBase):
+    """Unittests for the background writer thread"""
+
+    def test_flushDrainsQueue(self):
+        self.storage.durability("async")
+        place = Place()
+        self.storage.save()
+        place.name = "Loft"
+        self.storage.save()
+        self.storage.flush()
+        with open(self.path) as file_0:
+            obj_dict = json.load(file_0)
+        self.assertEqual("Loft", obj_dict["Place." + place.id]["name"])
+
+    def test_closeStopsWriter(self):
+        self.storage.durability("async")
+        place = Place()
+        self.storage.save()
+        self.storage.close()
+        self.assertIsNone(FileStorage._FileStorage__writer)
+        self.storage.reload()
+        self.assertIn("Place." + place.id, self.storage.all())
+
+    def test_writerErrorIsReported(self):
+        self.storage.durability("async")
+        missing = os.path.join(self.tmp_dir, "missing", "file.json")
+        with patch.object(FileStorage, "_FileStorage__file_path", missing):
+            Place()
+            self.storage.save()
+            with self.assertRaises(OSError):
+                self.storage.flush()
+        self.assertIsNone(self.storage.writer_error())
+
+    def test_failedJournalWriteIsRetried(self):
+        self.storage.journal(True)
+        self.storage.durability("async")
+        os.mkdir(self.path + ".log")
+        place = Place()
+        with self.assertRaises(OSError):
+            self.storage.flush()
+        os.rmdir(self.path + ".log")
+        self.storage.flush()
+        self.storage.close()
+        self.storage.reload()
+        self.assertIn("Place." + place.id, self.storage.all())
+
+
+class TestFileStorageStreaming(TestFileStorageBase):
+    """Unittests for the streamed snapshot and compaction"""
+
+    def test_saveWithoutCache(self):
+        self.storage.fragment_cache(False)
+        places = [Place() for i in range(3)]
+        with patch.object(FileStorage, "_FileStorage__buffer_size", 1):
+            self.storage.save()
+        self.assertEqual({}, FileStorage._FileStorage__fragments)
+        with open(self.path) as file_0:
+            obj_dict = json.load(file_0)
+        self.assertEqual(["Place." + place.id for place in places],
+                         list(obj_dict))
+
+    def test_compactKeepsRecordOrder(self):
+        first, second, third = Place(), State(), Place()
+        self.storage.save()
+        self.storage.journal(True)
+        second.name = "California"
+        self.storage.delete(first)
+        self.storage.save()
+        self.storage.compact(wait=True)
+        with open(self.path) as file_0:
+            obj_dict = json.load(file_0)
+        self.assertEqual(["State." + second.id, "Place." + third.id],
+                         list(obj_dict))
+        self.assertEqual("California",
+                         obj_dict["State." + second.id]["name"])
+
+    def test_compactSingleLineSnapshot(self):
+        place = Place()
+        with open(self.path, "w") as file_0:
+            json.dump({"Place." + place.id: place.to_dict()}, file_0)
+        self.storage.journal(True)
+        state = State()
+        self.storage.save()
+        self.storage.compact(wait=True)
+        with open(self.path) as file_0:
+            self.assertEqual(["Place." + place.id, "State." + state.id],
+                             list(json.load(file_0)))
+
+
+class TestFileStorageLazy(TestFileStorageBase):
+    """Unittests for the lazy, offset-indexed reload"""
+
+    def setUp(self):
+        super().setUp()
+        self.place, self.state = Place(), State()
+        self.place.name = "Loft"
+        self.storage.save()
+        self.storage.lazy_load(True)
+
+    def test_reloadDecodesNothing(self):
+        with patch.object(Place, "__init__") as init:
+            self.storage.reload()
+        init.assert_not_called()
+        self.assertEqual({}, FileStorage._FileStorage__objects)
+
+    def test_getDecodesOneRecord(self):
+        self.storage.reload()
+        place = self.storage.get("Place", self.place.id)
+        self.assertEqual(self.place.to_dict(), place.to_dict())
+        self.assertIs(place, self.storage.get("Place", self.place.id))
+        self.assertEqual(["Place." + self.place.id],
+                         list(FileStorage._FileStorage__objects))
+
+    def test_allDecodesEverything(self):
+        self.storage.reload()
+        self.assertEqual({"Place." + self.place.id, "State." + self.state.id},
+                         set(self.storage.all()))
+        self.assertEqual({}, FileStorage._FileStorage__unloaded)
+
+    def test_saveKeepsUnloadedRecords(self):
+        self.storage.reload()
+        self.storage.get("State", self.state.id).name = "Nevada"
+        self.storage.save()
+        self.storage.lazy_load(False)
+        self.storage.reload()
+        self.assertEqual("Loft", self.storage.get("Place", self.place.id).name)
+        self.assertEqual("Nevada",
+                         self.storage.get("State", self.state.id).name)
+
+    def test_journalOverridesUnloadedRecords(self):
+        self.storage.journal(True)
+        self.storage.delete(self.state)
+        self.place.name = "Barn"
+        self.storage.save()
+        self.storage.reload()
+        self.assertIsNone(self.storage.get("State", self.state.id))
+        self.assertEqual("Barn", self.storage.get("Place", self.place.id).name)
+
+    def test_singleLineFileIsLoadedEagerly(self):
+        with open(self.path, "w") as file_0:
+            json.dump({"Place." + self.place.id: self.place.to_dict()},
+                      file_0)
+        self.storage.reload()
+        self.assertEqual(["Place." + self.place.id],
+                         list(FileStorage._FileStorage__objects))
+
+
+class TestFileStorageHydrate(TestFileStorageBase):
+    """Unittests for bulk hydration"""
+
+    def test_hydrateBypassesConstructor(self):
+        items = [{"__class__": "Place", "id": "1", "name": "Loft",
+                  "created_at": "2024-02-21T10:30:00",
+                  "updated_at": "2024-02-21T10:30:00.123456"}]
+        with patch.object(Place, "__init__") as init:
+            self.assertEqual(1, self.storage.hydrate(items))
+        init.assert_not_called()
+        place = self.storage.get("Place", "1")
+        self.assertIsInstance(place, Place)
+        self.assertEqual("Loft", place.name)
+        self.assertEqual(123456, place.updated_at.microsecond)
+        self.assertFalse(place.is_dirty())
+
+    def test_hydrateRestoresGarbageCollector(self):
+        with self.assertRaises(KeyError):
+            self.storage.hydrate([{"__class__": "Nope", "id": "1"}])
+        self.assertTrue(gc.isenabled())
+
+    def test_reloadHydrates(self):
+        place = Place()
+        self.storage.save()
+        with patch.object(Place, "__init__") as init:
+            self.storage.reload()
+        init.assert_not_called()
+        self.assertEqual(place.to_dict(),
+                         self.storage.get("Place", place.id).to_dict())
+
+
+class TestFileStoragePartitions(TestFileStorageBase):
+    """Unittests for the per-class partitions and read-only views"""
+
+    def test_allIsReadOnlyView(self):
+        place = Place()
+        view = self.storage.all()
+        with self.assertRaises(TypeError):
+            view["Place." + place.id] = place
+        state = State()
+        self.assertIn("State." + state.id, view)
+
+    def test_allByClass(self):
+        places = {Place().id, Place().id}
+        State()
+        self.assertEqual(places, set(self.storage.all("Place")))
+        self.assertEqual(0, len(self.storage.all("Nope")))
+
+    def test_deleteRemovesFromPartition(self):
+        place = Place()
+        self.storage.delete(place)
+        self.assertIsNone(self.storage.get("Place", place.id))
+        self.assertEqual(0, len(self.storage.all("Place")))
+
+    def test_allByClassLoadsOnlyThatClass(self):
+        place, state = Place(), State()
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual([place.id], list(self.storage.all("Place")))
+        self.assertEqual(["State." + state.id],
+                         list(FileStorage._FileStorage__unloaded))
+
+
+class TestFileStorageIndexes(TestFileStorageBase):
+    """Unittests for the secondary hash indexes"""
+
+    def test_newIsIndexed(self):
+        place, other = Place(), Place()
+        place.city_id = "c1"
+        other.city_id = "c2"
+        self.assertEqual([place.id],
+                         list(self.storage.by_index("Place", "city_id", "c1")))
+
+    def test_updateMovesObject(self):
+        place = Place()
+        place.city_id = "c1"
+        place.city_id = "c2"
+        self.assertEqual(0, len(self.storage.by_index("Place", "city_id",
+                                                      "c1")))
+        self.assertIn(place.id,
+                      self.storage.by_index("Place", "city_id", "c2"))
+
+    def test_deleteUnindexes(self):
+        city = City()
+        city.state_id = "s1"
+        self.storage.delete(city)
+        self.assertEqual(0, len(self.storage.by_index("City", "state_id",
+                                                      "s1")))
+
+    def test_reloadRebuilds(self):
+        place = Place()
+        place.user_id = "u1"
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual([place.id],
+                         list(self.storage.by_index("Place", "user_id", "u1")))
+
+    def test_lazyReloadLoadsClass(self):
+        place = Place()
+        place.user_id = "u1"
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual([place.id],
+                         list(self.storage.by_index("Place", "user_id", "u1")))
+
+    def test_journalTombstoneUnindexes(self):
+        self.storage.journal(True)
+        place = Place()
+        place.user_id = "u1"
+        self.storage.save()
+        self.storage.delete(place)
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(0, len(self.storage.by_index("Place", "user_id",
+                                                      "u1")))
+
+    def test_createIndex(self):
+        place = Place()
+        place.name = "Loft"
+        self.storage.create_index("Place", "name")
+        self.assertIn(place.id, self.storage.by_index("Place", "name", "Loft"))
+        self.storage.reload()
+        self.assertEqual(0, len(self.storage.by_index("Place", "name",
+                                                      "Loft")))
+
+    def test_unknownIndex(self):
+        with self.assertRaises(ValueError):
+            self.storage.by_index("Place", "name", "Loft")
+
+
+class TestFileStorageQuery(TestFileStorageBase):
+    """Unittests for the query planner"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = []
+        for price, city_id in ((50, "c1"), (150, "c1"), (80, "c2"),
+                               (20, "c1")):
+            place = Place()
+            place.price_by_night = price
+            place.city_id = city_id
+            self.places.append(place)
+
+    def test_where(self):
+        self.assertEqual({self.places[0].id, self.places[3].id}, {
+            place.id for place in self.storage.query(
+                "Place", [("price_by_night", "<", 80), ("city_id", "==", "c1")])
+        })
+
+    def test_orderLimitOffset(self):
+        result = self.storage.query("Place", order_by="-price_by_night",
+                                    limit=2, offset=1)
+        self.assertEqual([self.places[2], self.places[0]], result)
+        result = self.storage.query("Place", order_by="price_by_night")
+        self.assertEqual([20, 50, 80, 150],
+                         [place.price_by_night for place in result])
+
+    def test_usesIndex(self):
+        with patch.object(FileStorage, "all") as all:
+            result = self.storage.query("Place", [("city_id", "==", "c2")])
+        all.assert_not_called()
+        self.assertEqual([self.places[2]], result)
+
+    def test_limitStopsScan(self):
+        with patch("models.engine.query.matches",
+                   return_value=True) as matches:
+            self.assertEqual(1, len(self.storage.query("Place", limit=1)))
+        self.assertEqual(1, matches.call_count)
+
+    def test_uncomparableValuesDoNotMatch(self):
+        self.places[0].price_by_night = "free"
+        self.assertEqual(3, len(self.storage.query(
+            "Place", [("price_by_night", ">", 0)])))
+
+    def test_unknownOperator(self):
+        with self.assertRaises(ValueError):
+            self.storage.query("Place", [("price_by_night", "~", 0)])
+
+
+class TestFileStorageRanges(TestFileStorageBase):
+    """Unittests for the sorted range indexes"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = []
+        for price in (120, 80, 100, 60, 100):
+            place = Place()
+            place.price_by_night = price
+            self.places.append(place)
+
+    def prices(self, places):
+        return [place.price_by_night for place in places]
+
+    def test_range(self):
+        self.assertEqual([80, 100, 100, 120], self.prices(
+            self.storage.by_range("Place", "price_by_night", 80, 120)))
+        self.assertEqual([100, 100], self.prices(self.storage.by_range(
+            "Place", "price_by_night", 80, 120, include_low=False,
+            include_high=False)))
+        self.assertEqual([120, 100, 100, 80, 60], self.prices(
+            self.storage.by_range("Place", "price_by_night", reverse=True)))
+
+    def test_minMax(self):
+        self.assertIs(self.places[3],
+                      self.storage.min_by("Place", "price_by_night"))
+        self.assertIs(self.places[0],
+                      self.storage.max_by("Place", "price_by_night"))
+        for place in self.places:
+            self.storage.delete(place)
+        self.assertIsNone(self.storage.min_by("Place", "price_by_night"))
+
+    def test_updateAndDelete(self):
+        self.places[0].price_by_night = 10
+        self.storage.delete(self.places[3])
+        self.assertIs(self.places[0],
+                      self.storage.min_by("Place", "price_by_night"))
+        self.assertEqual([10, 80, 100, 100], self.prices(
+            self.storage.by_range("Place", "price_by_night")))
+
+    def test_nonNumericValuesAreLeftOut(self):
+        self.places[0].price_by_night = "free"
+        self.assertEqual(4, len(self.storage.by_range("Place",
+                                                      "price_by_night")))
+
+    def test_reloadRebuilds(self):
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual(120, self.storage.max_by("Place",
+                                                  "price_by_night")
+                         .price_by_night)
+
+    def test_queryUsesRange(self):
+        with patch.object(FileStorage, "all") as all:
+            result = self.storage.query(
+                "Place", [("price_by_night", ">", 60),
+                          ("price_by_night", "<=", 100)],
+                order_by="-price_by_night")
+        all.assert_not_called()
+        self.assertEqual([100, 100, 80], self.prices(result))
+
+    def test_queryOrderWalksIndex(self):
+        with patch("models.engine.query.sort_key") as sort_key:
+            result = self.storage.query("Place", order_by="price_by_night",
+                                        limit=2)
+        sort_key.assert_not_called()
+        self.assertEqual([60, 80], self.prices(result))
+
+    def test_unknownRange(self):
+        with self.assertRaises(ValueError):
+            self.storage.by_range("Place", "name")
+
+
+class TestFileStorageGeo(TestFileStorageBase):
+    """Unittests for the grid index on place positions"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = {}
+        for name, lat, lon in (("louvre", 48.8606, 2.3376),
+                               ("eiffel", 48.8584, 2.2945),
+                               ("versailles", 48.8049, 2.1204),
+                               ("fiji", -17.7134, 178.0650),
+                               ("samoa", -13.7590, -172.1046)):
+            place = Place()
+            place.latitude = lat
+            place.longitude = lon
+            self.places[name] = place
+
+    def test_within(self):
+        self.assertEqual([self.places["louvre"], self.places["eiffel"]],
+                         self.storage.places_within(48.8611, 2.3380, 5))
+        self.assertEqual(3, len(self.storage.places_within(48.8611, 2.3380,
+                                                           25)))
+
+    def test_withinCrossesAntimeridian(self):
+        self.assertEqual([self.places["fiji"], self.places["samoa"]],
+                         self.storage.places_within(-17.7, 178.1, 1200))
+
+    def test_bbox(self):
+        self.assertEqual({self.places["louvre"].id, self.places["eiffel"].id},
+                         {place.id for place in self.storage.places_in_bbox(
+                             48.85, 2.25, 48.87, 2.35)})
+        self.assertEqual({self.places["fiji"].id, self.places["samoa"].id},
+                         {place.id for place in self.storage.places_in_bbox(
+                             -20, 170, -10, -170)})
+
+    def test_updateAndDelete(self):
+        self.places["versailles"].latitude = 48.8600
+        self.places["versailles"].longitude = 2.3370
+        self.storage.delete(self.places["louvre"])
+        self.assertEqual([self.places["versailles"]],
+                         self.storage.places_within(48.8606, 2.3376, 1))
+
+    def test_reloadRebuilds(self):
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual(1, len(self.storage.places_within(-17.7, 178.0, 50)))
+
+    def test_nonFinitePositionIsUnindexed(self):
+        self.places["louvre"].latitude = float("inf")
+        self.places["eiffel"].longitude = float("nan")
+        self.assertEqual([], self.storage.places_within(48.8611, 2.3380, 5))
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(1, len(self.storage.places_within(48.8049, 2.1204,
+                                                           1)))
+
+
+class TestFileStorageSearch(TestFileStorageBase):
+    """Unittests for the full-text indexes"""
+
+    def setUp(self):
+        super().setUp()
+        self.loft, self.barn = Place(), Place()
+        self.loft.name = "Sunny Loft"
+        self.loft.description = "A cozy loft with Wi-Fi"
+        self.barn.name = "Old Barn"
+        self.barn.description = "Rustic and cozy"
+        self.review = Review()
+        self.review.text = "Cozy, but the barnyard was loud"
+
+    def ids(self, objects):
+        return {obj.id for obj in objects}
+
+    def test_and(self):
+        self.assertEqual({self.loft.id}, self.ids(self.storage.search(
+            "cozy wifi") + self.storage.search("COZY AND wi-fi")))
+
+    def test_or(self):
+        self.assertEqual({self.loft.id, self.barn.id},
+                         self.ids(self.storage.search("sunny OR rustic")))
+
+    def test_prefix(self):
+        self.assertEqual({self.barn.id, self.review.id},
+                         self.ids(self.storage.search("barn*")))
+        self.assertEqual({self.barn.id},
+                         self.ids(self.storage.search("barn*", "Place")))
+
+    def test_updateAndDelete(self):
+        self.loft.name = "Sunny Studio"
+        self.storage.delete(self.barn)
+        self.assertEqual([], self.storage.search("loft sunny studio barn"))
+        self.assertEqual([self.loft], self.storage.search("studio"))
+        self.assertEqual([], self.storage.search("rustic OR old"))
+
+    def test_reloadRebuilds(self):
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual({self.review.id},
+                         self.ids(self.storage.search("loud", "Review")))
+
+
+class TestFileStorageBitmaps(TestFileStorageBase):
+    """Unittests for the amenity bitmaps"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = []
+        for amenities in (["wifi", "pool"], ["wifi"], ["pool", "pets"], []):
+            place = Place()
+            place.amenity_ids = amenities
+            self.places.append(place)
+
+    def members(self, **kwargs):
+        return self.storage.by_members("Place", "amenity_ids", **kwargs)
+
+    def count(self, **kwargs):
+        return self.storage.count_members("Place", "amenity_ids", **kwargs)
+
+    def test_algebra(self):
+        self.assertEqual([self.places[0]],
+                         self.members(all_of=["wifi", "pool"]))
+        self.assertEqual(self.places[:3],
+                         self.members(any_of=["wifi", "pets"]))
+        self.assertEqual([self.places[1], self.places[3]],
+                         self.members(none_of=["pool"]))
+        self.assertEqual([self.places[0]],
+                         self.members(all_of=["pool"], none_of=["pets"]))
+        self.assertEqual([], self.members(all_of=["wifi", "sauna"]))
+
+    def test_count(self):
+        self.assertEqual(4, self.count())
+        self.assertEqual(2, self.count(all_of=["wifi"]))
+        with patch.object(FileStorage, "all") as all:
+            self.assertEqual(1, self.count(any_of=["pets"]))
+        all.assert_not_called()
+
+    def test_updateAndDelete(self):
+        self.places[1].amenity_ids = ["wifi", "pool"]
+        self.places[0].amenity_ids.remove("pool")
+        self.storage.touch(self.places[0])
+        self.storage.delete(self.places[2])
+        self.assertEqual([self.places[1]], self.members(all_of=["pool"]))
+        self.assertEqual(3, self.count())
+
+    def test_freedSlotIsReused(self):
+        self.storage.delete(self.places[0])
+        place = Place()
+        place.amenity_ids = ["sauna"]
+        self.assertEqual([place] + self.places[1:], self.members())
+
+    def test_unknownBitmap(self):
+        with self.assertRaises(ValueError):
+            self.storage.by_members("Place", "name")
+
+
+class TestFileStorageInclude(TestFileStorageBase):
+    """Unittests for the batched relationship prefetch"""
+
+    def setUp(self):
+        super().setUp()
+        self.state, self.city, self.user = State(), City(), User()
+        self.city.state_id = self.state.id
+        self.wifi, self.pool = Amenity(), Amenity()
+        self.place, self.other = Place(), Place()
+        self.place.city_id = self.city.id
+        self.place.user_id = self.user.id
+        self.place.amenity_ids = [self.wifi.id, "gone", self.pool.id]
+        self.reviews = [Review(), Review()]
+        for review in self.reviews:
+            review.place_id = self.place.id
+            review.user_id = self.user.id
+
+    def test_include(self):
+        (place, related), (other, nothing) = self.storage.include(
+            [self.place, self.other],
+            ["city.state", "user", "amenities", "reviews.user"])
+        self.assertIs(self.place, place)
+        self.assertIs(self.city, related["city"])
+        self.assertIs(self.state, related["city.state"])
+        self.assertIs(self.user, related["user"])
+        self.assertEqual([self.wifi, self.pool], related["amenities"])
+        self.assertEqual(self.reviews, related["reviews"])
+        self.assertEqual([self.user, self.user], related["reviews.user"])
+        self.assertEqual({"city": None, "city.state": None, "user": None,
+                          "amenities": [], "reviews": [],
+                          "reviews.user": []}, nothing)
+
+    def test_includeResolvesEachStepOnce(self):
+        with patch.object(FileStorage, "_FileStorage__get_many",
+                          return_value={}) as get_many:
+            self.storage.include([self.place, self.other],
+                                 ["city", "city.state", "user"])
+        self.assertEqual(3, get_many.call_count)
+
+    def test_queryInclude(self):
+        self.assertEqual([(self.state, {"cities": [self.city],
+                                        "cities.places": [self.place]})],
+                         self.storage.query("State",
+                                            include=["cities.places"]))
+
+    def test_includeLazy(self):
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        place = self.storage.get("Place", self.place.id)
+        (place, related), = self.storage.include([place], ["city.state",
+                                                           "reviews"])
+        self.assertEqual(self.state.id, related["city.state"].id)
+        self.assertEqual(2, len(related["reviews"]))
+
+    def test_unknownRelation(self):
+        with self.assertRaises(ValueError):
+            self.storage.include([self.place], ["city.owner"])
+        self.assertEqual([], self.storage.include([], ["nope"]))
+
+
+class TestFileStorageCascade(TestFileStorageBase):
+    """Unittests for the cascading delete"""
+
+    def setUp(self):
+        super().setUp()
+        self.state, self.city, self.user = State(), City(), User()
+        self.city.state_id = self.state.id
+        self.place = Place()
+        self.place.city_id = self.city.id
+        self.review = Review()
+        self.review.place_id = self.place.id
+        self.own_review = Review()
+        self.own_review.user_id = self.user.id
+
+    def test_deleteWithoutCascade(self):
+        self.assertEqual([self.state], self.storage.delete(self.state))
+        self.assertIs(self.city, self.storage.get("City", self.city.id))
+
+    def test_cascadeFromState(self):
+        removed = self.storage.delete(self.state, cascade=True)
+        self.assertEqual({self.state.id, self.city.id, self.place.id,
+                          self.review.id}, {obj.id for obj in removed})
+        self.assertEqual(2, len(self.storage.all()))
+        self.assertEqual(0, len(self.storage.by_index("Review", "place_id",
+                                                      self.place.id)))
+
+    def test_cascadeFromUser(self):
+        self.place.user_id = self.user.id
+        self.storage.delete(self.user, cascade=True)
+        self.assertEqual({"State." + self.state.id, "City." + self.city.id},
+                         set(self.storage.all()))
+
+    def test_cascadePersistsOnce(self):
+        self.storage.save()
+        self.storage.journal(True)
+        self.storage.delete(self.state, cascade=True)
+        self.storage.save()
+        with open(self.path + ".log") as file_0:
+            self.assertEqual(4, len(file_0.readlines()))
+        self.storage.reload()
+        self.assertEqual(2, len(self.storage.all()))
+
+
+class TestFileStorageAggregate(TestFileStorageBase):
+    """Unittests for the group-by aggregations"""
+
+    def setUp(self):
+        super().setUp()
+        for price, guests, city_id in ((100, 2, "c1"), (50, 4, "c1"),
+                                       (80, 6, "c2")):
+            place = Place()
+            place.price_by_night = price
+            place.max_guest = guests
+            place.city_id = city_id
+
+    def test_groupBy(self):
+        self.assertEqual({
+            "c1": {"count": 2, "avg(price_by_night)": 75.0,
+                   "max(max_guest)": 4, "min(max_guest)": 2},
+            "c2": {"count": 1, "avg(price_by_night)": 80.0,
+                   "max(max_guest)": 6, "min(max_guest)": 6}
+        }, self.storage.aggregate("Place", group_by="city_id",
+                                  avg="price_by_night", max="max_guest",
+                                  min=["max_guest"]))
+
+    def test_singleGroupWithWhere(self):
+        self.assertEqual({None: {"count": 2, "sum(price_by_night)": 130}},
+                         self.storage.aggregate(
+                             "Place", where=[("max_guest", ">", 2)],
+                             sum="price_by_night"))
+
+    def test_nonNumericValuesAreIgnored(self):
+        Place().price_by_night = "free"
+        self.assertEqual({"count": 4, "avg(price_by_night)": 230 / 3},
+                         self.storage.aggregate(
+                             "Place", avg="price_by_night")[None])
+
+    def test_streamsCandidates(self):
+        with patch("models.engine.query.select") as select:
+            self.storage.aggregate("Place", where=[("city_id", "==", "c1")],
+                                   group_by="city_id")
+        select.assert_not_called()
+
+    def test_unknownFunction(self):
+        with self.assertRaises(ValueError):
+            self.storage.aggregate("Place", median="price_by_night")
+
+
+class TestFileStorageMaterialized(TestFileStorageBase):
+    """Unittests for the maintained counts and aggregates"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = []
+        for price, city_id in ((100, "c1"), (50, "c1"), (80, "c2")):
+            place = Place()
+            place.price_by_night = price
+            place.city_id = city_id
+            self.places.append(place)
+
+    def test_count(self):
+        State()
+        self.assertEqual(3, self.storage.count("Place"))
+        self.assertEqual(4, self.storage.count())
+        self.assertEqual(0, self.storage.count("Nope"))
+        self.storage.delete(self.places[0])
+        self.assertEqual(2, self.storage.count("Place"))
+
+    def test_placesPerCity(self):
+        self.places[0].city_id = "c2"
+        self.places[2].price_by_night = 90
+        self.storage.delete(self.places[1])
+        Place().city_id = "c3"
+        self.assertEqual({"c2": {"count": 2, "sum(price_by_night)": 190},
+                          "c3": {"count": 1, "sum(price_by_night)": 0}},
+                         self.storage.materialized("places_per_city"))
+
+    def test_materializeDoesNotWalk(self):
+        self.storage.materialize("prices", "Place", avg="price_by_night")
+        Place().price_by_night = 70
+        with patch.object(FileStorage, "all") as all:
+            self.assertEqual({None: {"count": 4,
+                                     "avg(price_by_night)": 75.0}},
+                             self.storage.materialized("prices"))
+        all.assert_not_called()
+
+    def test_reloadRebuilds(self):
+        self.storage.save()
+        self.storage.lazy_load(True)
+        self.storage.reload()
+        self.assertEqual(2, self.storage.materialized(
+            "places_per_city")["c1"]["count"])
+        self.assertEqual(3, self.storage.count("Place"))
+
+    def test_unsupportedAggregate(self):
+        with self.assertRaises(ValueError):
+            self.storage.materialize("cheapest", "Place",
+                                     min="price_by_night")
+        with self.assertRaises(ValueError):
+            self.storage.materialized("cheapest")
+
+
+class TestFileStorageTransactions(TestFileStorageBase):
+    """Unittests for transactions and savepoints"""
+
+    def setUp(self):
+        super().setUp()
+        self.place = Place()
+        self.place.city_id = "c1"
+        self.place.price_by_night = 100
+        self.storage.save()
+
+    def test_commitWritesOnce(self):
+        self.storage.begin()
+        with patch.object(FileStorage, "_FileStorage__write_snapshot") as \
+                write:
+            for price in range(10):
+                self.place.price_by_night = price
+                self.place.do_save()
+            State()
+            self.storage.save()
+            write.assert_not_called()
+            self.storage.commit()
+        self.assertEqual(1, write.call_count)
+
+    def test_rollback(self):
+        self.storage.begin()
+        self.place.city_id = "c2"
+        self.place.name = "Loft"
+        city = City()
+        self.storage.delete(self.place)
+        self.storage.rollback()
+        self.assertIs(self.place, self.storage.get("Place", self.place.id))
+        self.assertEqual("c1", self.place.city_id)
+        self.assertNotIn("name", self.place.__dict__)
+        self.assertIsNone(self.storage.get("City", city.id))
+        self.assertEqual([self.place.id],
+                         list(self.storage.by_index("Place", "city_id", "c1")))
+        self.assertEqual({}, dict(self.storage.by_index("Place", "city_id",
+                                                        "c2")))
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(1, self.storage.count())
+
+    def test_savepoints(self):
+        self.assertEqual(1, self.storage.begin())
+        self.place.price_by_night = 200
+        self.assertEqual(2, self.storage.begin())
+        self.place.price_by_night = 300
+        self.storage.rollback()
+        self.assertEqual(200, self.place.price_by_night)
+        self.storage.begin()
+        self.place.price_by_night = 400
+        self.storage.commit()
+        self.assertEqual([self.place], self.storage.by_range(
+            "Place", "price_by_night", 400, 400))
+        self.storage.rollback()
+        self.assertEqual(100, self.place.price_by_night)
+        self.assertEqual([self.place], self.storage.by_range(
+            "Place", "price_by_night", 100, 100))
+
+    def test_noTransaction(self):
+        with self.assertRaises(ValueError):
+            self.storage.commit()
+        with self.assertRaises(ValueError):
+            self.storage.rollback()
+
+
+class TestFileStorageSnapshots(TestFileStorageBase):
+    """Unittests for snapshot-isolated reads"""
+
+    def setUp(self):
+        super().setUp()
+        self.places = [Place() for i in range(4)]
+        for price, place in enumerate(self.places):
+            place.price_by_night = price
+
+    def test_isolation(self):
+        snapshot = self.storage.snapshot()
+        self.places[0].price_by_night = 50
+        self.places[0].price_by_night = 60
+        self.storage.delete(self.places[1])
+        created = Place()
+        seen = dict(snapshot.items("Place"))
+        self.assertEqual({"Place." + p.id for p in self.places}, set(seen))
+        self.assertEqual(0, seen["Place." + self.places[0].id].price_by_night)
+        self.assertIsNone(snapshot.get("Place", created.id))
+        self.assertEqual(4, snapshot.count())
+        later = self.storage.snapshot()
+        self.assertEqual(60, later.get("Place",
+                                       self.places[0].id).price_by_night)
+        self.assertEqual(4, later.count("Place"))
+        snapshot.release()
+        later.release()
+
+    def test_iterateWhileWriting(self):
+        with self.storage.snapshot() as snapshot:
+            seen = []
+            for key, obj in snapshot.items("Place"):
+                seen.append(obj.price_by_night)
+                Place()
+                self.storage.delete(self.places[-1])
+                self.places[0].price_by_night = 99
+            self.assertEqual([0, 1, 2, 3], seen)
+
+    def test_recreatedId(self):
+        self.storage.delete(self.places[0])
+        with self.storage.snapshot() as snapshot:
+            self.storage.new(self.places[0])
+            self.assertEqual(3, snapshot.count("Place"))
+            self.assertIsNone(snapshot.get("Place", self.places[0].id))
+        with self.storage.snapshot() as snapshot:
+            self.assertEqual(4, snapshot.count("Place"))
+
+    def test_reclaim(self):
+        versions = FileStorage._FileStorage__versions
+        first = self.storage.snapshot()
+        self.places[0].price_by_night = 10
+        second = self.storage.snapshot()
+        self.places[0].price_by_night = 20
+        self.assertEqual(2, len(versions._VersionLog__history))
+        first.release()
+        self.assertEqual(1, len(versions._VersionLog__history))
+        self.assertEqual(10, second.get("Place",
+                                        self.places[0].id).price_by_night)
+        second.release()
+        self.assertEqual({}, versions._VersionLog__images)
+        for place in self.places[:3]:
+            self.storage.delete(place)
+        self.assertEqual([self.places[3].id],
+                         FileStorage._FileStorage__order["Place"])
+
+
+class TestFileStorageThreadSafe(TestFileStorageBase):
+    """Unittests for the thread-safe mode"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage.thread_safe(True)
+        self.addCleanup(self.storage.thread_safe, False)
+
+    def test_concurrentNewAndSave(self):
+        errors = []
+
+        def create():
+            try:
+                for i in range(300):
+                    Place().price_by_night = i
+            except Exception as error:
+                errors.append(error)
+
+        def save():
+            try:
+                for i in range(20):
+                    self.storage.save()
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=create) for i in range(4)]
+        threads.append(threading.Thread(target=save))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual(1200, self.storage.count("Place"))
+
+    def test_touchWaitsForWriters(self):
+        place = Place()
+        self.storage.save()
+        thread = threading.Thread(target=self.storage.touch, args=(place,))
+        with self.storage.exclusive():
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertFalse(place.is_dirty())
+        thread.join()
+        self.assertTrue(place.is_dirty())
+
+    def test_asyncJournalCompaction(self):
+        def run():
+            self.storage.journal(True, threshold=200)
+            self.storage.durability("async")
+            for i in range(5):
+                Place()
+                self.storage.save()
+            self.storage.flush()
+            self.storage.reload()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.storage.compact(wait=True)
+        self.assertEqual(5, self.storage.count("Place"))
+
+    def test_writerExcludesReaders(self):
+        lock = self.storage.lock()
+        seen = []
+        with self.storage.exclusive():
+            reader = threading.Thread(
+                target=lambda: seen.append(self.storage.count()))
+            reader.start()
+            Place()
+            reader.join(0.1)
+            self.assertEqual([], seen)
+        reader.join()
+        self.assertEqual([1], seen)
+        with lock.reading():
+            self.assertEqual(1, self.storage.count())
+            with self.assertRaises(RuntimeError):
+                Place()
+
+    def test_snapshotUnderLock(self):
+        place = Place()
+        with self.storage.snapshot() as snapshot:
+            place.name = "Loft"
+            self.assertEqual("", snapshot.get("Place", place.id).name)
+            self.assertEqual(1, snapshot.count())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,18 @@
+#!/usr/bin/python3
+"""Creates the storage instance shared by every model of the application
+
+The engine is chosen with the HBNB_TYPE_STORAGE environment variable:
+"sqlite" selects SQLiteStorage, anything else FileStorage.
+HBNB_LAZY_LOAD=1 makes FileStorage decode records on first access.
+"""
+
+from os import getenv
+
+if getenv("HBNB_TYPE_STORAGE") == "sqlite":
+    from models.engine.sqlite_storage import SQLiteStorage
+    storage = SQLiteStorage()
+else:
+    from models.engine.file_storage import FileStorage
+    storage = FileStorage()
+    storage.lazy_load(getenv("HBNB_LAZY_LOAD") == "1")
+storage.reload()
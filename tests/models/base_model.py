@@ -29,6 +29,25 @@ class BaseModel:
         else:
             models.storage.new(self)
 
+    def __setattr__(self, name, value):
+        """Sets an attribute and marks the instance as modified
+
+        Args:
+            name (str): name of the attribute
+            value (any): new value of the attribute
+        """
+        if not models.storage.holds(self):
+            super().__setattr__(name, value)
+            return
+        with models.storage.exclusive():
+            models.storage.remember(self, name)
+            super().__setattr__(name, value)
+            models.storage.touch(self, name)
+
+    def is_dirty(self):
+        """Returns True if the instance changed since storage last saved it"""
+        return models.storage.is_dirty(self)
+
     def do_save(self):
         """ For updating the updated_at to current datetime """
         self.updated_at = datetime.today()
@@ -45,6 +64,10 @@ class BaseModel:
         st_dict["__class__"] = self.__class__.__name__
         return st_dict
 
+    def to_dict(self):
+        """Returns the dictionary of the BaseModel instance used by storage"""
+        return self.do_ict()
+
     def __str__(self):
         """ Return the official string representation of the BaseModel instance """
         obj_name = self.__class__.__name__
@@ -10,31 +10,319 @@ from models.city import City
 from models.place import Place
 from models.amenity import Amenity
 from models.review import Review
+from models.engine.indexes import AggregateIndex, BitmapIndex, GridIndex, \
+    HashIndex, SortedIndex, TextIndex
+from models.engine import query
+from models.engine.undo import MISSING, UndoLog
+from models.engine.versions import Snapshot, VersionLog
+from models.engine.locks import RWLock, reading, writing
+from contextlib import nullcontext
+from datetime import datetime
+from types import MappingProxyType
+import atexit
+import gc
 import json
+import mmap
+import os
+import queue
+import threading
+import time
 
 
 class FileStorage:
     """
     Encapsulates storage operations for seamless object persistence within a JSON file.
 
+    Each object is encoded once and its JSON fragment is cached until the
+    object is modified again, so a save only re-encodes the dirty objects.
+    Snapshots are streamed to the file one record at a time; with the cache
+    turned off a save needs no memory beyond its write buffer.
+
+    In journal mode, `save` appends only the records changed since the last
+    save (and tombstones for deleted objects) to `<file_path>.log` instead of
+    rewriting the whole JSON file. Once the log grows past the journal
+    threshold it is folded into a new snapshot by a background thread.
+
+    Objects are also partitioned by class name, so reading the objects of
+    one class never scans the others; `all` returns read-only views instead
+    of copies.
+
+    Secondary hash indexes, declared per class in __index_fields, map an
+    attribute value to the objects holding it and are kept in sync by
+    `new`, `touch` and `delete`; `by_index` reads them. Sorted indexes,
+    declared in __range_fields, keep the objects ordered by a numeric
+    attribute for `by_range`, `min_by` and `max_by`. Places are also filed
+    in a grid by position for `places_within` and `places_in_bbox`, and
+    the words of the text attributes declared in __text_fields are indexed
+    for `search`. The list attributes declared in __bitmap_fields get a
+    bitmap per element, which `by_members` and `count_members` combine.
+
+    The relations between classes are declared in __relations, so that
+    `include` can resolve the related objects of a whole batch at once.
+
+    The group-by aggregates declared in __materialized, such as the number
+    of places and their total price per city, are kept up to date on every
+    change; `materialized` reads them and `count` reads the size of a
+    partition, both at a cost independent of the number of objects.
+
+    Reloaded records are turned into objects by `hydrate`, which bypasses
+    the model constructors.
+
+    In lazy mode, `reload` maps the file into memory and only indexes the
+    offsets of each record; a record is decoded into an object the first
+    time `all` or `get` asks for it.
+
+    With "grouped" durability, the saves requested within a time window or
+    up to an operation count are coalesced into one physical write; `flush`
+    forces the write and pending saves are flushed when the program exits.
+
+    With "async" durability, `save` only encodes the dirty objects and hands
+    the resulting change set to a writer thread through a bounded queue, so
+    the caller never waits for the disk unless the queue is full. Errors of
+    the writer are kept until `writer_error` or `flush` reports them.
+
     Attributes:
         __file_path (str): File path to store objects.
         __objects (dict): Dictionary housing instantiated objects.
+        __classes (dict): The model classes that can be reloaded, by name.
+        __partitions (dict): The objects of each class, by class name and id.
+        __index_fields (dict): The indexed attributes of each class name.
+        __indexes (dict): The indexes to maintain for each class name.
+        __hash_indexes (dict): The hash indexes, by (class name, attribute).
+        __range_fields (dict): The numeric attributes of each class name
+            kept sorted.
+        __range_indexes (dict): The sorted indexes, by (class name,
+            attribute).
+        __geo_fields (dict): The latitude and longitude attributes of each
+            class name filed in a grid.
+        __geo_indexes (dict): The grid indexes, by class name.
+        __text_fields (dict): The full-text indexed attributes of each
+            class name.
+        __text_indexes (dict): The full-text indexes, by class name.
+        __bitmap_fields (dict): The list attributes of each class name
+            indexed by element.
+        __bitmap_indexes (dict): The bitmap indexes, by (class name,
+            attribute).
+        __relations (dict): The relations of each class name, by name, as
+            (kind, related class name, attribute) triples: "one" when the
+            attribute holds the id of the related object, "many" when it
+            holds a list of ids and "reverse" when the attribute of the
+            related objects holds the id of this one.
+        __materialized (dict): The maintained aggregates, by name, as
+            (class name, group_by, metrics) triples.
+        __aggregate_indexes (dict): The aggregate index of each maintained
+            aggregate, by name.
+        __dirty (dict): Keys changed since the last save, mapped to the
+            object or to None when the object was deleted.
+        __fragments (dict): Cached `"key": {...}` JSON line of each object
+            that did not change since it was last encoded.
+        __cache (bool): Whether encoded fragments are kept in __fragments.
+        __lazy (bool): Whether reload defers decoding the records.
+        __unloaded (dict): Offsets of the line, the value and the end of
+            each record not decoded yet, by key.
+        __mmap (mmap.mmap): The mapped file the unloaded records live in.
+        __buffer_size (int): Characters buffered before each file write.
+        __journal (bool): Whether saves append to the journal.
+        __journal_threshold (int): Log size in bytes that triggers compaction.
+        __compactor (threading.Thread): The running compaction, if any.
+        __compaction_lock (threading.Lock): Guards __compactor, which the
+            writer thread sets too.
+        __durability (str): "immediate", "grouped" or "async".
+        __group_window (float): Seconds a grouped save may stay pending.
+        __group_size (int): Number of saves coalesced into one write.
+        __pending (int): Saves requested since the last physical write.
+        __pending_since (float): When the oldest pending save was requested.
+        __deadline (threading.Timer): Writes the pending saves once their
+            window elapses, if no later save or flush does it first.
+        __writer (threading.Thread): The writer thread of the async mode.
+        __queue (queue.Queue): Change sets waiting for the writer thread.
+        __writer_error (Exception): The last error raised by the writer.
+        __queue_depth (int): Capacity of the async queue.
+        __undo (UndoLog): The pre-images of the open transaction.
+        __order (dict): The ids of each class name, in the order they
+            entered the storage, for snapshots to walk.
+        __stale (dict): The ids of each class name still in __order after
+            their object was deleted.
+        __versions (VersionLog): The pre-images the snapshots still need.
+        __lock (RWLock): The lock of the thread-safe mode, or None.
     """
 
     __file_path = "file.json"
     __objects = {}
+    __classes = {cls.__name__: cls for cls in
+                 (BaseModel, User, State, City, Place, Amenity, Review)}
+    __partitions = {name: {} for name in __classes}
+    __index_fields = {"City": ["state_id"], "Place": ["city_id", "user_id"],
+                      "Review": ["place_id", "user_id"]}
+    __indexes = {}
+    __hash_indexes = {}
+    __range_fields = {"Place": ["number_rooms", "number_bathrooms",
+                                "max_guest", "price_by_night"]}
+    __range_indexes = {}
+    __geo_fields = {"Place": ("latitude", "longitude")}
+    __geo_indexes = {}
+    __text_fields = {"Place": ["name", "description"], "Review": ["text"],
+                     "City": ["name"], "State": ["name"], "Amenity": ["name"]}
+    __text_indexes = {}
+    __bitmap_fields = {"Place": ["amenity_ids"]}
+    __bitmap_indexes = {}
+    __materialized = {
+        "places_per_city": ("Place", "city_id", {"sum": ["price_by_night"]}),
+        "reviews_per_user": ("Review", "user_id", {})
+    }
+    __aggregate_indexes = {}
+    __relations = {
+        "State": {"cities": ("reverse", "City", "state_id")},
+        "City": {"state": ("one", "State", "state_id"),
+                 "places": ("reverse", "Place", "city_id")},
+        "User": {"places": ("reverse", "Place", "user_id"),
+                 "reviews": ("reverse", "Review", "user_id")},
+        "Place": {"city": ("one", "City", "city_id"),
+                  "user": ("one", "User", "user_id"),
+                  "amenities": ("many", "Amenity", "amenity_ids"),
+                  "reviews": ("reverse", "Review", "place_id")},
+        "Review": {"place": ("one", "Place", "place_id"),
+                   "user": ("one", "User", "user_id")}
+    }
+    __dirty = {}
+    __fragments = {}
+    __cache = True
+    __lazy = False
+    __unloaded = {}
+    __mmap = None
+    __buffer_size = 64 * 1024
+    __journal = False
+    __journal_threshold = 4 * 1024 * 1024
+    __compactor = None
+    __compaction_lock = threading.Lock()
+    __durability = "immediate"
+    __group_window = 1.0
+    __group_size = 1000
+    __pending = 0
+    __pending_since = 0.0
+    __deadline = None
+    __writer = None
+    __queue = None
+    __writer_error = None
+    __queue_depth = 64
+    __undo = UndoLog()
+    __order = {name: [] for name in __classes}
+    __stale = {name: set() for name in __classes}
+    __versions = VersionLog()
+    __lock = None
 
-    def all(self):
+    @reading
+    def all(self, cls=None):
         """
-        Retrieves a comprehensive dictionary of all stored objects.
+        Retrieves a read-only view of the stored objects.
+
+        The view reflects later changes to the storage and must not be
+        iterated while objects are added or removed; take a `snapshot` to
+        read alongside writers.
+
+        Args:
+            cls (str): Only return the objects of this class name.
 
         Returns:
-            dict: A deep copy of the __objects dictionary.
+            mappingproxy: Every object by "<class>.<id>" key, or the objects
+            of `cls` by id.
+        """
+
+        if cls is None:
+            if len(FileStorage.__unloaded) > 0:
+                for key in list(FileStorage.__unloaded):
+                    self.__load(key)
+            return MappingProxyType(FileStorage.__objects)
+        if len(FileStorage.__unloaded) > 0:
+            prefix = cls + "."
+            for key in [key for key in FileStorage.__unloaded
+                        if key.startswith(prefix)]:
+                self.__load(key)
+        return MappingProxyType(FileStorage.__partitions.get(cls, {}))
+
+    @reading
+    def get(self, cls, id):
         """
+        Retrieves one object by class and id.
 
-        return FileStorage.__objects.copy()
+        Args:
+            cls (str): The class name of the object.
+            id (str): The id of the object.
+
+        Returns:
+            The object, or None if it does not exist.
+        """
+
+        if len(FileStorage.__unloaded) > 0 and \
+                f"{cls}.{id}" in FileStorage.__unloaded:
+            return self.__load(f"{cls}.{id}")
+        return FileStorage.__partitions.get(cls, {}).get(id)
+
+    @writing
+    def hydrate(self, items, pause_gc=True):
+        """
+        Registers objects built from their dictionaries, in bulk.
+
+        Instances are created without calling their constructor: the class
+        comes from a registry, the attributes are copied into the instance
+        dictionary and timestamps are parsed with `datetime.fromisoformat`.
+        The objects are not marked as changed.
+
+        Args:
+            items (iterable): The dictionaries, as returned by `to_dict`.
+                They are modified in place.
+            pause_gc (bool): Disable the garbage collector while loading.
+
+        Returns:
+            int: The number of objects registered.
+        """
+
+        classes = FileStorage.__classes
+        objects = FileStorage.__objects
+        partitions = FileStorage.__partitions
+        indexes = FileStorage.__indexes
+        unloaded = FileStorage.__unloaded
+        order = FileStorage.__order
+        stale = FileStorage.__stale
+        versions = FileStorage.__versions
+        pinned = versions.pinned()
+        parse = datetime.fromisoformat
+        gc_enabled = gc.isenabled()
+        if pause_gc:
+            gc.disable()
+        count = 0
+        try:
+            for item in items:
+                cls = classes[item.pop("__class__")]
+                obj = cls.__new__(cls)
+                if "created_at" in item:
+                    item["created_at"] = parse(item["created_at"])
+                if "updated_at" in item:
+                    item["updated_at"] = parse(item["updated_at"])
+                obj.__dict__.update(item)
+                key = "{}.{}".format(cls.__name__, item["id"])
+                if len(unloaded) > 0:
+                    unloaded.pop(key, None)
+                if pinned:
+                    versions.preserve(key, objects.get(key))
+                if key in objects:
+                    self.__unindex(objects[key])
+                elif item["id"] in stale[cls.__name__]:
+                    stale[cls.__name__].discard(item["id"])
+                else:
+                    order[cls.__name__].append(item["id"])
+                objects[key] = obj
+                partitions[cls.__name__][item["id"]] = obj
+                if cls.__name__ in indexes:
+                    for index in indexes[cls.__name__]:
+                        index.add(obj)
+                count += 1
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return count
 
+    @writing
     def new(self, obj):
         """
         Register a new object within the storage system.
@@ -44,30 +332,1585 @@ class FileStorage:
         """
 
         obj_name = obj.__class__.__name__
-        FileStorage.__objects[f"{obj_name}.{obj.id}"] = obj
+        key = f"{obj_name}.{obj.id}"
+        old = FileStorage.__objects.get(key)
+        FileStorage.__unloaded.pop(key, None)
+        if FileStorage.__undo.depth() > 0:
+            FileStorage.__undo.key(key, old,
+                                   FileStorage.__dirty.get(key, MISSING))
+        FileStorage.__versions.preserve(key, old)
+        if old is not None:
+            self.__unindex(old)
+        else:
+            self.__list(obj_name, obj.id)
+        FileStorage.__objects[key] = obj
+        FileStorage.__partitions.setdefault(obj_name, {})[obj.id] = obj
+        FileStorage.__dirty[key] = obj
+        for index in FileStorage.__indexes.get(obj_name, ()):
+            index.add(obj)
+
+    @writing
+    def remember(self, obj, name):
+        """
+        Records the value of an attribute before it is set, so the open
+        transaction can restore it, and the state of the object, if a
+        snapshot needs it.
+
+        Values are restored by reference: lists modified in place are not.
+
+        Args:
+            obj: The object about to change.
+            name (str): The attribute about to be set.
+        """
+
+        if "id" not in obj.__dict__ or (FileStorage.__undo.depth() == 0 and
+                                        not FileStorage.__versions.pinned()):
+            return
+        key = f"{obj.__class__.__name__}.{obj.id}"
+        if FileStorage.__objects.get(key) is obj:
+            FileStorage.__versions.preserve(key, obj)
+            if FileStorage.__undo.depth() > 0:
+                FileStorage.__undo.attr(obj, name)
+
+    @writing
+    def touch(self, obj, name=None):
+        """
+        Marks a stored object as changed so the next save persists it.
+
+        Args:
+            obj: The object whose attributes were modified.
+            name (str): The attribute that was set, so only the indexes
+                covering it are refreshed; None refreshes them all.
+        """
+
+        key = f"{obj.__class__.__name__}.{obj.id}"
+        if FileStorage.__objects.get(key) is obj:
+            FileStorage.__dirty[key] = obj
+            for index in FileStorage.__indexes.get(obj.__class__.__name__, ()):
+                if name is None or index.covers(name):
+                    index.refresh(obj)
+
+    def holds(self, obj):
+        """
+        Tells whether an object is the one stored under its key.
+
+        Every attribute write calls it first, so it does not take the lock:
+        `remember` and `touch` check the object again under it.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            bool: False for objects not registered yet, whose attribute
+            writes need no bookkeeping.
+        """
+
+        return FileStorage.__partitions.get(obj.__class__.__name__, {}).get(
+            obj.__dict__.get("id")) is obj
+
+    @reading
+    def is_dirty(self, obj):
+        """
+        Tells whether an object changed since it was last saved.
+
+        Args:
+            obj: The object to check.
+
+        Returns:
+            bool: True if the next save has to encode the object again.
+        """
+
+        return f"{obj.__class__.__name__}.{obj.id}" in FileStorage.__dirty
+
+    @writing
+    def delete(self, obj, cascade=False):
+        """
+        Removes an object from storage.
+
+        With `cascade`, the objects depending on it through a reverse
+        relation (the cities of a state, the places of a city or user, the
+        reviews of a place or user) are removed as well, recursively. They
+        are found through the hash indexes, so the cost grows with their
+        number only. Nothing is written until the next save.
+
+        Args:
+            obj: The object to be removed.
+            cascade (bool): Whether to remove its dependents too.
+
+        Returns:
+            list: The objects removed.
+        """
+
+        doomed = {f"{obj.__class__.__name__}.{obj.id}": obj}
+        pending = [obj] if cascade else []
+        while len(pending) > 0:
+            current = pending.pop()
+            relations = FileStorage.__relations.get(
+                current.__class__.__name__, {})
+            for kind, cls, attr in relations.values():
+                if kind != "reverse":
+                    continue
+                for dependent in self.by_index(cls, attr, current.id).values():
+                    if f"{cls}.{dependent.id}" not in doomed:
+                        doomed[f"{cls}.{dependent.id}"] = dependent
+                        pending.append(dependent)
+        removed = []
+        for key, obj in doomed.items():
+            if FileStorage.__undo.depth() > 0 and key in FileStorage.__objects:
+                FileStorage.__undo.key(key, FileStorage.__objects[key],
+                                       FileStorage.__dirty.get(key, MISSING))
+            FileStorage.__versions.preserve(key,
+                                            FileStorage.__objects.get(key))
+            if FileStorage.__objects.pop(key, None) is not None:
+                FileStorage.__partitions[obj.__class__.__name__].pop(obj.id,
+                                                                     None)
+                self.__unlist(obj.__class__.__name__, obj.id)
+                FileStorage.__dirty[key] = None
+                self.__unindex(obj)
+                removed.append(obj)
+        return removed
+
+    @writing
+    def create_index(self, cls, attr):
+        """
+        Declares and builds a hash index on an attribute of a class.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The attribute to index.
+        """
+
+        if (cls, attr) in FileStorage.__hash_indexes:
+            return
+        FileStorage.__index_fields.setdefault(cls, []).append(attr)
+        index = HashIndex(attr)
+        for obj in self.all(cls).values():
+            index.add(obj)
+        FileStorage.__indexes.setdefault(cls, []).append(index)
+        FileStorage.__hash_indexes[(cls, attr)] = index
+
+    @reading
+    def by_index(self, cls, attr, value):
+        """
+        Retrieves the objects of a class whose attribute holds a value.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The indexed attribute.
+            value: The value to look for.
+
+        Returns:
+            mappingproxy: A read-only view of the matching objects, by id.
+
+        Raises:
+            ValueError: If the attribute is not indexed.
+        """
+
+        if (cls, attr) not in FileStorage.__hash_indexes:
+            raise ValueError("no index on {}.{}".format(cls, attr))
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        return FileStorage.__hash_indexes[(cls, attr)].lookup(value)
+
+    @writing
+    def by_range(self, cls, attr, low=None, high=None, include_low=True,
+                 include_high=True, reverse=False):
+        """
+        Retrieves the objects of a class whose numeric attribute lies
+        between two bounds, ordered by it.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The attribute kept sorted.
+            low: The lower bound, or None for no bound.
+            high: The upper bound, or None for no bound.
+            include_low (bool): Whether the lower bound itself matches.
+            include_high (bool): Whether the upper bound itself matches.
+            reverse (bool): Order from the highest value down.
+
+        Returns:
+            list: The matching objects.
+
+        Raises:
+            ValueError: If the attribute is not kept sorted.
+        """
+
+        return list(self.__range_index(cls, attr).range(
+            low, high, include_low, include_high, reverse))
+
+    @writing
+    def min_by(self, cls, attr):
+        """
+        Retrieves the object of a class holding the lowest value.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The attribute kept sorted.
+
+        Returns:
+            The object, or None if no object holds a number.
+
+        Raises:
+            ValueError: If the attribute is not kept sorted.
+        """
+
+        return self.__range_index(cls, attr).min()
+
+    @writing
+    def max_by(self, cls, attr):
+        """
+        Retrieves the object of a class holding the highest value.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The attribute kept sorted.
+
+        Returns:
+            The object, or None if no object holds a number.
+
+        Raises:
+            ValueError: If the attribute is not kept sorted.
+        """
+
+        return self.__range_index(cls, attr).max()
+
+    @reading
+    def places_within(self, lat, lon, radius_km):
+        """
+        Retrieves the places within a distance of a point, nearest first.
+
+        Args:
+            lat (float): The latitude of the point, in degrees.
+            lon (float): The longitude of the point, in degrees.
+            radius_km (float): The distance, in kilometers.
+
+        Returns:
+            list: The places found.
+        """
+
+        return self.__geo_index("Place").within(lat, lon, radius_km)
+
+    @reading
+    def places_in_bbox(self, south, west, north, east):
+        """
+        Retrieves the places inside a bounding box.
+
+        Args:
+            south (float): The lowest latitude, in degrees.
+            west (float): The western longitude, in degrees.
+            north (float): The highest latitude, in degrees.
+            east (float): The eastern longitude, in degrees; lower than
+                `west` when the box crosses the antimeridian.
+
+        Returns:
+            list: The places found.
+        """
+
+        return self.__geo_index("Place").bbox(south, west, north, east)
+
+    @writing
+    def search(self, text, cls=None):
+        """
+        Retrieves the objects whose text attributes match a query.
+
+        The query is made of terms, all of which must match, separated by
+        "OR" into alternatives; a term ending with "*" matches every word
+        starting with it.
+
+        Args:
+            text (str): The query, e.g. "cozy loft OR barn*".
+            cls (str): Only search the objects of this class name.
+
+        Returns:
+            list: The matching objects.
+        """
+
+        found = []
+        for name, index in FileStorage.__text_indexes.items():
+            if cls is None or cls == name:
+                if len(FileStorage.__unloaded) > 0:
+                    self.all(name)
+                found.extend(index.search(text).values())
+        return found
+
+    @reading
+    def by_members(self, cls, attr, all_of=(), any_of=(), none_of=()):
+        """
+        Retrieves the objects of a class by the elements of a list
+        attribute, e.g. the places having wifi and a pool but no pets.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The list attribute indexed by element.
+            all_of (iterable): Elements every match must hold.
+            any_of (iterable): Elements a match must hold at least one of.
+            none_of (iterable): Elements no match may hold.
+
+        Returns:
+            list: The matching objects.
+
+        Raises:
+            ValueError: If the attribute is not indexed by element.
+        """
+
+        return self.__bitmap_index(cls, attr).lookup(all_of, any_of, none_of)
+
+    @reading
+    def count_members(self, cls, attr, all_of=(), any_of=(), none_of=()):
+        """
+        Counts the objects of a class by the elements of a list attribute,
+        without building them.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The list attribute indexed by element.
+            all_of (iterable): Elements every match must hold.
+            any_of (iterable): Elements a match must hold at least one of.
+            none_of (iterable): Elements no match may hold.
+
+        Returns:
+            int: The number of matches.
+
+        Raises:
+            ValueError: If the attribute is not indexed by element.
+        """
+
+        return self.__bitmap_index(cls, attr).count(all_of, any_of, none_of)
+
+    @reading
+    def include(self, objects, paths):
+        """
+        Resolves the related objects of a batch of objects.
+
+        Each path names a relation, or a chain of relations separated by
+        dots such as "city.state". Every step is resolved once for the
+        whole batch: the ids wanted by all the objects are gathered and
+        looked up together, and reverse relations read the hash index of
+        the related class.
+
+        Args:
+            objects (iterable): The objects, all of the same class.
+            paths (iterable): The relation paths to resolve.
+
+        Returns:
+            list: An (object, related) pair for each object, `related`
+            mapping each path, and each path it extends, to the related
+            object or None, or to a list of related objects when the path
+            goes through a relation to many.
+
+        Raises:
+            ValueError: If a path names an unknown relation.
+        """
+
+        objects = list(objects)
+        if len(objects) == 0:
+            return []
+        groups = {"": [[obj] for obj in objects]}
+        classes = {"": objects[0].__class__.__name__}
+        plural = {"": False}
+        results = [(obj, {}) for obj in objects]
+        for path in paths:
+            names = path.split(".")
+            for depth in range(len(names)):
+                prefix = ".".join(names[:depth])
+                step = ".".join(names[:depth + 1])
+                if step in groups:
+                    continue
+                relation = FileStorage.__relations.get(
+                    classes[prefix], {}).get(names[depth])
+                if relation is None:
+                    raise ValueError("unknown relation: {}.{}".format(
+                        classes[prefix], names[depth]))
+                groups[step] = self.__follow(relation, groups[prefix])
+                classes[step] = relation[1]
+                plural[step] = plural[prefix] or relation[0] != "one"
+                for (obj, related), group in zip(results, groups[step]):
+                    if plural[step]:
+                        related[step] = group
+                    else:
+                        related[step] = group[0] if len(group) > 0 else None
+        return results
+
+    @reading
+    def count(self, cls=None):
+        """
+        Counts the stored objects, without walking them.
+
+        Args:
+            cls (str): Only count the objects of this class name.
+
+        Returns:
+            int: The number of objects.
+        """
+
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        if cls is None:
+            return len(FileStorage.__objects)
+        return len(FileStorage.__partitions.get(cls, {}))
+
+    @writing
+    def materialize(self, name, cls, group_by=None, **metrics):
+        """
+        Declares an aggregate to keep up to date from now on.
+
+        Args:
+            name (str): The name to read the aggregate by.
+            cls (str): The class name.
+            group_by (str): The attribute whose values form the groups, or
+                None for a single group.
+            **metrics: The attribute, or list of attributes, to compute
+                each of "sum" and "avg" over.
+
+        Raises:
+            ValueError: If a function cannot be maintained incrementally.
+        """
+
+        index = AggregateIndex(group_by, query.check_metrics(metrics))
+        for obj in self.all(cls).values():
+            index.add(obj)
+        if name in FileStorage.__aggregate_indexes:
+            old_cls, old_index = FileStorage.__aggregate_indexes[name]
+            FileStorage.__indexes[old_cls].remove(old_index)
+        FileStorage.__materialized[name] = (cls, group_by, metrics)
+        FileStorage.__indexes.setdefault(cls, []).append(index)
+        FileStorage.__aggregate_indexes[name] = (cls, index)
+
+    @reading
+    def materialized(self, name):
+        """
+        Retrieves the current value of a maintained aggregate.
+
+        Args:
+            name (str): The name of the aggregate.
+
+        Returns:
+            dict: The metrics of each group, by group value (None without
+            `group_by`), named "count" and "<function>(<attribute>)".
+
+        Raises:
+            ValueError: If no aggregate has that name.
+        """
+
+        if name not in FileStorage.__aggregate_indexes:
+            raise ValueError("no aggregate named {}".format(name))
+        cls, index = FileStorage.__aggregate_indexes[name]
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        return index.results()
+
+    @writing
+    def query(self, cls, where=(), order_by=None, limit=None, offset=0,
+              include=None):
+        """
+        Retrieves the objects of a class satisfying conditions.
+
+        An equality condition on an indexed attribute narrows the candidates
+        to its index bucket. Failing that, the bounds set on an attribute
+        kept sorted become a range scan, and ordering by such an attribute
+        walks its index instead of sorting. The other conditions are checked
+        in one pass over the candidates, stopping once the page is full.
+
+        Args:
+            cls (str): The class name.
+            where (iterable): The (attribute, operator, value) conditions.
+            order_by (str): The attribute to order by, descending when
+                prefixed with "-".
+            limit (int): The maximum number of objects to return.
+            offset (int): The number of matching objects to skip.
+            include (iterable): Relation paths to resolve for the page of
+                results, as `include` does.
+
+        Returns:
+            list: The matching objects, or their (object, related) pairs
+            when `include` is given.
+
+        Raises:
+            ValueError: If a condition, the ordering or a relation is
+                invalid.
+        """
+
+        candidates, where, order_by = self.__plan(cls, query.check(where),
+                                                  order_by)
+        results = query.select(candidates, where, order_by, limit, offset)
+        if include is not None:
+            return self.include(results, include)
+        return results
+
+    @writing
+    def aggregate(self, cls, group_by=None, where=(), **metrics):
+        """
+        Counts the objects of a class and computes metrics over them, per
+        group, e.g. the average price per night of the places of each city.
+
+        The objects satisfying the conditions are streamed through the
+        aggregation in one pass; the conditions use the indexes as `query`
+        does.
+
+        Args:
+            cls (str): The class name.
+            group_by (str): The attribute whose values form the groups, or
+                None for a single group.
+            where (iterable): The (attribute, operator, value) conditions.
+            **metrics: The attribute, or list of attributes, to compute
+                each of "sum", "avg", "min" and "max" over.
+
+        Returns:
+            dict: The metrics of each group, by group value (None without
+            `group_by`), named "count" and "<function>(<attribute>)".
+
+        Raises:
+            ValueError: If a condition or a function is invalid.
+        """
+
+        metrics = query.check_metrics(metrics)
+        candidates, where, order_by = self.__plan(cls, query.check(where),
+                                                  None)
+        return query.aggregate(
+            (obj for obj in candidates if query.matches(obj, where)),
+            group_by, metrics)
+
+    def fragment_cache(self, enabled=True):
+        """
+        Switches the cache of encoded fragments on or off.
+
+        Without the cache every snapshot encodes each object again, but the
+        store no longer keeps a serialized copy of itself in memory.
+
+        Args:
+            enabled (bool): Whether encoded fragments should be kept.
+        """
+
+        FileStorage.__cache = enabled
+        if not enabled:
+            FileStorage.__fragments = {}
+
+    def lazy_load(self, enabled=True):
+        """
+        Switches lazy reloading on or off for the next reload.
+
+        Args:
+            enabled (bool): Whether reload should defer decoding records.
+        """
+
+        FileStorage.__lazy = enabled
+
+    def journal(self, enabled=True, threshold=None):
+        """
+        Switches journal mode on or off.
+
+        Args:
+            enabled (bool): Whether saves should append to the journal.
+            threshold (int): Log size in bytes after which the journal is
+                compacted into a new snapshot.
+        """
+
+        FileStorage.__journal = enabled
+        if threshold is not None:
+            FileStorage.__journal_threshold = threshold
+
+    @writing
+    def durability(self, mode, window=None, size=None, depth=64):
+        """
+        Chooses when a requested save reaches the disk.
+
+        Args:
+            mode (str): "immediate" writes on every save, "grouped"
+                coalesces saves into one write and "async" leaves the
+                writes to a background thread. "grouped" switches
+                thread-safe mode on, as a timer thread writes the pending
+                saves once their window elapses.
+            window (float): Seconds after which pending saves are written.
+            size (int): Number of pending saves that triggers a write.
+            depth (int): Number of change sets the async queue holds
+                before `save` blocks.
+
+        Raises:
+            ValueError: If the mode is unknown.
+        """
+
+        if mode not in ("immediate", "grouped", "async"):
+            raise ValueError("unknown durability mode: {}".format(mode))
+        self.close()
+        FileStorage.__durability = mode
+        if mode != "immediate":
+            atexit.unregister(FileStorage.__flush_at_exit)
+            atexit.register(FileStorage.__flush_at_exit)
+        if mode == "async":
+            self.__start_writer(depth)
+        if mode == "grouped":
+            self.thread_safe()
+        if window is not None:
+            FileStorage.__group_window = window
+        if size is not None:
+            FileStorage.__group_size = size
+
+    @writing
+    def snapshot(self):
+        """
+        Takes a consistent view of the storage for a reader.
+
+        Nothing is copied: writers keep going and record the state of the
+        objects they change while the snapshot needs it. Records not
+        decoded yet are decoded first.
+
+        Returns:
+            Snapshot: The view, to release when done.
+        """
+
+        if len(FileStorage.__unloaded) > 0:
+            self.all()
+        return Snapshot(FileStorage.__versions, FileStorage.__partitions,
+                        FileStorage.__order, FileStorage.__lock)
+
+    def thread_safe(self, enabled=True):
+        """
+        Switches thread-safe mode on or off.
 
+        In thread-safe mode, reads run under a shared lock and writes under
+        an exclusive one, and every record is decoded up front. Methods that
+        may reorganize an index when read, like `by_range`, `search` and
+        `query`, count as writes. The mappings `all` and `by_index` return
+        still change with the storage: threads should walk a `snapshot`.
+
+        Args:
+            enabled (bool): Whether methods should take the lock.
+        """
+
+        if not enabled:
+            FileStorage.__lock = None
+        elif FileStorage.__lock is None:
+            self.all()
+            FileStorage.__lock = RWLock()
+
+    def lock(self):
+        """
+        Retrieves the lock of the thread-safe mode.
+
+        Returns:
+            RWLock: The lock, or None outside of thread-safe mode.
+        """
+
+        return FileStorage.__lock
+
+    def exclusive(self):
+        """
+        Holds the write lock of the thread-safe mode, if on, for a with
+        block, so changes made to objects directly are not seen half done.
+
+        Returns:
+            The context manager.
+        """
+
+        if FileStorage.__lock is None:
+            return nullcontext()
+        return FileStorage.__lock.writing()
+
+    @writing
+    def begin(self):
+        """
+        Opens a transaction, or a savepoint inside the open one.
+
+        Until the transaction is committed, saves and flushes do nothing
+        and the pre-image of every change is recorded.
+
+        Returns:
+            int: The number of open savepoints, the transaction included.
+        """
+
+        return FileStorage.__undo.begin()
+
+    @writing
+    def commit(self):
+        """
+        Closes the innermost savepoint, keeping its changes.
+
+        Closing the transaction itself writes its changes to disk, in one
+        flush.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        if FileStorage.__undo.release():
+            self.flush()
+
+    @writing
+    def rollback(self):
+        """
+        Closes the innermost savepoint, undoing its changes.
+
+        Attributes are set back to their values, and created and deleted
+        objects are removed and put back, indexes included.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        objects = FileStorage.__objects
+        changed = {}
+        for entry in FileStorage.__undo.undo():
+            if entry[0] == "attr":
+                kind, obj, name, value = entry
+                key = f"{obj.__class__.__name__}.{obj.id}"
+                if objects.get(key) is obj:
+                    FileStorage.__versions.preserve(key, obj)
+                if value is MISSING:
+                    obj.__dict__.pop(name, None)
+                else:
+                    obj.__dict__[name] = value
+                changed[id(obj)] = obj
+                continue
+            kind, key, obj, dirty = entry
+            FileStorage.__versions.preserve(key, objects.get(key))
+            current = objects.pop(key, None)
+            if current is not None:
+                FileStorage.__partitions[current.__class__.__name__].pop(
+                    current.id, None)
+                self.__unlist(current.__class__.__name__, current.id)
+                self.__unindex(current)
+            if obj is not None:
+                objects[key] = obj
+                FileStorage.__partitions[obj.__class__.__name__][obj.id] = obj
+                self.__list(obj.__class__.__name__, obj.id)
+                for index in FileStorage.__indexes.get(
+                        obj.__class__.__name__, ()):
+                    index.add(obj)
+            if dirty is MISSING:
+                FileStorage.__dirty.pop(key, None)
+            else:
+                FileStorage.__dirty[key] = dirty
+        for obj in changed.values():
+            if objects.get(f"{obj.__class__.__name__}.{obj.id}") is obj:
+                self.touch(obj)
+
+    def depth(self):
+        """
+        Tells how many savepoints are open.
+
+        Returns:
+            int: 0 outside of a transaction, 1 in a transaction, more in
+            nested savepoints.
+        """
+
+        return FileStorage.__undo.depth()
+
+    @writing
     def save(self):
         """
         Persists all objects to the designated JSON file.
+
+        In journal mode only the changes since the last save are appended.
+        With grouped durability the write is deferred until the group is
+        full or its time window has elapsed, and with async durability it
+        is queued for the writer thread. Nothing happens while a
+        transaction is open.
+        """
+
+        if FileStorage.__undo.depth() > 0:
+            return
+        if FileStorage.__writer is not None:
+            changes = self.__encode_dirty()
+            if len(changes) > 0:
+                FileStorage.__queue.put(changes)
+            return
+        if FileStorage.__durability == "grouped":
+            FileStorage.__pending += 1
+            if FileStorage.__pending == 1:
+                FileStorage.__pending_since = time.monotonic()
+                self.__arm_deadline()
+            elapsed = time.monotonic() - FileStorage.__pending_since
+            if FileStorage.__pending < FileStorage.__group_size and \
+                    elapsed < FileStorage.__group_window:
+                return
+        self.flush()
+
+    @writing
+    def flush(self):
+        """
+        Writes every change requested so far to disk, unless a transaction
+        is open.
+
+        Raises:
+            Exception: The error met by the writer thread, if any.
+        """
+
+        if FileStorage.__undo.depth() > 0:
+            return
+        FileStorage.__pending = 0
+        if FileStorage.__deadline is not None:
+            FileStorage.__deadline.cancel()
+            FileStorage.__deadline = None
+        if FileStorage.__writer is not None:
+            FileStorage.__queue.put(self.__encode_dirty())
+            FileStorage.__queue.join()
+            error = self.writer_error()
+            if error is not None:
+                raise error
+        elif FileStorage.__journal:
+            changes = self.__encode_dirty()
+            try:
+                self.__append_journal(changes)
+            except Exception:
+                for key in changes:
+                    if key not in FileStorage.__dirty:
+                        FileStorage.__dirty[key] = \
+                            FileStorage.__objects.get(key)
+                raise
+        else:
+            for key in FileStorage.__dirty:
+                FileStorage.__fragments.pop(key, None)
+            FileStorage.__dirty = {}
+            self.__write_snapshot(
+                fragment for key, fragment in self.__all_fragments())
+
+    @writing
+    def close(self):
+        """
+        Writes the pending saves and stops the writer thread, if any.
+
+        Raises:
+            Exception: The error met by the writer thread, if any.
+        """
+
+        if FileStorage.__writer is not None:
+            self.flush()
+            self.__stop_writer()
+        elif FileStorage.__pending > 0:
+            self.flush()
+
+    def writer_error(self):
+        """
+        Retrieves and clears the last error met by the writer thread, or
+        by the timer of the grouped durability.
+
+        Returns:
+            Exception: The error, or None if every write succeeded.
         """
 
-        curr_dict = FileStorage.__objects
-        obj_dict = {obj: curr_dict[obj].to_dict() for obj in curr_dict.keys()}
-        with open(FileStorage.__file_path, "w") as file_0:
-            json.dump(obj_dict, file_0)
+        error = FileStorage.__writer_error
+        FileStorage.__writer_error = None
+        return error
 
+    @writing
+    def compact(self, wait=False):
+        """
+        Folds the journal into a new snapshot in a background thread.
+
+        Args:
+            wait (bool): Block until the compaction has finished.
+        """
+
+        self.__compact(wait)
+
+    def __compact(self, wait=False):
+        """
+        Starts folding the journal without taking the storage lock, so the
+        writer thread can compact while a flush holds it.
+
+        Args:
+            wait (bool): Block until the compaction has finished.
+        """
+
+        log_path = FileStorage.__file_path + ".log"
+        with FileStorage.__compaction_lock:
+            if FileStorage.__compactor is None or \
+                    not FileStorage.__compactor.is_alive():
+                if not os.path.exists(log_path + ".1"):
+                    if not os.path.exists(log_path):
+                        return
+                    os.replace(log_path, log_path + ".1")
+                FileStorage.__compactor = threading.Thread(
+                    target=FileStorage.__fold_journal,
+                    args=(FileStorage.__file_path,), daemon=True)
+                FileStorage.__compactor.start()
+            compactor = FileStorage.__compactor
+        if wait:
+            compactor.join()
+
+    @writing
     def reload(self):
         """
         Restores objects from the JSON file, if it exists.
+
+        Journal entries written after the snapshot are replayed on top of it.
+        The open transaction, if any, is discarded.
         """
 
+        writer = FileStorage.__writer
+        if writer is not None:
+            self.__stop_writer()
+        self.__wait_compactor()
+        FileStorage.__objects = {}
+        FileStorage.__partitions = {name: {} for name in FileStorage.__classes}
+        FileStorage.__order = {name: [] for name in FileStorage.__classes}
+        FileStorage.__stale = {name: set() for name in FileStorage.__classes}
+        FileStorage.__versions = VersionLog()
+        self.__build_indexes()
+        FileStorage.__fragments = {}
+        FileStorage.__unloaded = {}
+        FileStorage.__pending = 0
+        FileStorage.__undo = UndoLog()
+        if FileStorage.__mmap is not None:
+            FileStorage.__mmap.close()
+            FileStorage.__mmap = None
         try:
-            with open(FileStorage.__file_path) as file_0:
-                obj_dict = json.load(file_0)
-                for item in obj_dict.values():
-                    class_name = item["__class__"]
-                    del item["__class__"]
-                    self.new(eval(class_name)(**item))
+            if not FileStorage.__lazy or not self.__index_file():
+                with open(FileStorage.__file_path) as file_0:
+                    self.hydrate(json.load(file_0).values())
         except FileNotFoundError:
+            pass
+        log_path = FileStorage.__file_path + ".log"
+        for path in (log_path + ".1", log_path):
+            for key, item in FileStorage.__read_journal(path):
+                FileStorage.__unloaded.pop(key, None)
+                obj = FileStorage.__objects.pop(key, None)
+                if obj is not None:
+                    FileStorage.__partitions[obj.__class__.__name__].pop(
+                        obj.id, None)
+                    self.__unlist(obj.__class__.__name__, obj.id)
+                    self.__unindex(obj)
+                if item is not None:
+                    self.hydrate((item,), pause_gc=False)
+        FileStorage.__dirty = {}
+        if FileStorage.__lock is not None:
+            for key in list(FileStorage.__unloaded):
+                self.__load(key)
+        if writer is not None:
+            self.__start_writer(FileStorage.__queue_depth)
+
+    def __build_indexes(self):
+        """Creates an empty index for every declared attribute"""
+
+        FileStorage.__indexes = {}
+        FileStorage.__hash_indexes = {}
+        FileStorage.__range_indexes = {}
+        for cls, attrs in FileStorage.__index_fields.items():
+            for attr in attrs:
+                index = HashIndex(attr)
+                FileStorage.__indexes.setdefault(cls, []).append(index)
+                FileStorage.__hash_indexes[(cls, attr)] = index
+        for cls, attrs in FileStorage.__range_fields.items():
+            for attr in attrs:
+                index = SortedIndex(attr)
+                FileStorage.__indexes.setdefault(cls, []).append(index)
+                FileStorage.__range_indexes[(cls, attr)] = index
+        FileStorage.__geo_indexes = {}
+        for cls, (lat_attr, lon_attr) in FileStorage.__geo_fields.items():
+            index = GridIndex(lat_attr, lon_attr)
+            FileStorage.__indexes.setdefault(cls, []).append(index)
+            FileStorage.__geo_indexes[cls] = index
+        FileStorage.__text_indexes = {}
+        for cls, attrs in FileStorage.__text_fields.items():
+            index = TextIndex(attrs)
+            FileStorage.__indexes.setdefault(cls, []).append(index)
+            FileStorage.__text_indexes[cls] = index
+        FileStorage.__bitmap_indexes = {}
+        for cls, attrs in FileStorage.__bitmap_fields.items():
+            for attr in attrs:
+                index = BitmapIndex(attr)
+                FileStorage.__indexes.setdefault(cls, []).append(index)
+                FileStorage.__bitmap_indexes[(cls, attr)] = index
+        FileStorage.__aggregate_indexes = {}
+        for name, (cls, group_by, metrics) in \
+                FileStorage.__materialized.items():
+            index = AggregateIndex(group_by, query.check_metrics(metrics))
+            FileStorage.__indexes.setdefault(cls, []).append(index)
+            FileStorage.__aggregate_indexes[name] = (cls, index)
+
+    def __range_index(self, cls, attr):
+        """
+        Retrieves a sorted index, loading the objects of its class.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The attribute kept sorted.
+
+        Returns:
+            SortedIndex: The index.
+
+        Raises:
+            ValueError: If the attribute is not kept sorted.
+        """
+
+        if (cls, attr) not in FileStorage.__range_indexes:
+            raise ValueError("no sorted index on {}.{}".format(cls, attr))
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        return FileStorage.__range_indexes[(cls, attr)]
+
+    def __bitmap_index(self, cls, attr):
+        """
+        Retrieves a bitmap index, loading the objects of its class.
+
+        Args:
+            cls (str): The class name.
+            attr (str): The list attribute indexed by element.
+
+        Returns:
+            BitmapIndex: The index.
+
+        Raises:
+            ValueError: If the attribute is not indexed by element.
+        """
+
+        if (cls, attr) not in FileStorage.__bitmap_indexes:
+            raise ValueError("no bitmap index on {}.{}".format(cls, attr))
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        return FileStorage.__bitmap_indexes[(cls, attr)]
+
+    def __follow(self, relation, groups):
+        """
+        Follows a relation from groups of objects, in one batch.
+
+        Args:
+            relation (tuple): The (kind, related class name, attribute) of
+                the relation.
+            groups (list): The lists of objects to start from.
+
+        Returns:
+            list: The list of related objects of each group.
+        """
+
+        kind, cls, attr = relation
+        sources = {obj.id: obj for group in groups for obj in group}
+        if kind == "reverse":
+            if (cls, attr) not in FileStorage.__hash_indexes:
+                raise ValueError("no index on {}.{}".format(cls, attr))
+            index = FileStorage.__hash_indexes[(cls, attr)]
+            if len(FileStorage.__unloaded) > 0:
+                self.all(cls)
+            targets = {obj_id: list(index.lookup(obj_id).values())
+                       for obj_id in sources}
+        else:
+            wanted = {}
+            for obj in sources.values():
+                value = getattr(obj, attr, None)
+                if kind == "one":
+                    ids = [value]
+                else:
+                    ids = value if isinstance(value, list) else []
+                wanted[obj.id] = [i for i in ids if isinstance(i, str)]
+            found = self.__get_many(cls, {i for ids in wanted.values()
+                                          for i in ids})
+            targets = {obj_id: [found[i] for i in ids if i in found]
+                       for obj_id, ids in wanted.items()}
+        return [[target for obj in group for target in targets[obj.id]]
+                for group in groups]
+
+    def __get_many(self, cls, ids):
+        """
+        Retrieves the objects of a class with the given ids.
+
+        Args:
+            cls (str): The class name.
+            ids (iterable): The ids.
+
+        Returns:
+            dict: The objects found, by id.
+        """
+
+        partition = FileStorage.__partitions.get(cls, {})
+        found = {}
+        for obj_id in ids:
+            obj = partition.get(obj_id)
+            if obj is None and len(FileStorage.__unloaded) > 0:
+                obj = self.get(cls, obj_id)
+            if obj is not None:
+                found[obj_id] = obj
+        return found
+
+    def __geo_index(self, cls):
+        """
+        Retrieves a grid index, loading the objects of its class.
+
+        Args:
+            cls (str): The class name.
+
+        Returns:
+            GridIndex: The index.
+        """
+
+        if len(FileStorage.__unloaded) > 0:
+            self.all(cls)
+        return FileStorage.__geo_indexes[cls]
+
+    def __plan(self, cls, where, order_by):
+        """
+        Chooses the candidates of a query.
+
+        An equality condition on a hashed attribute wins, then a range scan
+        or an ordered walk of a sorted index, then the whole partition.
+
+        Args:
+            cls (str): The class name.
+            where (list): The (attribute, operator, value) conditions.
+            order_by (str): The attribute to order by, or None.
+
+        Returns:
+            tuple: The candidates, with the conditions and ordering left to
+            apply to them.
+        """
+
+        for condition in where:
+            attr, op, value = condition
+            if op == "==" and (cls, attr) in FileStorage.__hash_indexes:
+                rest = [other for other in where if other is not condition]
+                return (self.by_index(cls, attr, value).values(), rest,
+                        order_by)
+        candidates, where, order_by = self.__plan_range(cls, where, order_by)
+        if candidates is None:
+            candidates = self.all(cls).values()
+        return candidates, where, order_by
+
+    def __plan_range(self, cls, where, order_by):
+        """
+        Turns the conditions or the ordering of a query into a range scan.
+
+        The numeric bounds set on the first attribute kept sorted are
+        folded into one scan. Without such bounds, an ordering on an
+        attribute kept sorted walks its index, provided every object of
+        the class holds a number there.
+
+        Args:
+            cls (str): The class name.
+            where (list): The (attribute, operator, value) conditions.
+            order_by (str): The attribute to order by, or None.
+
+        Returns:
+            tuple: The candidates, or None if no index applies, with the
+            conditions and ordering left to apply to them.
+        """
+
+        def bound(value):
+            return isinstance(value, (int, float))
+
+        attrs = [attr for attr, op, value in where if op != "!=" and
+                 bound(value) and (cls, attr) in FileStorage.__range_indexes]
+        if len(attrs) == 0:
+            if order_by is None or (cls, order_by.lstrip("-")) not in \
+                    FileStorage.__range_indexes:
+                return None, where, order_by
+            index = self.__range_index(cls, order_by.lstrip("-"))
+            if len(index) != len(self.all(cls)):
+                return None, where, order_by
+            return index.range(reverse=order_by.startswith("-")), where, None
+        attr = attrs[0]
+        low, high, include_low, include_high = None, None, True, True
+        rest = []
+        for condition in where:
+            if condition[0] != attr or condition[1] == "!=" or \
+                    not bound(condition[2]):
+                rest.append(condition)
+                continue
+            op, value = condition[1], condition[2]
+            if op in (">", ">=", "==") and (low is None or value > low or
+                                           (value == low and op == ">")):
+                low, include_low = value, op != ">"
+            if op in ("<", "<=", "==") and (high is None or value < high or
+                                           (value == high and op == "<")):
+                high, include_high = value, op != "<"
+        candidates = self.__range_index(cls, attr).range(
+            low, high, include_low, include_high, order_by == "-" + attr)
+        if order_by in (attr, "-" + attr):
+            order_by = None
+        return candidates, rest, order_by
+
+    def __list(self, name, id):
+        """Lists the id of an object entering its partition"""
+
+        if id in FileStorage.__stale.setdefault(name, set()):
+            FileStorage.__stale[name].discard(id)
+        else:
+            FileStorage.__order.setdefault(name, []).append(id)
+
+    def __unlist(self, name, id):
+        """
+        Marks the id of an object leaving its partition as stale, dropping
+        the stale ids once they are half of the list and no snapshot
+        walks it.
+        """
+
+        stale = FileStorage.__stale[name]
+        stale.add(id)
+        if 2 * len(stale) > len(FileStorage.__order[name]) and \
+                not FileStorage.__versions.pinned():
+            FileStorage.__order[name] = [
+                id for id in FileStorage.__order[name] if id not in stale]
+            FileStorage.__stale[name] = set()
+
+    def __unindex(self, obj):
+        """
+        Removes an object from the indexes of its class.
+
+        Args:
+            obj: The object leaving the storage.
+        """
+
+        for index in FileStorage.__indexes.get(obj.__class__.__name__, ()):
+            index.remove(obj)
+
+    def __index_file(self):
+        """
+        Maps the JSON file and indexes the offsets of every record.
+
+        Only files written one record per line can be indexed.
+
+        Returns:
+            bool: False if the file has another layout.
+        """
+
+        with open(FileStorage.__file_path, "rb") as file_0:
+            if os.fstat(file_0.fileno()).st_size == 0:
+                return False
+            mm = mmap.mmap(file_0.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:2] != b"{\n":
+            mm.close()
+            return False
+        unloaded = {}
+        size = len(mm)
+        pos = 2
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                end = size
+            if mm[pos] == 34:
+                line_end = end - 1 if mm[end - 1] == 44 else end
+                key_end = mm.find(b'": ', pos + 1, line_end) + 1
+                key = mm[pos + 1:key_end - 1]
+                if b"\\" in key:
+                    line = mm[pos:line_end].decode()
+                    key, key_end = json.JSONDecoder().raw_decode(line)
+                    key_end += pos
+                else:
+                    key = key.decode()
+                unloaded[key] = (pos, key_end + 2, line_end)
+            pos = end + 1
+        FileStorage.__mmap = mm
+        FileStorage.__unloaded = unloaded
+        return True
+
+    def __load(self, key):
+        """
+        Decodes an unloaded record into an object.
+
+        Args:
+            key (str): The key of the record.
+
+        Returns:
+            The object.
+        """
+
+        start, value, end = FileStorage.__unloaded.pop(key)
+        item = json.loads(FileStorage.__mmap[value:end])
+        self.hydrate((item,), pause_gc=False)
+        if FileStorage.__cache:
+            FileStorage.__fragments[key] = FileStorage.__mmap[start:end].decode()
+        return FileStorage.__objects[key]
+
+    @staticmethod
+    def __flush_at_exit():
+        """Writes the saves still pending when the program exits"""
+
+        FileStorage().close()
+
+    def __arm_deadline(self):
+        """Starts the timer that writes the pending saves"""
+
+        timer = threading.Timer(FileStorage.__group_window,
+                                self.__flush_late)
+        timer.daemon = True
+        FileStorage.__deadline = timer
+        timer.start()
+
+    def __flush_late(self):
+        """
+        Writes the pending saves from the timer thread, unless a save or
+        flush already did. An error is kept for `writer_error`, and the
+        changes for the next write.
+        """
+
+        with self.exclusive():
+            if FileStorage.__deadline is not threading.current_thread():
+                return
+            try:
+                self.flush()
+            except Exception as error:
+                FileStorage.__writer_error = error
+
+    def __start_writer(self, depth):
+        """
+        Starts the writer thread of the async mode.
+
+        Args:
+            depth (int): Number of change sets the queue holds.
+        """
+
+        image = dict(self.__all_fragments())
+        FileStorage.__queue_depth = depth
+        FileStorage.__queue = queue.Queue(depth)
+        FileStorage.__writer = threading.Thread(
+            target=self.__write_loop, args=(FileStorage.__queue, image),
+            daemon=True)
+        FileStorage.__writer.start()
+
+    def __stop_writer(self):
+        """Drains the queue and stops the writer thread"""
+
+        FileStorage.__queue.put(None)
+        FileStorage.__writer.join()
+        FileStorage.__writer = None
+        FileStorage.__queue = None
+
+    def __write_loop(self, changes_queue, image):
+        """
+        Persists the queued change sets until the None sentinel arrives.
+
+        Change sets already waiting in the queue are merged into one write.
+        The changes of a failed write are kept and written with the next
+        change set, which `flush` always sends.
+
+        Args:
+            changes_queue (queue.Queue): The change sets to persist.
+            image (dict): The fragments of the persisted store, owned by
+                the writer thread.
+        """
+
+        stop = False
+        failed = {}
+        while not stop:
+            batch = [changes_queue.get()]
+            while True:
+                try:
+                    batch.append(changes_queue.get_nowait())
+                except queue.Empty:
+                    break
+            changes = failed
+            for change_set in batch:
+                if change_set is None:
+                    stop = True
+                else:
+                    changes.update(change_set)
+            failed = {}
+            try:
+                for key, fragment in changes.items():
+                    if fragment is None:
+                        image.pop(key, None)
+                    else:
+                        image[key] = fragment
+                if FileStorage.__journal:
+                    self.__append_journal(changes)
+                elif len(changes) > 0:
+                    self.__write_snapshot(image.values())
+            except Exception as error:
+                FileStorage.__writer_error = error
+                failed = changes
+            finally:
+                for change_set in batch:
+                    changes_queue.task_done()
+
+    def __encode_dirty(self):
+        """
+        Refreshes the cached fragments of the objects changed since the
+        last save.
+
+        Returns:
+            dict: The new fragment of each changed key, or None for the
+            keys that were deleted.
+        """
+
+        changes = {}
+        fragments = FileStorage.__fragments
+        for key, obj in FileStorage.__dirty.items():
+            if obj is None:
+                fragments.pop(key, None)
+                changes[key] = None
+            else:
+                changes[key] = "{}: {}".format(json.dumps(key),
+                                               json.dumps(obj.to_dict()))
+                if FileStorage.__cache:
+                    fragments[key] = changes[key]
+        FileStorage.__dirty = {}
+        return changes
+
+    def __all_fragments(self):
+        """
+        Yields the key and fragment of every object, encoding the missing
+        ones. Unloaded records are copied from the mapped file as they are.
+        """
+
+        fragments = FileStorage.__fragments
+        for key, obj in FileStorage.__objects.items():
+            fragment = fragments.get(key)
+            if fragment is None:
+                fragment = "{}: {}".format(json.dumps(key),
+                                           json.dumps(obj.to_dict()))
+                if FileStorage.__cache:
+                    fragments[key] = fragment
+            yield key, fragment
+        for key, (start, value, end) in FileStorage.__unloaded.items():
+            yield key, FileStorage.__mmap[start:end].decode()
+
+    def __write_snapshot(self, fragments):
+        """
+        Rewrites the whole JSON file and discards the journal.
+
+        Args:
+            fragments (iterable): The encoded records of every object.
+        """
+
+        self.__wait_compactor()
+        with open(FileStorage.__file_path + ".tmp", "w") as file_0:
+            FileStorage.__dump_fragments(file_0, fragments)
+        os.replace(FileStorage.__file_path + ".tmp", FileStorage.__file_path)
+        for path in (".log.1", ".log"):
+            try:
+                os.remove(FileStorage.__file_path + path)
+            except FileNotFoundError:
+                pass
+
+    def __append_journal(self, changes):
+        """
+        Appends the records changed since the last save to the journal.
+
+        Every entry is a one-line JSON object holding a single record, or
+        null as the tombstone of a deleted key.
+
+        Args:
+            changes (dict): The fragments returned by __encode_dirty.
+        """
+
+        if len(changes) == 0:
             return
+        log_path = FileStorage.__file_path + ".log"
+        with open(log_path, "a") as file_0:
+            for key, fragment in changes.items():
+                if fragment is None:
+                    fragment = "{}: null".format(json.dumps(key))
+                file_0.write("{" + fragment + "}\n")
+            size = file_0.tell()
+        if size >= FileStorage.__journal_threshold:
+            self.__compact()
+
+    def __wait_compactor(self):
+        """Blocks until a running compaction has finished"""
+
+        with FileStorage.__compaction_lock:
+            compactor = FileStorage.__compactor
+            FileStorage.__compactor = None
+        if compactor is not None:
+            compactor.join()
+
+    @staticmethod
+    def __read_journal(path):
+        """
+        Yields the (key, record) entries of a journal file.
+
+        A truncated last line, left by an interrupted append, is ignored.
+
+        Args:
+            path (str): The journal file to read.
+        """
+
+        try:
+            with open(path) as file_0:
+                for line in file_0:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    yield from entry.items()
+        except FileNotFoundError:
+            return
+
+    @staticmethod
+    def __fold_journal(file_path):
+        """
+        Merges the rotated journal into the snapshot and removes it.
+
+        Only the files are read, so the live objects are left untouched
+        while the console keeps appending to the fresh journal.
+
+        Args:
+            file_path (str): Path of the snapshot file.
+        """
+
+        rotated = file_path + ".log.1"
+        changes = {}
+        for key, item in FileStorage.__read_journal(rotated):
+            if item is None:
+                changes[key] = None
+            else:
+                changes[key] = "{}: {}".format(json.dumps(key),
+                                               json.dumps(item))
+        with open(file_path + ".tmp", "w") as file_0:
+            FileStorage.__dump_fragments(
+                file_0, FileStorage.__merge_snapshot(file_path, changes))
+        os.replace(file_path + ".tmp", file_path)
+        os.remove(rotated)
+
+    @staticmethod
+    def __merge_snapshot(file_path, changes):
+        """
+        Yields the records of a snapshot with the journal changes applied.
+
+        Snapshots written one record per line are streamed, so only the
+        changes are held in memory; other layouts are loaded whole.
+
+        Args:
+            file_path (str): Path of the snapshot file.
+            changes (dict): New fragment of each changed key, or None for
+                the deleted ones. Consumed by the merge.
+        """
+
+        decoder = json.JSONDecoder()
+        try:
+            with open(file_path) as file_0:
+                if file_0.readline() != "{\n":
+                    file_0.seek(0)
+                    lines = ("{}: {}".format(json.dumps(key), json.dumps(item))
+                             for key, item in json.load(file_0).items())
+                else:
+                    lines = (line.rstrip("\n").rstrip(",") for line in file_0)
+                for line in lines:
+                    if line in ("", "}"):
+                        continue
+                    key = decoder.raw_decode(line)[0]
+                    if key in changes:
+                        line = changes.pop(key)
+                    if line is not None:
+                        yield line
+        except FileNotFoundError:
+            pass
+        for line in changes.values():
+            if line is not None:
+                yield line
+
+    @staticmethod
+    def __dump_fragments(file_0, fragments):
+        """
+        Writes a JSON object holding one `"key": {...}` record per line.
+
+        Records are streamed through a buffer of about __buffer_size
+        characters, so the memory used does not depend on their number.
+
+        Args:
+            file_0 (file): The file to write to.
+            fragments (iterable): The encoded records.
+        """
 
+        chunk = ["{"]
+        buffered = 0
+        separator = "\n"
+        for fragment in fragments:
+            chunk.append(separator)
+            chunk.append(fragment)
+            separator = ",\n"
+            buffered += len(fragment)
+            if buffered >= FileStorage.__buffer_size:
+                file_0.write("".join(chunk))
+                chunk = []
+                buffered = 0
+        chunk.append("\n}\n")
+        file_0.write("".join(chunk))
@@ -0,0 +1,1169 @@
+#!/usr/bin/python3
+"""
+This module provides the secondary indexes FileStorage keeps up to date as
+objects are created, modified and destroyed.
+
+Every index exposes the same three hooks: `add` when an object enters the
+storage, `remove` when it leaves it and `refresh` after its attributes
+changed. `covers` tells which attributes call for a refresh.
+
+Attributes:
+    EARTH_RADIUS_KM (float): The mean radius of the Earth, in kilometers.
+    CHUNK_BITS (int): The number of slots covered by one bitmap chunk.
+    BYTE_BITS (list): The positions of the bits set in each byte value.
+    MERGE_THRESHOLD (int): The number of pending entries from which a sorted
+        list is re-sorted whole instead of inserted into one at a time.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from types import MappingProxyType
+import math
+import re
+
+EARTH_RADIUS_KM = 6371.0088
+CHUNK_BITS = 1 << 16
+MERGE_THRESHOLD = 16
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1)
+             for byte in range(256)]
+
+
+class HashIndex:
+    """
+    Maps each value of one attribute to the objects holding it.
+
+    Attributes:
+        attr (str): The indexed attribute.
+        __buckets (dict): The objects of each value, by id.
+        __values (dict): The value each indexed object was filed under.
+    """
+
+    def __init__(self, attr):
+        """
+        Creates an empty index.
+
+        Args:
+            attr (str): The attribute to index.
+        """
+
+        self.attr = attr
+        self.__buckets = {}
+        self.__values = {}
+
+    def add(self, obj):
+        """
+        Files an object under its current value.
+
+        Objects whose value cannot be hashed are left out.
+
+        Args:
+            obj: The object to index.
+        """
+
+        value = getattr(obj, self.attr, None)
+        try:
+            self.__buckets.setdefault(value, {})[obj.id] = obj
+        except TypeError:
+            return
+        self.__values[obj.id] = value
+
+    def remove(self, obj):
+        """
+        Removes an object from the index.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        if obj.id not in self.__values:
+            return
+        value = self.__values.pop(obj.id)
+        bucket = self.__buckets[value]
+        del bucket[obj.id]
+        if len(bucket) == 0:
+            del self.__buckets[value]
+
+    def refresh(self, obj):
+        """
+        Moves an object to the bucket of its new value, if it changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        value = getattr(obj, self.attr, None)
+        if obj.id in self.__values and self.__values[obj.id] == value:
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name == self.attr
+
+    def lookup(self, value):
+        """
+        Retrieves the objects holding a value.
+
+        Args:
+            value: The value to look for.
+
+        Returns:
+            mappingproxy: A read-only view of the matching objects, by id.
+        """
+
+        try:
+            return MappingProxyType(self.__buckets.get(value, {}))
+        except TypeError:
+            return MappingProxyType({})
+
+
+class SortedIndex:
+    """
+    Keeps the objects holding a numeric value of one attribute sorted by it.
+
+    Entries are (value, id) pairs kept sorted in a list, with their values
+    mirrored in a second list for bisecting on bounds, so that range scans
+    cost O(log n + k). New entries are buffered until the next read, so a
+    bulk load sorts once instead of inserting into the list every time.
+
+    Attributes:
+        attr (str): The indexed attribute.
+        __entries (list): The sorted (value, id) pairs.
+        __keys (list): The values of __entries, in the same order.
+        __pending (list): The (value, id) pairs not merged into __entries.
+        __objects (dict): The indexed objects, by id.
+        __values (dict): The value each indexed object was filed under.
+    """
+
+    def __init__(self, attr):
+        """
+        Creates an empty index.
+
+        Args:
+            attr (str): The attribute to index.
+        """
+
+        self.attr = attr
+        self.__entries = []
+        self.__keys = []
+        self.__pending = []
+        self.__objects = {}
+        self.__values = {}
+
+    def __len__(self):
+        """Returns the number of indexed objects"""
+
+        return len(self.__values)
+
+    def __settle(self):
+        """Merges the pending entries into the sorted lists"""
+
+        if len(self.__pending) == 0:
+            return
+        if len(self.__pending) < MERGE_THRESHOLD:
+            for entry in self.__pending:
+                position = bisect_left(self.__entries, entry)
+                self.__entries.insert(position, entry)
+                self.__keys.insert(position, entry[0])
+        else:
+            self.__entries.extend(self.__pending)
+            self.__entries.sort()
+            self.__keys = [entry[0] for entry in self.__entries]
+        self.__pending = []
+
+    def add(self, obj):
+        """
+        Files an object under its current value.
+
+        Objects whose value is not a number are left out.
+
+        Args:
+            obj: The object to index.
+        """
+
+        value = getattr(obj, self.attr, None)
+        if not isinstance(value, (int, float)):
+            return
+        self.__pending.append((value, obj.id))
+        self.__objects[obj.id] = obj
+        self.__values[obj.id] = value
+
+    def remove(self, obj):
+        """
+        Removes an object from the index.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        if obj.id not in self.__values:
+            return
+        self.__settle()
+        value = self.__values.pop(obj.id)
+        position = bisect_left(self.__entries, (value, obj.id))
+        del self.__entries[position]
+        del self.__keys[position]
+        del self.__objects[obj.id]
+
+    def refresh(self, obj):
+        """
+        Moves an object to the position of its new value, if it changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        value = getattr(obj, self.attr, None)
+        if obj.id in self.__values and self.__values[obj.id] == value:
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name == self.attr
+
+    def range(self, low=None, high=None, include_low=True, include_high=True,
+              reverse=False):
+        """
+        Iterates over the objects whose value lies between two bounds.
+
+        Args:
+            low: The lower bound, or None for no bound.
+            high: The upper bound, or None for no bound.
+            include_low (bool): Whether the lower bound itself matches.
+            include_high (bool): Whether the upper bound itself matches.
+            reverse (bool): Iterate from the highest value down.
+
+        Yields:
+            The matching objects, ordered by value.
+        """
+
+        self.__settle()
+        start, stop = 0, len(self.__keys)
+        if low is not None:
+            start = (bisect_left if include_low else bisect_right)(
+                self.__keys, low)
+        if high is not None:
+            stop = (bisect_right if include_high else bisect_left)(
+                self.__keys, high)
+        positions = range(start, stop)
+        if reverse:
+            positions = reversed(positions)
+        for position in positions:
+            yield self.__objects[self.__entries[position][1]]
+
+    def min(self):
+        """
+        Retrieves the object holding the lowest value.
+
+        Returns:
+            The object, or None if the index is empty.
+        """
+
+        self.__settle()
+        if len(self.__entries) == 0:
+            return None
+        return self.__objects[self.__entries[0][1]]
+
+    def max(self):
+        """
+        Retrieves the object holding the highest value.
+
+        Returns:
+            The object, or None if the index is empty.
+        """
+
+        self.__settle()
+        if len(self.__entries) == 0:
+            return None
+        return self.__objects[self.__entries[-1][1]]
+
+
+def haversine(lat_0, lon_0, lat_1, lon_1):
+    """
+    Computes the great-circle distance between two points.
+
+    Args:
+        lat_0 (float): The latitude of the first point, in degrees.
+        lon_0 (float): The longitude of the first point, in degrees.
+        lat_1 (float): The latitude of the second point, in degrees.
+        lon_1 (float): The longitude of the second point, in degrees.
+
+    Returns:
+        float: The distance, in kilometers.
+    """
+
+    lat_0, lon_0, lat_1, lon_1 = map(math.radians,
+                                     (lat_0, lon_0, lat_1, lon_1))
+    a = math.sin((lat_1 - lat_0) / 2) ** 2 + math.cos(lat_0) * \
+        math.cos(lat_1) * math.sin((lon_1 - lon_0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Files the objects holding a position in the cells of a uniform grid.
+
+    A search only visits the cells overlapping its area, then checks the
+    exact position of the objects found there.
+
+    Attributes:
+        lat_attr (str): The latitude attribute, in degrees.
+        lon_attr (str): The longitude attribute, in degrees.
+        cell_size (float): The side of a cell, in degrees.
+        __cells (dict): The objects of each (row, column) cell, by id.
+        __positions (dict): The position each indexed object was filed
+            under.
+    """
+
+    def __init__(self, lat_attr="latitude", lon_attr="longitude",
+                 cell_size=0.1):
+        """
+        Creates an empty index.
+
+        Args:
+            lat_attr (str): The latitude attribute.
+            lon_attr (str): The longitude attribute.
+            cell_size (float): The side of a cell, in degrees.
+        """
+
+        self.lat_attr = lat_attr
+        self.lon_attr = lon_attr
+        self.cell_size = cell_size
+        self.__cells = {}
+        self.__positions = {}
+
+    def __position(self, obj):
+        """
+        Retrieves the position of an object.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            tuple: The (latitude, longitude) pair, or None if either is not
+            a finite number.
+        """
+
+        lat = getattr(obj, self.lat_attr, None)
+        lon = getattr(obj, self.lon_attr, None)
+        if not isinstance(lat, (int, float)) or \
+                not isinstance(lon, (int, float)) or \
+                not math.isfinite(lat) or not math.isfinite(lon):
+            return None
+        return (lat, lon)
+
+    def __cell(self, lat, lon):
+        """
+        Computes the cell holding a position.
+
+        Args:
+            lat (float): The latitude.
+            lon (float): The longitude.
+
+        Returns:
+            tuple: The (row, column) of the cell.
+        """
+
+        return (math.floor(lat / self.cell_size),
+                math.floor(lon / self.cell_size))
+
+    def add(self, obj):
+        """
+        Files an object in the cell of its current position.
+
+        Objects whose coordinates are not numbers are left out.
+
+        Args:
+            obj: The object to index.
+        """
+
+        position = self.__position(obj)
+        if position is None:
+            return
+        self.__cells.setdefault(self.__cell(*position), {})[obj.id] = obj
+        self.__positions[obj.id] = position
+
+    def remove(self, obj):
+        """
+        Removes an object from the index.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        if obj.id not in self.__positions:
+            return
+        cell = self.__cell(*self.__positions.pop(obj.id))
+        del self.__cells[cell][obj.id]
+        if len(self.__cells[cell]) == 0:
+            del self.__cells[cell]
+
+    def refresh(self, obj):
+        """
+        Moves an object to the cell of its new position, if it changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        if self.__positions.get(obj.id) == self.__position(obj):
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name in (self.lat_attr, self.lon_attr)
+
+    def bbox(self, south, west, north, east):
+        """
+        Retrieves the objects inside a bounding box.
+
+        A box whose west edge lies east of its east edge crosses the
+        antimeridian.
+
+        Args:
+            south (float): The lowest latitude.
+            west (float): The western longitude.
+            north (float): The highest latitude.
+            east (float): The eastern longitude.
+
+        Returns:
+            list: The objects inside the box.
+        """
+
+        if west > east:
+            return self.bbox(south, west, north, 180.0) + \
+                self.bbox(south, -180.0, north, east)
+        found = []
+        for obj, (lat, lon) in self.__candidates(south, west, north, east):
+            if south <= lat <= north and west <= lon <= east:
+                found.append(obj)
+        return found
+
+    def within(self, lat, lon, radius_km):
+        """
+        Retrieves the objects within a distance of a point, nearest first.
+
+        Args:
+            lat (float): The latitude of the point.
+            lon (float): The longitude of the point.
+            radius_km (float): The distance, in kilometers.
+
+        Returns:
+            list: The objects found.
+        """
+
+        angle = radius_km / EARTH_RADIUS_KM
+        south = lat - math.degrees(angle)
+        north = lat + math.degrees(angle)
+        ratio = 1.0
+        if south > -90 and north < 90:
+            ratio = math.sin(angle) / math.cos(math.radians(lat))
+        if ratio >= 1.0:
+            boxes = [(max(south, -90.0), -180.0, min(north, 90.0), 180.0)]
+        else:
+            dlon = math.degrees(math.asin(ratio))
+            west = (lon - dlon + 180) % 360 - 180
+            east = (lon + dlon + 180) % 360 - 180
+            if west > east:
+                boxes = [(south, west, north, 180.0),
+                         (south, -180.0, north, east)]
+            else:
+                boxes = [(south, west, north, east)]
+        found = []
+        for box in boxes:
+            for obj, (obj_lat, obj_lon) in self.__candidates(*box):
+                distance = haversine(lat, lon, obj_lat, obj_lon)
+                if distance <= radius_km:
+                    found.append((distance, obj))
+        found.sort(key=lambda pair: pair[0])
+        return [obj for distance, obj in found]
+
+    def __candidates(self, south, west, north, east):
+        """
+        Iterates over the objects filed in the cells overlapping a box.
+
+        When the box spans more cells than are occupied, the occupied cells
+        are filtered instead.
+
+        Args:
+            south (float): The lowest latitude.
+            west (float): The western longitude.
+            north (float): The highest latitude.
+            east (float): The eastern longitude.
+
+        Yields:
+            tuple: Each object with its position.
+        """
+
+        row_0, column_0 = self.__cell(south, west)
+        row_1, column_1 = self.__cell(north, east)
+        if (row_1 - row_0 + 1) * (column_1 - column_0 + 1) > \
+                len(self.__cells):
+            cells = [bucket for (row, column), bucket in self.__cells.items()
+                     if row_0 <= row <= row_1 and
+                     column_0 <= column <= column_1]
+        else:
+            cells = [self.__cells[(row, column)]
+                     for row in range(row_0, row_1 + 1)
+                     for column in range(column_0, column_1 + 1)
+                     if (row, column) in self.__cells]
+        for bucket in cells:
+            for obj in bucket.values():
+                yield obj, self.__positions[obj.id]
+
+
+def tokenize(text):
+    """
+    Splits a text into lowercase word tokens.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        list: The tokens, in order.
+    """
+
+    return re.findall(r"\w+", text.lower())
+
+
+def parse_search(text):
+    """
+    Splits a full-text query into alternatives of terms.
+
+    Args:
+        text (str): The query.
+
+    Returns:
+        list: One list of terms for each alternative, terms ending with "*"
+        being prefixes.
+    """
+
+    groups = [[]]
+    for word in text.split():
+        if word == "OR":
+            groups.append([])
+        elif word != "AND":
+            prefix = word.endswith("*")
+            terms = tokenize(word)
+            if prefix and len(terms) > 0:
+                terms[-1] += "*"
+            groups[-1].extend(terms)
+    return [group for group in groups if len(group) > 0]
+
+
+class TextIndex:
+    """
+    Maps each word of some text attributes to the objects containing it.
+
+    The words are also kept in a sorted list, so that a prefix is matched
+    by bisecting to the first word starting with it. New words are buffered
+    until the next prefix match or word removal.
+
+    A query is made of terms, all of which must match, separated by "OR"
+    into alternatives; a term ending with "*" matches every word starting
+    with it. "AND" between terms is accepted and ignored.
+
+    Attributes:
+        attrs (list): The indexed attributes.
+        __postings (dict): The objects containing each word, by id.
+        __words (list): The indexed words, sorted.
+        __new_words (list): The words not merged into __words.
+        __terms (dict): The words each indexed object was filed under.
+    """
+
+    def __init__(self, attrs):
+        """
+        Creates an empty index.
+
+        Args:
+            attrs (list): The attributes to index.
+        """
+
+        self.attrs = list(attrs)
+        self.__postings = {}
+        self.__words = []
+        self.__new_words = []
+        self.__terms = {}
+
+    def __tokens(self, obj):
+        """
+        Collects the words of the indexed attributes of an object.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            set: The words.
+        """
+
+        words = set()
+        for attr in self.attrs:
+            value = getattr(obj, attr, None)
+            if isinstance(value, str):
+                words.update(tokenize(value))
+        return words
+
+    def add(self, obj):
+        """
+        Files an object under each word of its indexed attributes.
+
+        Args:
+            obj: The object to index.
+        """
+
+        words = self.__tokens(obj)
+        for word in words:
+            if word not in self.__postings:
+                self.__postings[word] = {}
+                self.__new_words.append(word)
+            self.__postings[word][obj.id] = obj
+        self.__terms[obj.id] = words
+
+    def remove(self, obj):
+        """
+        Removes an object from the index.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        for word in self.__terms.pop(obj.id, ()):
+            posting = self.__postings[word]
+            del posting[obj.id]
+            if len(posting) == 0:
+                del self.__postings[word]
+                self.__settle()
+                del self.__words[bisect_left(self.__words, word)]
+
+    def __settle(self):
+        """Merges the new words into the sorted list"""
+
+        if len(self.__new_words) == 0:
+            return
+        if len(self.__new_words) < MERGE_THRESHOLD:
+            for word in self.__new_words:
+                insort(self.__words, word)
+        else:
+            self.__words.extend(self.__new_words)
+            self.__words.sort()
+        self.__new_words = []
+
+    def refresh(self, obj):
+        """
+        Refiles an object if the words of its indexed attributes changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        if self.__terms.get(obj.id) == self.__tokens(obj):
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name in self.attrs
+
+    def match(self, term):
+        """
+        Retrieves the objects containing a word, or a word starting with a
+        prefix.
+
+        Args:
+            term (str): The word, or the prefix followed by "*".
+
+        Returns:
+            dict: The matching objects, by id.
+        """
+
+        if not term.endswith("*"):
+            return self.__postings.get(term, {})
+        self.__settle()
+        prefix = term[:-1]
+        found = {}
+        position = bisect_left(self.__words, prefix)
+        while position < len(self.__words) and \
+                self.__words[position].startswith(prefix):
+            found.update(self.__postings[self.__words[position]])
+            position += 1
+        return found
+
+    def search(self, text):
+        """
+        Retrieves the objects matching a query.
+
+        Args:
+            text (str): The query.
+
+        Returns:
+            dict: The matching objects, by id.
+        """
+
+        found = {}
+        for group in parse_search(text):
+            postings = sorted((self.match(term) for term in group), key=len)
+            matches = dict(postings[0])
+            for posting in postings[1:]:
+                matches = {obj_id: obj for obj_id, obj in matches.items()
+                           if obj_id in posting}
+                if len(matches) == 0:
+                    break
+            found.update(matches)
+        return found
+
+
+class BitmapIndex:
+    """
+    Keeps, for each element of a list attribute, a bitmap of the objects
+    whose list holds it.
+
+    Every indexed object gets a slot in a dense numbering, freed slots
+    being reused. Bitmaps are split into chunks of CHUNK_BITS slots stored
+    as bytearrays, so that setting a bit is done in place; chunks without
+    any bit set are dropped. Queries combine the chunks as integers and
+    count matches without building the objects.
+
+    Attributes:
+        attr (str): The indexed list attribute.
+        __slots (dict): The slot of each indexed object, by id.
+        __objects (list): The object in each slot, or None.
+        __free (list): The slots freed by removed objects.
+        __members (dict): The elements each indexed object was filed under.
+        __present (dict): The chunks of the bitmap of occupied slots.
+        __bitmaps (dict): The chunks of the bitmap of each element.
+        __sizes (dict): The number of objects holding each element.
+    """
+
+    def __init__(self, attr):
+        """
+        Creates an empty index.
+
+        Args:
+            attr (str): The list attribute to index.
+        """
+
+        self.attr = attr
+        self.__slots = {}
+        self.__objects = []
+        self.__free = []
+        self.__members = {}
+        self.__present = {}
+        self.__bitmaps = {}
+        self.__sizes = {}
+
+    def __len__(self):
+        """Returns the number of indexed objects"""
+
+        return len(self.__slots)
+
+    def __elements(self, obj):
+        """
+        Collects the hashable elements of the list attribute of an object.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            frozenset: The elements.
+        """
+
+        value = getattr(obj, self.attr, None)
+        if not isinstance(value, (list, tuple, set, frozenset)):
+            return frozenset()
+        elements = set()
+        for element in value:
+            try:
+                elements.add(element)
+            except TypeError:
+                pass
+        return frozenset(elements)
+
+    @staticmethod
+    def __set(chunks, slot):
+        """
+        Sets the bit of a slot.
+
+        Args:
+            chunks (dict): The chunks of a bitmap.
+            slot (int): The slot.
+        """
+
+        number, bit = divmod(slot, CHUNK_BITS)
+        if number not in chunks:
+            chunks[number] = bytearray(CHUNK_BITS // 8)
+        chunks[number][bit >> 3] |= 1 << (bit & 7)
+
+    @staticmethod
+    def __clear(chunks, slot):
+        """
+        Clears the bit of a slot, dropping its chunk once empty.
+
+        Args:
+            chunks (dict): The chunks of a bitmap.
+            slot (int): The slot.
+        """
+
+        number, bit = divmod(slot, CHUNK_BITS)
+        chunks[number][bit >> 3] &= ~(1 << (bit & 7))
+        if chunks[number].count(0) == CHUNK_BITS // 8:
+            del chunks[number]
+
+    def add(self, obj):
+        """
+        Gives an object a slot and sets it in the bitmap of each element of
+        its list.
+
+        Args:
+            obj: The object to index.
+        """
+
+        if len(self.__free) > 0:
+            slot = self.__free.pop()
+            self.__objects[slot] = obj
+        else:
+            slot = len(self.__objects)
+            self.__objects.append(obj)
+        self.__slots[obj.id] = slot
+        self.__set(self.__present, slot)
+        elements = self.__elements(obj)
+        for element in elements:
+            self.__set(self.__bitmaps.setdefault(element, {}), slot)
+            self.__sizes[element] = self.__sizes.get(element, 0) + 1
+        self.__members[obj.id] = elements
+
+    def remove(self, obj):
+        """
+        Removes an object from the index, freeing its slot.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        if obj.id not in self.__slots:
+            return
+        slot = self.__slots.pop(obj.id)
+        for element in self.__members.pop(obj.id):
+            self.__clear(self.__bitmaps[element], slot)
+            self.__sizes[element] -= 1
+            if self.__sizes[element] == 0:
+                del self.__bitmaps[element]
+                del self.__sizes[element]
+        self.__clear(self.__present, slot)
+        self.__objects[slot] = None
+        self.__free.append(slot)
+
+    def refresh(self, obj):
+        """
+        Refiles an object if the elements of its list changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        if self.__members.get(obj.id) == self.__elements(obj):
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name == self.attr
+
+    def __chunk(self, element, number):
+        """
+        Retrieves one chunk of the bitmap of an element as an integer.
+
+        Args:
+            element: The element.
+            number (int): The chunk number.
+
+        Returns:
+            int: The bits of the chunk.
+        """
+
+        chunk = self.__bitmaps.get(element, {}).get(number)
+        if chunk is None:
+            return 0
+        return int.from_bytes(chunk, "little")
+
+    def __evaluate(self, all_of, any_of, none_of):
+        """
+        Combines the bitmaps of a query, chunk by chunk.
+
+        Args:
+            all_of (iterable): Elements every match must hold.
+            any_of (iterable): Elements a match must hold at least one of.
+            none_of (iterable): Elements no match may hold.
+
+        Yields:
+            tuple: The number of each chunk holding matches, with the bits
+            of the matching slots.
+        """
+
+        all_of = sorted(set(all_of), key=lambda e: self.__sizes.get(e, 0))
+        any_of, none_of = set(any_of), set(none_of)
+        if len(all_of) > 0 and all_of[0] not in self.__sizes:
+            return
+        for number, present in self.__present.items():
+            bits = int.from_bytes(present, "little")
+            for element in all_of:
+                bits &= self.__chunk(element, number)
+                if bits == 0:
+                    break
+            if bits != 0 and len(any_of) > 0:
+                either = 0
+                for element in any_of:
+                    either |= self.__chunk(element, number)
+                bits &= either
+            for element in none_of:
+                if bits == 0:
+                    break
+                bits &= ~self.__chunk(element, number)
+            if bits != 0:
+                yield number, bits
+
+    def count(self, all_of=(), any_of=(), none_of=()):
+        """
+        Counts the objects matching a query without building them.
+
+        Args:
+            all_of (iterable): Elements every match must hold.
+            any_of (iterable): Elements a match must hold at least one of.
+            none_of (iterable): Elements no match may hold.
+
+        Returns:
+            int: The number of matches.
+        """
+
+        return sum(bin(bits).count("1") for number, bits in
+                   self.__evaluate(all_of, any_of, none_of))
+
+    def lookup(self, all_of=(), any_of=(), none_of=()):
+        """
+        Retrieves the objects matching a query, in slot order.
+
+        Args:
+            all_of (iterable): Elements every match must hold.
+            any_of (iterable): Elements a match must hold at least one of.
+            none_of (iterable): Elements no match may hold.
+
+        Returns:
+            list: The matching objects.
+        """
+
+        found = []
+        for number, bits in self.__evaluate(all_of, any_of, none_of):
+            base = number * CHUNK_BITS
+            data = bits.to_bytes(CHUNK_BITS // 8, "little")
+            for position, byte in enumerate(data):
+                if byte != 0:
+                    for bit in BYTE_BITS[byte]:
+                        found.append(self.__objects[base + position * 8 + bit])
+        return found
+
+
+class AggregateIndex:
+    """
+    Keeps the count of the objects of each group, and sums and averages
+    of numeric attributes over them, up to date.
+
+    Every object's contribution is remembered, so that removing or
+    changing it costs O(1) whatever the number of objects. Minimums and
+    maximums cannot be maintained that way and are not supported.
+
+    Attributes:
+        group_by (str): The attribute whose values form the groups, or None
+            for a single group.
+        metrics (list): The ("sum" or "avg", attribute) pairs maintained.
+        __groups (dict): The count and the [total, number of values] of
+            each metric, by group value.
+        __contributions (dict): The group and values each object was
+            counted with, by id.
+    """
+
+    def __init__(self, group_by=None, metrics=()):
+        """
+        Creates an empty aggregate.
+
+        Args:
+            group_by (str): The attribute whose values form the groups.
+            metrics (list): The (function, attribute) pairs to maintain.
+
+        Raises:
+            ValueError: If a function is neither "sum" nor "avg".
+        """
+
+        for function, attr in metrics:
+            if function not in ("sum", "avg"):
+                raise ValueError(
+                    "{} cannot be maintained incrementally".format(function))
+        self.group_by = group_by
+        self.metrics = list(metrics)
+        self.__groups = {}
+        self.__contributions = {}
+
+    def __contribution(self, obj):
+        """
+        Computes the group and values an object counts with.
+
+        Args:
+            obj: The object.
+
+        Returns:
+            tuple: The group value and the value of each metric, None for
+            values that are not numbers.
+        """
+
+        group = None
+        if self.group_by is not None:
+            group = getattr(obj, self.group_by, None)
+        values = []
+        for function, attr in self.metrics:
+            value = getattr(obj, attr, None)
+            values.append(value if isinstance(value, (int, float)) else None)
+        return group, tuple(values)
+
+    def add(self, obj):
+        """
+        Counts an object in its group.
+
+        Objects whose group value cannot be hashed are left out.
+
+        Args:
+            obj: The object to count.
+        """
+
+        group, values = self.__contribution(obj)
+        try:
+            state = self.__groups.get(group)
+        except TypeError:
+            return
+        if state is None:
+            state = self.__groups[group] = [0] + [[0, 0] for i in values]
+        state[0] += 1
+        for position, value in enumerate(values, 1):
+            if value is not None:
+                state[position][0] += value
+                state[position][1] += 1
+        self.__contributions[obj.id] = (group, values)
+
+    def remove(self, obj):
+        """
+        Removes an object from its group.
+
+        Args:
+            obj: The object to remove.
+        """
+
+        if obj.id not in self.__contributions:
+            return
+        group, values = self.__contributions.pop(obj.id)
+        state = self.__groups[group]
+        state[0] -= 1
+        if state[0] == 0:
+            del self.__groups[group]
+            return
+        for position, value in enumerate(values, 1):
+            if value is not None:
+                state[position][0] -= value
+                state[position][1] -= 1
+
+    def refresh(self, obj):
+        """
+        Moves an object's contribution if its group or values changed.
+
+        Args:
+            obj: The modified object.
+        """
+
+        if self.__contributions.get(obj.id) == self.__contribution(obj):
+            return
+        self.remove(obj)
+        self.add(obj)
+
+    def covers(self, name):
+        """
+        Tells whether an attribute feeds the index.
+
+        Args:
+            name (str): The attribute.
+
+        Returns:
+            bool: True if setting the attribute may move objects.
+        """
+
+        return name == self.group_by or \
+            any(name == attr for function, attr in self.metrics)
+
+    def results(self):
+        """
+        Retrieves the current metrics.
+
+        Returns:
+            dict: The metrics of each group, by group value, named "count"
+            and "<function>(<attribute>)".
+        """
+
+        results = {}
+        for group, state in self.__groups.items():
+            results[group] = {"count": state[0]}
+            for position, (function, attr) in enumerate(self.metrics, 1):
+                total, number = state[position]
+                if number == 0:
+                    value = None
+                elif function == "avg":
+                    value = total / number
+                else:
+                    value = total
+                results[group]["{}({})".format(function, attr)] = value
+        return results
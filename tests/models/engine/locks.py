@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+"""
+This module provides the reader-writer lock FileStorage runs its methods
+under in thread-safe mode.
+
+Methods are marked with the `reading` and `writing` decorators, which take
+the lock returned by the storage's `lock` method, if any.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import threading
+
+
+class RWLock:
+    """
+    Lets any number of readers, or a single writer, in at a time.
+
+    Waiting writers go before new readers, so a stream of readers cannot
+    starve them. Both sides are reentrant, and a thread holding the write
+    lock may also read; a thread holding only the read lock cannot start
+    writing.
+
+    Attributes:
+        __condition (threading.Condition): Guards the state below.
+        __readers (dict): The read holds of each thread, by thread id.
+        __writer (int): The id of the thread holding the write lock.
+        __writes (int): The write holds of that thread.
+        __waiting (int): The number of threads waiting to write.
+    """
+
+    def __init__(self):
+        """Initializes an unlocked lock."""
+
+        self.__condition = threading.Condition(threading.Lock())
+        self.__readers = {}
+        self.__writer = None
+        self.__writes = 0
+        self.__waiting = 0
+
+    def acquire_read(self):
+        """Waits until no writer holds or waits for the lock, then reads."""
+
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__writer != me and me not in self.__readers:
+                while self.__writer is not None or self.__waiting > 0:
+                    self.__condition.wait()
+            self.__readers[me] = self.__readers.get(me, 0) + 1
+
+    def release_read(self):
+        """Gives a read hold back."""
+
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__readers[me] > 1:
+                self.__readers[me] -= 1
+                return
+            del self.__readers[me]
+            if len(self.__readers) == 0:
+                self.__condition.notify_all()
+
+    def acquire_write(self):
+        """
+        Waits until nobody else holds the lock, then writes.
+
+        Raises:
+            RuntimeError: If the thread only holds the read lock.
+        """
+
+        me = threading.get_ident()
+        with self.__condition:
+            if self.__writer == me:
+                self.__writes += 1
+                return
+            if me in self.__readers:
+                raise RuntimeError("cannot upgrade a read lock")
+            self.__waiting += 1
+            try:
+                while self.__writer is not None or len(self.__readers) > 0:
+                    self.__condition.wait()
+            finally:
+                self.__waiting -= 1
+            self.__writer = me
+            self.__writes = 1
+
+    def release_write(self):
+        """Gives a write hold back."""
+
+        with self.__condition:
+            self.__writes -= 1
+            if self.__writes == 0:
+                self.__writer = None
+                self.__condition.notify_all()
+
+    @contextmanager
+    def reading(self):
+        """Holds the read lock for the duration of a with block."""
+
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def writing(self):
+        """Holds the write lock for the duration of a with block."""
+
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+
+def reading(method):
+    """
+    Runs a storage method under the read lock of the storage, if any.
+
+    Args:
+        method (function): The method.
+
+    Returns:
+        function: The wrapped method.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.lock()
+        if lock is None:
+            return method(self, *args, **kwargs)
+        with lock.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def writing(method):
+    """
+    Runs a storage method under the write lock of the storage, if any.
+
+    Args:
+        method (function): The method.
+
+    Returns:
+        function: The wrapped method.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self.lock()
+        if lock is None:
+            return method(self, *args, **kwargs)
+        with lock.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
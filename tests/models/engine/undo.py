@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""
+This module provides the undo log the storage engines build their
+transactions on.
+
+While a transaction is open, the engines record the pre-image of everything
+they are about to change: the value an attribute held before it was set,
+and the object a key held before an object was created or deleted under it.
+Rolling back replays those pre-images newest first.
+
+Attributes:
+    MISSING (object): The pre-image of an attribute or dirty mark that did
+        not exist.
+"""
+
+MISSING = object()
+
+
+class UndoLog:
+    """
+    Records pre-images, grouped by nested savepoints.
+
+    Attributes:
+        __entries (list): The pre-images, oldest first: ("attr", object,
+            name, value) and ("key", key, object, dirty mark) tuples.
+        __savepoints (list): The position in __entries each open savepoint
+            started at, outermost first.
+    """
+
+    def __init__(self):
+        """Initializes an empty log, outside of any transaction."""
+
+        self.__entries = []
+        self.__savepoints = []
+
+    def depth(self):
+        """
+        Tells how many savepoints are open.
+
+        Returns:
+            int: 0 outside of a transaction, 1 in a transaction, more in
+            nested savepoints.
+        """
+
+        return len(self.__savepoints)
+
+    def begin(self):
+        """
+        Opens a transaction, or a savepoint inside the open one.
+
+        Returns:
+            int: The new depth.
+        """
+
+        self.__savepoints.append(len(self.__entries))
+        return len(self.__savepoints)
+
+    def attr(self, obj, name):
+        """
+        Records the value of an attribute before it is set.
+
+        Args:
+            obj: The object about to change.
+            name (str): The attribute about to be set.
+        """
+
+        self.__entries.append(("attr", obj, name,
+                               obj.__dict__.get(name, MISSING)))
+
+    def key(self, key, obj, dirty):
+        """
+        Records what a key held before an object is created or deleted
+        under it.
+
+        Args:
+            key (str): The "<class>.<id>" key.
+            obj: The object the key held, or None.
+            dirty: The dirty mark of the key, or MISSING.
+        """
+
+        self.__entries.append(("key", key, obj, dirty))
+
+    def release(self):
+        """
+        Closes the innermost savepoint, keeping its changes.
+
+        Its pre-images are kept for the enclosing savepoints, and dropped
+        when the transaction itself is closed.
+
+        Returns:
+            bool: Whether the transaction itself was closed.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        if len(self.__savepoints) == 0:
+            raise ValueError("no transaction")
+        self.__savepoints.pop()
+        if len(self.__savepoints) == 0:
+            self.__entries = []
+            return True
+        return False
+
+    def undo(self):
+        """
+        Closes the innermost savepoint, handing back its pre-images.
+
+        Returns:
+            list: The pre-images recorded since the savepoint was opened,
+            newest first.
+
+        Raises:
+            ValueError: If no transaction is open.
+        """
+
+        if len(self.__savepoints) == 0:
+            raise ValueError("no transaction")
+        start = self.__savepoints.pop()
+        entries = self.__entries[start:]
+        del self.__entries[start:]
+        entries.reverse()
+        return entries
@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""Unittests for `models/engine/sqlite_storage.py`."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from models.engine.sqlite_storage import SQLiteStorage
+from models.city import City
+from models.place import Place
+from models.review import Review
+from models.state import State
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """Unittests for the SQLite storage engine"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "file.db")
+        patcher = patch.object(SQLiteStorage, "_SQLiteStorage__db_path",
+                               self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = SQLiteStorage()
+        self.storage.reload()
+        patcher = patch("models.storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        SQLiteStorage._SQLiteStorage__connection.close()
+        SQLiteStorage._SQLiteStorage__connection = None
+        shutil.rmtree(self.tmp_dir)
+
+    def test_walMode(self):
+        connection = sqlite3.connect(self.path)
+        mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+        connection.close()
+        self.assertEqual("wal", mode)
+
+    def test_saveAndGet(self):
+        place = Place()
+        place.name = "Loft"
+        place.price_by_night = 120
+        place.amenity_ids = ["wifi", "pool"]
+        place.pets = "yes"
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual({}, self.storage._SQLiteStorage__objects)
+        loaded = self.storage.get("Place", place.id)
+        self.assertIsNot(place, loaded)
+        self.assertEqual(place.to_dict(), loaded.to_dict())
+        self.assertIs(loaded, self.storage.get("Place", place.id))
+
+    def test_timestampWithoutMicroseconds(self):
+        place = Place()
+        place.created_at = datetime(2017, 9, 28, 21, 5, 54)
+        self.storage.save()
+        self.storage.reload()
+        loaded = self.storage.get("Place", place.id)
+        self.assertEqual(datetime(2017, 9, 28, 21, 5, 54), loaded.created_at)
+
+    def test_getMissing(self):
+        self.assertIsNone(self.storage.get("Place", "nope"))
+        self.assertIsNone(self.storage.get("Nope", "nope"))
+
+    def test_allLoadsEveryTable(self):
+        place = Place()
+        state = State()
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual({"Place." + place.id, "State." + state.id},
+                         set(self.storage.all()))
+
+    def test_allByClass(self):
+        place = Place()
+        State()
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual([place.id], list(self.storage.all("Place")))
+
+    def test_saveWritesOnlyChangedRows(self):
+        place = Place()
+        State()
+        self.storage.save()
+        place.name = "Loft"
+        with patch.object(State, "to_dict") as to_dict:
+            self.storage.save()
+        to_dict.assert_not_called()
+
+    def test_deleteUnloadedRow(self):
+        place = Place()
+        self.storage.save()
+        self.storage.reload()
+        self.storage.delete(self.storage.get("Place", place.id))
+        self.assertIsNone(self.storage.get("Place", place.id))
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual({}, self.storage.all())
+
+    def test_byIndex(self):
+        saved, changed, new = Place(), Place(), Place()
+        saved.city_id = changed.city_id = "c1"
+        self.storage.save()
+        self.storage.reload()
+        self.storage.get("Place", changed.id).city_id = "c2"
+        new.city_id = "c1"
+        self.storage.new(new)
+        self.assertEqual({saved.id, new.id},
+                         set(self.storage.by_index("Place", "city_id", "c1")))
+        with self.assertRaises(ValueError):
+            self.storage.by_index("Place", "name", "Loft")
+
+    def test_count(self):
+        places = [Place() for i in range(3)]
+        State()
+        self.storage.save()
+        self.storage.reload()
+        self.storage.delete(self.storage.get("Place", places[0].id))
+        self.storage.get("Place", places[1].id).name = "Loft"
+        Place()
+        with patch.object(SQLiteStorage, "_SQLiteStorage__load_table") as \
+                load:
+            self.assertEqual(3, self.storage.count("Place"))
+            self.assertEqual(4, self.storage.count())
+            self.assertEqual(0, self.storage.count("Nope"))
+        load.assert_not_called()
+
+    def test_deleteCascade(self):
+        state, city, place, review = State(), City(), Place(), Review()
+        city.state_id = state.id
+        place.city_id = city.id
+        review.place_id = place.id
+        self.storage.save()
+        self.storage.reload()
+        removed = self.storage.delete(self.storage.get("State", state.id),
+                                      cascade=True)
+        self.assertEqual(4, len(removed))
+        self.storage.save()
+        self.storage.reload()
+        self.assertEqual({}, self.storage.all())
+
+
+    def test_rollback(self):
+        place, state = Place(), State()
+        place.name = "Loft"
+        self.storage.save()
+        self.storage.reload()
+        self.storage.begin()
+        self.storage.get("Place", place.id).name = "Barn"
+        self.storage.delete(self.storage.get("State", state.id))
+        city = City()
+        self.storage.save()
+        self.storage.rollback()
+        self.assertEqual("Loft", self.storage.get("Place", place.id).name)
+        self.assertIsNotNone(self.storage.get("State", state.id))
+        self.assertIsNone(self.storage.get("City", city.id))
+        self.storage.begin()
+        self.storage.get("Place", place.id).name = "Barn"
+        self.storage.commit()
+        self.storage.reload()
+        self.assertEqual("Barn", self.storage.get("Place", place.id).name)
+
+
+if __name__ == "__main__":
+    unittest.main()